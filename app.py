@@ -1,23 +1,55 @@
+import importlib
 import streamlit as st
-from utils.io import load_data, LOCAL_PATH
-from utils.prep import normalize
-from sections import intro, overview, deep_dives, conclusions
+from utils.figcache import FIGURES
+from utils import trace
 from pathlib import Path
-import plotly.express as px
-from PIL import Image
+
+# Heavy modules (pandas, plotly, the sections) are imported after the title is sent,
+# geopandas/shapely only if the normalized tables have to be rebuilt.
+SECTIONS = {
+    "Intro": "intro",
+    "Overview": "overview",
+    "Detailed analysis": "deep_dives",
+    "Conclusions": "conclusions",
+}
 
 # --- CONFIG PAGE ---
 st.set_page_config(page_title="Vélib’ - Station capacities", layout="wide")
 
+
+trace.begin()
+figures_before = FIGURES.stats()
+
 # --- LOADING ---
-@st.cache_data(show_spinner=False)
-def get_tables(file_mtime: float, arr_mtime: float, com_mtime: float):
-    """Returns normalized tables. Cache depends on CSV timestamp."""
-    df_raw = load_data()
-    return normalize(df_raw)
+@st.cache_resource(show_spinner=False, max_entries=2)
+def get_tables(generation: str, file_mtime: float, arr_mtime: float, com_mtime: float):
+    """
+    Returns normalized tables, held once per process and shared (read-only) by every session.
+    Cached on the published generation key (utils.cache.current_generation), so every worker
+    swaps when any of them, the build step or the background refresh publishes new tables,
+    and on the input timestamps, so an edited CSV is published (load_tables resolves which).
+    """
+    from utils.cache import load_tables
+    from utils.mapbase import commune_palette
+
+    trace.annotate(cache="miss")
+    tables = dict(load_tables())
+    # The compact store is mapped from the artifact (utils.store), not rebuilt here
+    tables["stations"] = tables["store"].frame
+    tables["colors"] = commune_palette(tables["by_commune"]["commune_std"].unique())
+    return tables
+
+@st.cache_resource(show_spinner=False)
+def get_logo():
+    from PIL import Image
+
+    logo = Image.open(Path(__file__).resolve().parent / "assets" / "velib_logo.png")
+    logo.load()
+    return logo
 
 # --- TITRE ---
-logo = Image.open(Path(__file__).resolve().parent / "assets" / "velib_logo.png")
+with trace.span("logo"):
+    logo = get_logo()
 col1, col2 = st.columns([0.1, 0.9])  # smaller column for the logo
 with col1:
     st.image(logo, width=70)
@@ -25,54 +57,75 @@ with col2:
     st.title("Vélib’ - Where is station capacity most critical?")
 st.caption("Source : ParisData / data.gouv — Vélib’ Localisation & caractéristiques des stations.")
 
-# --- SIDEBAR ---
-with st.sidebar:
-    st.header("Filters")
+from utils.io import LOCAL_PATH, ARR_PATH, COM_PATH
+from utils.cache import current_generation
+from utils.refresh import start_refresher
 
+
+def _mtime(path: Path) -> float:
     try:
-        file_mtime = LOCAL_PATH.stat().st_mtime
-    except Exception:
-        file_mtime = 0
+        return path.stat().st_mtime
+    except OSError:
+        return 0
 
-    base_dir = Path(__file__).resolve().parent
-    data_dir = base_dir / "data"
-    arr_path = data_dir / "arrondissements.geojson"
-    com_path = data_dir / "communes-version-simplifiee.geojson"
 
-    try:
-        file_mtime = LOCAL_PATH.stat().st_mtime
-    except Exception:
-        file_mtime = 0
+def _inputs():
+    return _mtime(LOCAL_PATH), _mtime(ARR_PATH), _mtime(COM_PATH)
 
-    arr_mtime = arr_path.stat().st_mtime if arr_path.exists() else 0
-    com_mtime = com_path.stat().st_mtime if com_path.exists() else 0
 
-    tables = get_tables(file_mtime, arr_mtime, com_mtime)
+def _warm(published):
+    """Runs in the refresh thread: the next rerun finds the new tables in get_tables."""
+    get_tables(published["version"], *_inputs())
 
-    from utils.viz import set_commune_colors
-    communes = tables["by_commune"]["commune_std"].unique()
-    set_commune_colors(communes)
 
-    communes_all = tables["stations"]["commune_std"].dropna().unique().tolist()
-    show_commune_filter = [c for c in communes_all if c and c != "(Inconnu)"]
-    if show_commune_filter:
-        communes_sel = st.multiselect("Commune / Arrondissement", sorted(show_commune_filter), default=[])
-    else:
-        with st.expander("Aperçu de 'by_commune' (debug)"):
-            st.write(tables.get("by_commune"))
-        communes_sel = []
+# Downloads, normalizes and publishes new snapshots off the request path (utils.refresh)
+refresher = start_refresher(on_publish=_warm)
+
+
+# --- SIDEBAR ---
+# The commune filter lives in each page, inside the fragment of the charts it filters
+with st.sidebar:
+    with trace.span("get_tables", cache="hit"):
+        tables = get_tables(current_generation(), *_inputs())
 
     page = st.radio(
         "Sections",
-        ["Intro", "Overview", "Detailed analysis", "Conclusions"]
+        list(SECTIONS)
+    )
+
+    from sections.filters import station_search
+
+    with trace.span("station_search"):
+        station_search(tables)
+
+if trace.ENABLED:
+    with st.sidebar.expander("Figure cache"):
+        cache_stats = FIGURES.stats()
+        st.caption(
+            f"{cache_stats['hits']} hits / {cache_stats['misses']} misses "
+            f"({cache_stats['hit_rate']:.0%}) · {cache_stats['entries']} figures · "
+            f"{cache_stats['bytes'] / (1 << 20):.1f} / {cache_stats['max_bytes'] / (1 << 20):.0f} MB"
+        )
+
+with trace.span("render", page=page):
+    # Each section (and its plotting libraries) is imported on first navigation
+    section = importlib.import_module(f"sections.{SECTIONS[page]}")
+    section.render(tables)
+
+# --- DEBUG (VELIB_TRACE=1) ---
+if trace.ENABLED:
+    figures_after = FIGURES.stats()
+    spans = trace.end(
+        page=page,
+        figure_hits=figures_after["hits"] - figures_before["hits"],
+        figure_misses=figures_after["misses"] - figures_before["misses"],
     )
-    filters = {"communes": communes_sel}
-
-if page == "Intro":
-    intro.render(tables)
-elif page == "Overview":
-    overview.render(tables, filters)
-elif page == "Detailed analysis":
-    deep_dives.render(tables, filters)
-else:
-    conclusions.render(tables)
+    with st.sidebar.expander("Performance (debug)", expanded=False):
+        st.caption(f"Rerun: {spans[0]['ms']:.0f} ms · figure cache "
+                   f"{spans[0]['figure_hits']} hits / {spans[0]['figure_misses']} misses")
+        st.dataframe(
+            [{"stage": "  " * s["depth"] + s["name"], "ms": s["ms"],
+              "details": ", ".join(f"{k}={v}" for k, v in s.items() if k not in {"name", "depth", "ms", "start_ms"})}
+             for s in spans[1:]],
+            hide_index=True,
+        )
@@ -0,0 +1,247 @@
+"""
+Scaling benchmarks of the ingestion pipeline, the figure builders and the pages.
+
+    python -m bench.run                                  # 1k .. 1M stations -> bench/results.json
+    python -m bench.run --sizes 1000 10000 --out base.json
+    python -m bench.run --compare base.json              # exit code 1 on regression
+
+Each stage is timed (best of --repeat runs) then run once more under tracemalloc
+for its peak Python/NumPy allocation. Pages are rendered headlessly with
+Streamlit's AppTest, in a subprocess pointed at the synthetic CSV: each render also
+records the process peak RSS (memory-mapped tables included), and each rerun is
+repeated under tracemalloc. --compare checks times and both memory figures.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+PAGES = ["Intro", "Overview", "Detailed analysis", "Conclusions"]
+ROOT = Path(__file__).resolve().parents[1]
+# Regression slack below which differences are noise: (field, absolute slack)
+COMPARED = [("seconds", 0.01), ("peak_mb", 1.0), ("rss_mb", 16.0)]
+
+
+def measure(fn, repeat=3):
+    """(best wall time in seconds, peak traced allocation in MB, last result)"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak / (1 << 20), result
+
+
+def peak_rss_mb() -> float:
+    """High-water mark of this process' resident memory (ru_maxrss is in KB on Linux, bytes on macOS)."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1 << 20) if sys.platform == "darwin" else rss / (1 << 10)
+
+
+def pipeline_stages(csv_path: Path):
+    """(stage name, zero-argument callable) of the ingestion pipeline and figure builders."""
+    from utils import viz
+    from utils.io import load_data, iter_data
+    from utils.prep import normalize, normalize_batches, refresh, _standardize, assign_commune_geojson
+    from utils.cube import build_cube, box_stats, capacity_counts, zone_summary
+    from utils.spatial import nearest_neighbour, neighbourhood
+    from utils.raster import region, Coverage
+    from utils.optimize import optimize
+    from utils.ingest import normalize_files
+
+    raw = load_data(csv_path)
+    std = _standardize(raw.copy())
+    tables = normalize(raw.copy())
+    stations, by_com, cube = tables["stations"], tables["by_commune"], tables["cube"]
+    colors = viz.commune_palette(by_com["commune_std"].unique())
+
+    moved = raw.copy()
+    moved.iloc[0, moved.columns.get_loc("Coordonnées géographiques")] = "48.8566, 2.3522"
+
+    def map_figure():
+        if len(stations) <= viz.LOD_MAX_POINTS:
+            return viz.map_chart(stations, colors=colors)
+        return viz.map_cells_chart(viz.bin_stations(stations, 10), colors=colors)
+
+    return [
+        ("load_data", lambda: load_data(csv_path)),
+        ("iter_data+normalize_batches", lambda: normalize_batches(iter_data(csv_path))),
+        ("parse_columns", lambda: _standardize(raw.copy())),
+        ("assign_commune_geojson", lambda: assign_commune_geojson(std)),
+        ("normalize", lambda: normalize(raw.copy())),
+        ("normalize_files_16_tiles", lambda: normalize_files([csv_path], tiles=16)),
+        ("refresh_one_moved", lambda: refresh(tables, moved.copy())),
+        ("build_cube", lambda: build_cube(stations)),
+        ("nearest_neighbour", lambda: nearest_neighbour(stations["lat"], stations["lon"])),
+        ("neighbourhood_300m", lambda: neighbourhood(stations, 300)),
+        ("coverage_raster", lambda: Coverage(*region(), stations)),
+        ("optimize_1000_docks", lambda: optimize(Coverage(*region(), stations), stations, 1000)),
+        ("fig:map", map_figure),
+        ("fig:bar_commune", lambda: viz.bar_commune(by_com, topn=10, colors=colors)),
+        ("fig:bar_commune_capacity", lambda: viz.bar_commune_capacity(by_com, colors=colors)),
+        ("fig:hist_capacity", lambda: viz.hist_capacity(capacity_counts(cube))),
+        ("fig:box", lambda: viz.fig_box(*box_stats(cube), colors=colors)),
+        ("fig:pie_paris_suburbs", lambda: viz.fig_pie_paris_suburbs(zone_summary(cube))),
+        ("fig:pie_capacity_share", lambda: viz.fig_pie_capacity_share(by_com, colors=colors)),
+        ("fig:scatter", lambda: viz.fig_scatter_capacity_vs_stations(by_com, colors=colors)),
+    ]
+
+
+def bench_pipeline(csv_path: Path, n: int, repeat: int) -> list:
+    results = []
+    for stage, fn in pipeline_stages(csv_path):
+        seconds, peak_mb, out = measure(fn, repeat)
+        row = {"stage": stage, "n": n, "seconds": round(seconds, 6), "peak_mb": round(peak_mb, 3)}
+        if stage.startswith("fig:"):
+            row["payload_bytes"] = len(out.to_json())
+        results.append(row)
+        print(f"{n:>9} {stage:<30} {seconds * 1000:10.1f} ms {peak_mb:9.1f} MB", file=sys.stderr)
+    return results
+
+
+def bench_pages(csv_path: Path, n: int) -> list:
+    """Runs this module with --pages in a subprocess pointed at `csv_path`."""
+    with tempfile.TemporaryDirectory() as cache_dir:
+        env = {**os.environ, "VELIB_DATA_PATH": str(csv_path), "VELIB_CACHE_DIR": cache_dir}
+        out = subprocess.run(
+            [sys.executable, "-m", "bench.run", "--pages", str(n)],
+            cwd=ROOT, env=env, check=True, capture_output=True, text=True,
+        )
+    results = [json.loads(line) for line in out.stdout.splitlines() if line.startswith("{")]
+    for row in results:
+        peak = f"{row['peak_mb']:9.1f} MB" if "peak_mb" in row else " " * 12
+        print(f"{n:>9} {row['stage']:<30} {row['seconds'] * 1000:10.1f} ms {peak} {row['rss_mb']:9.1f} MB RSS",
+              file=sys.stderr)
+    return results
+
+
+def _traced(fn) -> float:
+    """Peak traced allocation of one call of `fn`, in MB."""
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1] / (1 << 20)
+    finally:
+        tracemalloc.stop()
+
+
+def run_pages(n: int):
+    """Subprocess side of bench_pages: one JSON line per measurement on stdout."""
+    import streamlit as st
+    from streamlit.testing.v1 import AppTest
+
+    from utils.figcache import FIGURES
+
+    app = str(ROOT / "app.py")
+    rows = {}
+
+    def record(stage, seconds):
+        rows[stage] = {"stage": stage, "n": n, "seconds": round(seconds, 6), "rss_mb": round(peak_rss_mb(), 3)}
+
+    at = AppTest.from_file(app, default_timeout=600)
+    start = time.perf_counter()
+    at.run()
+    record("page:cold_start", time.perf_counter() - start)
+
+    for page in PAGES:
+        start = time.perf_counter()
+        at.sidebar.radio[0].set_value(page).run()
+        seconds = time.perf_counter() - start
+        if at.exception:
+            raise RuntimeError(f"{page}: {at.exception[0].value}")
+        record(f"page:{page}", seconds)
+
+        # Same page again: what a widget interaction costs once everything is cached
+        seconds, peak_mb, _ = measure(at.run, repeat=1)
+        record(f"page:{page}:rerun", seconds)
+        rows[f"page:{page}:rerun"]["peak_mb"] = round(peak_mb, 3)
+
+    # Allocation peaks of the first renders, traced apart so the times above stay untraced
+    st.cache_data.clear()
+    st.cache_resource.clear()
+    FIGURES.clear()
+    at = AppTest.from_file(app, default_timeout=600)
+    rows["page:cold_start"]["peak_mb"] = round(_traced(at.run), 3)
+    for page in PAGES:
+        rows[f"page:{page}"]["peak_mb"] = round(_traced(at.sidebar.radio[0].set_value(page).run), 3)
+
+    for row in rows.values():
+        print(json.dumps(row))
+
+
+def compare(results: list, baseline_path: Path, tolerance: float) -> list:
+    """(row, field, baseline value) of every time or memory figure above `tolerance` x baseline, ignoring noise."""
+    baseline = {(r["stage"], r["n"]): r for r in json.loads(baseline_path.read_text())["results"]}
+    regressions = []
+    for row in results:
+        ref = baseline.get((row["stage"], row["n"]), {})
+        for field, slack in COMPARED:
+            if field in row and field in ref and row[field] > max(ref[field] * tolerance, ref[field] + slack):
+                regressions.append((row, field, ref[field]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--out", type=Path, default=ROOT / "bench" / "results.json")
+    parser.add_argument("--compare", type=Path, help="baseline results file to check against")
+    parser.add_argument("--tolerance", type=float, default=1.5)
+    parser.add_argument("--no-pages", action="store_true", help="skip the AppTest page renders")
+    parser.add_argument("--pages", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.pages is not None:
+        run_pages(args.pages)
+        return 0
+
+    from bench.synth import write_stations
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in args.sizes:
+            csv_path = write_stations(n, Path(tmp) / f"stations-{n}.csv")
+            results += bench_pipeline(csv_path, n, args.repeat)
+            if not args.no_pages:
+                results += bench_pages(csv_path, n)
+
+    report = {
+        "meta": {
+            "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "cpus": os.cpu_count(),
+        },
+        "results": results,
+    }
+    args.out.write_text(json.dumps(report, indent=1))
+    print(f"results written to {args.out}", file=sys.stderr)
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance)
+        for row, field, ref in regressions:
+            print(f"REGRESSION {row['stage']} n={row['n']} {field}: {row[field]:.4f} "
+                  f"(baseline {ref:.4f})", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
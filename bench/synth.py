@@ -0,0 +1,65 @@
+"""
+Synthetic Vélib-format station files for the benchmarks.
+
+    python -m bench.synth 100000 /tmp/stations-100k.csv
+"""
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from utils.io import ARR_PATH
+
+STREETS = ["Rue de l'Église", "Avenue Jean Jaurès", "Boulevard Saint-Germain", "Place de la République",
+           "Quai de Valmy", "Rue Oberkampf", "Avenue d'Italie", "Rue de Ménilmontant", "Gare de Lyon",
+           "Rue du Faubourg Saint-Antoine", "Parc de Bercy", "Porte d'Orléans"]
+
+
+def _area():
+    import geopandas as gpd
+
+    return shapely.union_all(gpd.read_file(ARR_PATH).to_crs("EPSG:4326").geometry.values)
+
+
+def random_points(n: int, seed: int = 0):
+    """n (lat, lon) points drawn uniformly inside the bundled arrondissement polygons."""
+    rng = np.random.default_rng(seed)
+    area = _area()
+    shapely.prepare(area)
+    min_x, min_y, max_x, max_y = area.bounds
+    lat, lon = np.empty(0), np.empty(0)
+    while lat.size < n:
+        k = int((n - lat.size) * 1.6) + 16  # the polygons fill ~70% of their bounding box
+        x = rng.uniform(min_x, max_x, k)
+        y = rng.uniform(min_y, max_y, k)
+        keep = shapely.contains_xy(area, x, y)
+        lat, lon = np.append(lat, y[keep]), np.append(lon, x[keep])
+    return lat[:n], lon[:n]
+
+
+def make_stations(n: int, seed: int = 0) -> pd.DataFrame:
+    """Raw stations with the data.gouv columns: ';' separated, 'lat, lon' coordinate strings."""
+    rng = np.random.default_rng(seed)
+    lat, lon = random_points(n, seed)
+    ids = rng.permutation(np.arange(1000, 1000 + 2 * n))[:n]
+    capacity = np.clip(np.round(rng.lognormal(np.log(30), 0.35, n)), 8, 80).astype(int)
+    streets = np.array(STREETS, dtype=object)[rng.integers(0, len(STREETS), n)]
+    return pd.DataFrame({
+        "Identifiant station": ids,
+        "Nom de la station": [f"{s} - {i}" for s, i in zip(streets, ids)],
+        "Capacité de la station": capacity,
+        "Coordonnées géographiques": [f"{a:.7f}, {b:.7f}" for a, b in zip(lat, lon)],
+        "station_opening_hours": "",
+    })
+
+
+def write_stations(n: int, path: Path, seed: int = 0) -> Path:
+    path = Path(path)
+    make_stations(n, seed).to_csv(path, sep=";", index=False, encoding="utf-8-sig")
+    return path
+
+
+if __name__ == "__main__":
+    write_stations(int(sys.argv[1]), Path(sys.argv[2]))
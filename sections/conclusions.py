@@ -1,5 +1,82 @@
 import streamlit as st
-from utils.viz import fig_pie_capacity_share, fig_scatter_capacity_vs_stations
+import pandas as pd
+from utils.viz import fig_pie_capacity_share, fig_scatter_capacity_vs_stations, map_recommendations
+from utils.cube import cell_metrics
+from utils.figcache import FIGURES
+from utils import trace
+
+
+@trace.fragment
+def _capacity_share(tables):
+    fig = FIGURES.figure(
+        fig_pie_capacity_share, tables["by_commune"], colors=tables["colors"], version=tables.get("version"),
+    )
+    trace.plotly_chart(fig, use_container_width=True)
+
+
+@trace.fragment
+def _capacity_vs_stations(tables):
+    fig = FIGURES.figure(
+        fig_scatter_capacity_vs_stations, tables["by_commune"], colors=tables["colors"], version=tables.get("version"),
+    )
+    trace.plotly_chart(fig, use_container_width=True)
+
+
+@trace.fragment
+def _optimizer_block(tables):
+    """Dock budget form and its result: submitting only reruns this block."""
+    from utils.optimize import STEP_DOCKS
+
+    with st.form("optimizer"):
+        c1, c2 = st.columns(2)
+        budget = c1.number_input("Dock budget", min_value=STEP_DOCKS, max_value=10_000, value=1_000, step=STEP_DOCKS)
+        minutes = c2.slider("Walking distance (minutes)", 2, 15, 5)
+        equity = st.checkbox("Favour arrondissements with fewer docks per km²", value=True)
+        submitted = st.form_submit_button("Find where to add docks")
+
+    if submitted:
+        from utils.optimize import optimize, equity_weights, commune_density
+        from utils.raster import get_coverage
+
+        with trace.span("optimize", budget=budget, minutes=minutes, equity=equity):
+            stations = tables["stations"]
+            coverage = get_coverage(stations, tables.get("version"))
+            if equity:
+                weights, density = equity_weights(coverage, stations)
+            else:
+                weights, density = None, commune_density(coverage, stations)[0]
+            st.session_state["optimizer_result"] = {
+                **optimize(coverage, stations, budget, minutes, weights), "minutes": minutes, "density": density,
+            }
+    result = st.session_state.get("optimizer_result")
+    if result is None:
+        return
+
+    st.caption(
+        f"Optimized in {result['seconds']:.2f} s · {result['candidates']:,} candidate sites in Paris · "
+        f"{result['evaluations']:,} gain evaluations"
+    )
+    picks = result["picks"]
+    c1, c2, c3 = st.columns(3)
+    c1.metric("Docks placed", f"{result['docks_added']:,}")
+    c2.metric("New stations", f"{int((picks['kind'] == 'New station').sum()):,}")
+    c3.metric(
+        f"Area without a dock within {result['minutes']} min",
+        f"{result['unserved_after']:.1%}",
+        delta=f"{result['unserved_after'] - result['unserved_before']:+.1%}",
+        delta_color="inverse",
+    )
+    if len(picks):
+        trace.plotly_chart(map_recommendations(picks), name="recommendations", use_container_width=True)
+        density = result["density"]
+        added = picks.groupby("commune")["docks_added"].sum().reindex(density.index, fill_value=0)
+        by_commune = pd.DataFrame({
+            "Docks added": added,
+            "Docks per km² (before)": density["docks_per_km2"].round(0),
+            "Docks per km² (after)": ((density["docks"] + added) / density["area_km2"]).round(0),
+        }).sort_values("Docks added", ascending=False)
+        st.dataframe(by_commune, use_container_width=True)
+
 
 def render(tables):
     """
@@ -15,11 +92,11 @@ def render(tables):
     """)
 
     # ----- Load and compute global statistics -----
-    df = tables["stations"]
     df_by_commune = tables["by_commune"]
+    m = cell_metrics(tables["cube"])
 
-    total_capacity = int(df["capacity_std"].sum())
-    avg_capacity = round(df["capacity_std"].mean(), 1)
+    total_capacity = int(m["capacity_total"])
+    avg_capacity = round(m["capacity_mean"], 1)
     top_commune = df_by_commune.loc[df_by_commune["capacity_total"].idxmax(), "commune_std"]
 
     st.markdown(f"""
@@ -37,8 +114,7 @@ def render(tables):
     highlighting a long-standing infrastructure concentration in central areas.
     """)
 
-    fig = fig_pie_capacity_share(df_by_commune)
-    st.plotly_chart(fig, use_container_width=True)
+    _capacity_share(tables)
 
     # ----- Analytical correlation: stations vs capacity -----
     st.subheader("Correlation between number of stations and total capacity")
@@ -50,8 +126,7 @@ def render(tables):
     reflecting infrastructure under-sizing relative to potential demand.
     """)
 
-    fig2 = fig_scatter_capacity_vs_stations(df_by_commune)
-    st.plotly_chart(fig2, use_container_width=True)
+    _capacity_vs_stations(tables)
 
     # ----- Summary -----
     st.markdown("""
@@ -62,6 +137,23 @@ def render(tables):
     - However, accessibility asymmetry persists between central and peripheral zones.
     """)
 
+    # ----- Optimized dock placement -----
+    st.markdown("### Where to add docks")
+    st.markdown("""
+    Given a budget of docks, the optimizer places them, 10 at a time, on existing stations or on
+    new sites, so as to maximize the docks reachable on foot from every 25 m cell of Paris.
+    The benefit grows with the logarithm of the docks within reach, so cells with little or no
+    supply are served first. There is no population data: by default, each cell is weighted by the
+    dock deficit of its arrondissement (up to twice the weight for the fewest docks per km² compared
+    with Paris as a whole), otherwise every cell counts the same. Parks count in both cases.
+
+    **Scope: Paris intra-muros only.** The grid is built from the arrondissements, so the suburban
+    communes are not part of the objective, and their stations are not candidates. This
+    places new docks within Paris. It is not a rebalancing of the whole network, and it does not
+    address the under-equipped outer communes listed above.
+    """)
+    _optimizer_block(tables)
+
     # ----- Strategic recommendations -----
     st.markdown("### Recommendations for city planners")
     st.markdown("""
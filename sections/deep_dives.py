@@ -1,21 +1,159 @@
 import streamlit as st
-import plotly.express as px
-from utils.viz import hist_capacity, fig_box, COMMUNE_COLORS
+from utils.viz import hist_capacity, fig_box, sample_stations, fig_neighbourhood, fig_trend
+from utils.figcache import FIGURES
+from utils import trace
+from utils.cube import select_cells, capacity_counts, box_stats
+from utils import history
+from sections.filters import commune_filter
 
-def render(tables, filters):
-    """Detailed station capacity analysis page"""
+SAMPLE_PER_COMMUNE = 30
+# Stations plotted per commune on the neighbourhood chart (statistics use all of them)
+NEIGHBOURHOOD_PER_COMMUNE = 200
+# Communes drawn as separate lines on the trend chart (beyond that, their sum)
+TREND_MAX_LINES = 12
 
-    # Filter data if user selected specific communes
-    df = tables["stations"]
-    if filters["communes"]:
-        df = df[df["commune_std"].isin(filters["communes"])]
 
-    # Title and context
-    st.title("Detailed analysis - Station capacity patterns")
-    st.markdown("""
-    This section explores how station capacities are distributed across communes and arrondissements.
-    It focuses on variability and concentration to identify areas with either limited or excessive docking capacity.
-    """)
+@st.cache_resource(show_spinner=False, max_entries=2)
+def _nearest(_stations, version):
+    """Nearest-neighbour distance of every station, once per data version (shared, read-only)."""
+    from utils.spatial import nearest_neighbour
+
+    return nearest_neighbour(_stations["lat"], _stations["lon"])
+
+
+@st.cache_resource(show_spinner=False, max_entries=16)
+def _within(_stations, version, radius_m):
+    """Docks and stations within `radius_m` of every station, once per (data version, radius)."""
+    from utils.spatial import neighbourhood
+
+    return neighbourhood(_stations, radius_m)
+
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def _trend(history_version, communes, start, end):
+    """Daily totals of the selection from the history aggregates, once per (history version, filters)."""
+    df = history.trend(communes, start, end)
+    if not communes or len(communes) > TREND_MAX_LINES:
+        df = df.groupby("date", as_index=False)[["stations", "capacity_total"]].sum()
+        df["commune_std"] = "All communes" if not communes else "Selected communes"
+    return df
+
+
+def _neighbourhood_rows(tables, communes, radius_m):
+    """Selected stations with their neighbourhood (computed over the whole network)."""
+    store = tables["store"]
+    rows = store.select(communes) if communes else None
+    df = store.take(rows)
+    within = _within(tables["stations"], tables.get("version"), radius_m)
+    nearest = _nearest(tables["stations"], tables.get("version"))
+    if rows is not None:
+        within, nearest = within.take(rows), nearest[rows]
+    return df.assign(
+        nn_m=nearest,
+        stations_within=within["stations_within"].to_numpy(),
+        docks_within=within["docks_within"].to_numpy(),
+        capacity_km2=within["capacity_km2"].to_numpy(),
+    )
+
+
+def _neighbourhood_figure(tables, communes, radius_m):
+    df = _neighbourhood_rows(tables, communes, radius_m)
+    return fig_neighbourhood(sample_stations(df, NEIGHBOURHOOD_PER_COMMUNE), radius_m, colors=tables["colors"])
+
+
+def _box_figure(tables, communes, with_sample):
+    """Box plot from the cube statistics, plus an optional capped sample of stations."""
+    stats, outliers = box_stats(select_cells(tables, communes))
+    sample = None
+    if with_sample:
+        store = tables["store"]
+        sample = sample_stations(store.take(store.select(communes) if communes else None), SAMPLE_PER_COMMUNE)
+    return fig_box(stats, outliers, sample, colors=tables["colors"])
+
+
+@trace.fragment
+def _box_block(tables, communes):
+    """Box plot and its sample checkbox: ticking it only reruns this block."""
+    with_sample = st.checkbox(f"Show a sample of stations (up to {SAMPLE_PER_COMMUNE} per commune)")
+    fig = FIGURES.figure(
+        _box_figure, tables, communes, with_sample,
+        filters={"communes": communes, "sample": with_sample}, version=tables.get("version"),
+    )
+    trace.plotly_chart(fig, use_container_width=True)
+
+
+@trace.fragment
+def _neighbourhood_block(tables, communes):
+    """Radius slider, density metrics, isolation chart and largest gaps: the slider only reruns this block."""
+    from utils.spatial import capacity_surface
+
+    radius = st.slider("Radius (m)", min_value=100, max_value=1500, value=300, step=50)
+    df = _neighbourhood_rows(tables, communes, radius)
+    if df.empty:
+        st.info("No station in the selection.")
+        return
+
+    surface = capacity_surface(df, cell_m=radius)
+    c1, c2, c3 = st.columns(3)
+    c1.metric("Median distance to the nearest station", f"{df['nn_m'].median():.0f} m")
+    c2.metric(f"Median docks within {radius} m", f"{df['docks_within'].median():.0f}")
+    c3.metric(f"Peak density ({radius} m cells)", f"{surface['capacity_km2'].max():,.0f} docks/km²")
+
+    fig = FIGURES.figure(
+        _neighbourhood_figure, tables, communes, radius,
+        filters={"communes": communes, "radius": radius}, version=tables.get("version"),
+    )
+    trace.plotly_chart(fig, use_container_width=True)
+
+    st.markdown("**Largest gaps** (stations farthest from any other one)")
+    gaps = df.nlargest(10, "nn_m")[["name_std", "commune_std", "capacity_std", "nn_m", "docks_within"]]
+    st.dataframe(
+        gaps.rename(columns={
+            "name_std": "Station", "commune_std": "Commune", "capacity_std": "Capacity",
+            "nn_m": "Nearest station (m)", "docks_within": f"Docks within {radius} m",
+        }).round(0),
+        hide_index=True, use_container_width=True,
+    )
+
+
+@trace.fragment
+def _trend_block(tables, communes):
+    """Capacity and station count over time (utils.history): the period slider only reruns this block."""
+    info = history.manifest()
+    if not info:
+        st.info("No snapshot history yet: add dated station CSVs with `python -m utils.history <files>`.")
+        return
+
+    first, last = info["first"], info["last"]
+    start, end = first, last
+    if first < last:
+        start, end = st.slider("Period", min_value=first, max_value=last, value=(first, last), format="YYYY-MM-DD")
+    shown = st.radio("Show", ["Docks", "Stations"], horizontal=True, key="trend-value")
+    value = "capacity_total" if shown == "Docks" else "stations"
+
+    key = tuple(sorted(communes))
+    df = _trend(info["version"], key, start, end)
+    if df.empty:
+        st.info("No snapshot of the selection in this period.")
+        return
+
+    totals = df.groupby("date")[value].sum()
+    c1, c2 = st.columns(2)
+    c1.metric(f"{shown} on {totals.index[-1]}", f"{totals.iloc[-1]:,}", delta=f"{totals.iloc[-1] - totals.iloc[0]:+,}")
+    c2.metric("Snapshots in history", f"{info['snapshots']:,}")
+
+    fig = FIGURES.figure(
+        fig_trend, df, value, colors=tables["colors"],
+        filters={"communes": communes, "start": start, "end": end, "value": value},
+        version=("history", info["version"]),
+    )
+    trace.plotly_chart(fig, use_container_width=True)
+
+
+@trace.fragment
+def _filtered_block(tables):
+    """Both charts depend on the commune filter: changing it reruns this block only."""
+    communes = commune_filter(tables, "deep_dives")
 
     # Histogram of station capacities
     st.markdown("### Distribution of station capacities")
@@ -24,7 +162,11 @@ def render(tables, filters):
     Most stations range between **20 and 35 docks**, with a few very large hubs in central Paris.
     """)
 
-    st.plotly_chart(hist_capacity(df), use_container_width=True)
+    fig = FIGURES.figure(
+        hist_capacity, capacity_counts(select_cells(tables, communes)),
+        filters={"communes": communes}, version=tables.get("version"),
+    )
+    trace.plotly_chart(fig, use_container_width=True)
 
     # Capacity distribution per commune (box plot)
     st.markdown("### Capacity variability by commune")
@@ -33,7 +175,40 @@ def render(tables, filters):
     Wider boxes indicate greater variability, while higher medians reveal better-equipped areas.
     """)
 
-    st.plotly_chart(fig_box(df), use_container_width=True)
+    _box_block(tables, communes)
+
+    # Local density and gaps (grid neighbour index, see utils.spatial)
+    st.markdown("### Local density and coverage gaps")
+    st.markdown("""
+    Communes are administrative units: what riders feel is the supply around them.
+    For each station, the chart compares the distance to its nearest neighbour with the
+    number of docks reachable within the chosen radius. Isolated, poorly supplied stations
+    sit at the bottom right.
+    """)
+
+    _neighbourhood_block(tables, communes)
+
+    # Trends from the snapshot history (utils.history)
+    st.markdown("### Capacity over time")
+    st.markdown("""
+    Daily docks and stations of the selected communes, from the archived snapshots.
+    The delta compares the last day of the period with the first one.
+    """)
+
+    _trend_block(tables, communes)
+
+
+def render(tables):
+    """Detailed station capacity analysis page"""
+
+    # Title and context
+    st.title("Detailed analysis - Station capacity patterns")
+    st.markdown("""
+    This section explores how station capacities are distributed across communes and arrondissements.
+    It focuses on variability and concentration to identify areas with either limited or excessive docking capacity.
+    """)
+
+    _filtered_block(tables)
 
     # Insight text section
     st.markdown("""
@@ -0,0 +1,55 @@
+import streamlit as st
+
+UNKNOWN = "(Inconnu)"  # utils.geo.UNKNOWN, not imported here: it pulls shapely
+SEARCH_RESULTS = 8
+
+
+def commune_filter(tables, page: str) -> list:
+    """
+    Commune / arrondissement multiselect of a page.
+    It is drawn inside the page's filtered fragment, so changing it only reruns the charts
+    that depend on it; the selection follows the user across pages (st.session_state["communes"]).
+    """
+    options = [c for c in tables["store"].communes if c and c != UNKNOWN]
+    if not options:
+        with st.expander("Aperçu de 'by_commune' (debug)"):
+            st.write(tables.get("by_commune"))
+        return []
+
+    previous = [c for c in st.session_state.get("communes", []) if c in options]
+    selected = st.multiselect("Commune / Arrondissement", options, default=previous, key=f"communes-{page}")
+    st.session_state["communes"] = selected
+    return selected
+
+
+@st.cache_resource(show_spinner=False, max_entries=2)
+def _station_index(_stations, version):
+    """Search index of the station names and communes, built once per data version."""
+    from utils.search import StationIndex
+
+    return StationIndex(_stations["name_std"], _stations["commune_std"])
+
+
+def station_search(tables):
+    """
+    Sidebar station search (accent- and case-insensitive, typo tolerant).
+    The chosen station is kept in st.session_state["focus_station"] as (data version, row)
+    and the Overview map zooms on it.
+    """
+    query = st.text_input("Find a station", key="station-query", placeholder="e.g. gare de l'est")
+    if not query.strip():
+        st.session_state["focus_station"] = None
+        return
+
+    rows = _station_index(tables["stations"], tables.get("version")).search(query, limit=SEARCH_RESULTS)
+    if not len(rows):
+        st.caption("No station found.")
+        st.session_state["focus_station"] = None
+        return
+
+    stations = tables["stations"]
+    labels = {
+        int(r): f"{stations['name_std'].iat[r]} · {stations['commune_std'].iat[r]}" for r in rows
+    }
+    choice = st.radio("Matches", list(labels), format_func=labels.get, label_visibility="collapsed")
+    st.session_state["focus_station"] = (tables.get("version"), choice)
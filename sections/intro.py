@@ -1,8 +1,26 @@
 import streamlit as st
 import plotly.express as px
 from utils.viz import bar_commune, fig_pie_paris_suburbs
+from utils.cube import zone_summary
+from utils.figcache import FIGURES
+from utils import trace
 import pandas as pd
 
+
+@trace.fragment
+def _zone_pie(tables):
+    fig_pie = FIGURES.figure(fig_pie_paris_suburbs, zone_summary(tables["cube"]), version=tables.get("version"))
+    trace.plotly_chart(fig_pie, use_container_width=True)
+
+
+@trace.fragment
+def _top_communes(tables):
+    fig_bar = FIGURES.figure(
+        bar_commune, tables["by_commune"], topn=10, colors=tables["colors"], version=tables.get("version"),
+    )
+    trace.plotly_chart(fig_bar, use_container_width=True)
+
+
 def render(tables):
     """Introduction page of the Velib dashboard"""
 
@@ -39,23 +57,14 @@ def render(tables):
     # Pie chart: Paris vs Suburbs
     st.markdown("### Paris vs Suburbs - Number of Stations")
 
-    df = tables["stations"].copy()
-    df["zone"] = df["commune_std"].apply(
-        lambda x: "Paris" if "Paris" in str(x) else "Suburbs"
-    )
-    summary = df.groupby("zone", dropna=False)["id_std"].count().reset_index()
-    summary = summary.rename(columns={"id_std": "stations"})
-
-    fig_pie = fig_pie_paris_suburbs(tables["stations"])
-    st.plotly_chart(fig_pie, use_container_width=True)
+    _zone_pie(tables)
 
     st.caption("Paris includes all arrondissements, 'Suburbs' refers to the surrounding communes (92, 93, 94, etc.).")
 
     # Bar chart: Top 10 communes by total capacity
     st.markdown("### Top 10 communes/arrondissements by total capacity")
 
-    fig_bar = bar_commune(by_com, topn=10)
-    st.plotly_chart(fig_bar, use_container_width=True)
+    _top_communes(tables)
 
     st.markdown("""
     The ranking highlights that Paris arrondissements dominate the total docking capacity.
@@ -1,22 +1,186 @@
 import streamlit as st
-import plotly.express as px
-from utils.viz import map_chart, bar_commune, COMMUNE_COLORS
+import pandas as pd
+from utils.viz import (
+    map_chart, map_cells_chart, bin_stations, bin_cells, in_viewport, bar_commune_capacity, add_image_overlay,
+    add_focus_marker, add_cells,
+    LOD_MAX_POINTS, LOD_POINT_ZOOM, LOD_PAD, LOD_OUTER_STEP,
+)
+from utils.figcache import FIGURES
+from utils import trace
+from utils.deck import MAP_BACKEND, DECK_LAYERS
+from utils.cube import select_cells, cell_metrics
+from utils.live import STATUS_URL, POLL_SECONDS, STALE_AFTER, NEAR_EMPTY_BIKES, NEAR_FULL_DOCKS, get_poller, critical_by_commune
+from sections.filters import commune_filter
 
-def render(tables, filters):
-    """Overview page showing general network patterns"""
 
-    # Data filtering based on selected communes
-    df = tables["stations"]
-    if filters["communes"]:
-        df = df[df["commune_std"].isin(filters["communes"])]
+@st.cache_data(show_spinner=False, max_entries=32)
+def _lod_cells(_stations, version, zoom):
+    """Binned layer of the whole network for one zoom level, computed once per data version."""
+    return bin_stations(_stations, zoom)
 
-    # Key metrics
-    c1, c2, c3, c4 = st.columns(4)
-    c1.metric("Stations", f"{df.shape[0]:,}")
-    c2.metric("Total capacity", f"{int(df['capacity_std'].sum()):,}")
-    c3.metric("Median capacity", f"{int(df['capacity_std'].median()) if len(df) else 0}")
+
+# Map zoom when a station is picked in the sidebar search
+FOCUS_ZOOM = 15
+
+COVERAGE_LAYERS = ["Walk to the nearest station", "Docks within walking distance"]
+WALK_MINUTES_MAX = 10  # colour scale of the walking-time layer (red at and above)
+
+
+@st.cache_resource(show_spinner=False, max_entries=16)
+def _coverage_image(_stations, version, layer, minutes):
+    """(PNG, bounds) of a coverage layer, once per data version and setting."""
+    import numpy as np
+    from utils.raster import image, get_coverage
+
+    coverage = get_coverage(_stations, version)
+    if layer == COVERAGE_LAYERS[0]:
+        png = image(coverage.walk_minutes(), 0, WALK_MINUTES_MAX, reverse=True)
+    else:
+        docks = coverage.docks_within(minutes)
+        png = image(docks, 0, max(float(np.nanpercentile(docks, 95)), 1.0))
+    return png, coverage.grid.bounds
+
+
+def _focus(tables):
+    """Row of the station picked in the sidebar search (None, or a row of another data version)."""
+    focus = st.session_state.get("focus_station")
+    if not focus or focus[0] != tables.get("version"):
+        return None
+    return focus[1]
+
+
+def _station_map(tables, communes, zoom, focus=None):
+    """Individual stations when few enough (or zoomed in), binned cells otherwise; centered on `focus` if any."""
+    fig = _station_layer(tables, communes, zoom, focus)
+    if focus is not None:
+        station = tables["stations"].iloc[focus]
+        add_focus_marker(fig, float(station["lat"]), float(station["lon"]), str(station["name_std"]))
+    return fig
+
+
+def _station_layer(tables, communes, zoom, focus=None):
+    store, colors = tables["store"], tables["colors"]
+    df = store.take(store.select(communes) if communes else None)
+    if focus is not None:
+        station = tables["stations"].iloc[focus]
+        center = {"lat": float(station["lat"]), "lon": float(station["lon"])}
+    elif df.empty:
+        return map_chart(df, zoom, colors=colors)
+    else:
+        center = {"lat": float(df["lat"].mean()), "lon": float(df["lon"].mean())}
+    if len(df) <= LOD_MAX_POINTS:
+        return map_chart(df, zoom, center, colors=colors)
+    # Full detail around the visible area, coarser cells beyond it: nothing is dropped
+    outer_zoom = max(zoom - LOD_OUTER_STEP, 0)
+    if zoom >= LOD_POINT_ZOOM:
+        near = in_viewport(df["lat"], df["lon"], center, zoom, pad=LOD_PAD)
+        fig = map_chart(df[near], zoom, center, colors=colors)
+        return add_cells(fig, bin_stations(df[~near], outer_zoom), colors)
+
+    version = tables.get("version")
+    if version is None:
+        cells = bin_stations(df, zoom)
+    else:
+        cells = _lod_cells(tables["stations"], version, zoom)
+        if communes:
+            cells = cells[cells["commune_std"].isin(communes)]
+    near = in_viewport(cells["lat"], cells["lon"], center, zoom, pad=LOD_PAD)
+    cells = pd.concat([cells[near], bin_cells(cells[~near], outer_zoom)], ignore_index=True)
+    return map_cells_chart(cells, zoom, center, colors=colors)
+
+
+@trace.fragment
+def _station_map_block(tables, communes):
+    """Map controls + map: moving the zoom slider (or the layer radio) only reruns this block."""
+    store = tables["store"]
+
+    overlay = None
+    if st.toggle("Accessibility layer (25 m grid over Paris)"):
+        c1, c2 = st.columns([0.6, 0.4])
+        layer = c1.radio("Coverage", COVERAGE_LAYERS, horizontal=True)
+        minutes = c2.slider("Walking minutes", 1, 15, 5, disabled=layer == COVERAGE_LAYERS[0])
+        with trace.span("coverage", layer=layer, minutes=minutes):
+            overlay = _coverage_image(tables["stations"], tables.get("version"), layer, minutes)
+        if layer == COVERAGE_LAYERS[0]:
+            st.caption(f"Walking time to the nearest station: green = close, red = {WALK_MINUTES_MAX} min or more.")
+        else:
+            st.caption(f"Docks reachable within {minutes} min on foot: red = few, green = many.")
+
+    focus = _focus(tables)
+    if MAP_BACKEND == "pydeck":
+        from utils.deck import deck_map
+
+        layer = st.radio("Map layer", DECK_LAYERS, horizontal=True)
+        df = store.take(store.select(communes) if communes else None)
+        kwargs = {}
+        if focus is not None:
+            lat, lon = (float(tables["stations"][c].iat[focus]) for c in ("lat", "lon"))
+            kwargs = {"zoom": FOCUS_ZOOM, "center": {"lat": lat, "lon": lon}, "focus": (lat, lon)}
+        st.pydeck_chart(deck_map(df, layer, colors=tables["colors"], overlay=overlay, **kwargs), use_container_width=True)
+    else:
+        # A new search pick zooms in; the slider stays free afterwards
+        st.session_state.setdefault("map-zoom", 10)
+        if focus is not None and st.session_state.get("map-focus") != focus:
+            st.session_state["map-zoom"] = max(st.session_state["map-zoom"], FOCUS_ZOOM)
+        st.session_state["map-focus"] = focus
+        zoom = st.slider("Map zoom", min_value=9, max_value=16, key="map-zoom")
+        shown = len(store.select(communes)) if communes else len(store)
+        if shown > LOD_MAX_POINTS and zoom < LOD_POINT_ZOOM:
+            st.caption("Stations are grouped by area at this zoom level (marker size = total capacity).")
+        fig = FIGURES.figure(
+            _station_map, tables, communes, zoom, focus,
+            filters={"communes": communes, "zoom": zoom, "focus": focus}, version=tables.get("version"),
+        )
+        if overlay is not None:
+            fig = add_image_overlay(fig, *overlay)
+        trace.plotly_chart(fig, use_container_width=True)
+
+
+@trace.fragment(run_every=POLL_SECONDS if STATUS_URL else None)
+def _live_block(tables, communes):
+    """Occupancy from the live feed (utils.live): reruns on its own at the polling interval."""
+    poller = get_poller()
+    if poller is None:
+        return
+    poller.attach(tables["stations"]["id_std"], tables.get("version"))
+    latest = poller.latest()
+    if latest is None:
+        error = poller.status()["last_error"]
+        st.caption("Live status: waiting for the feed" + (f" ({error.split(':')[0]}, retrying)." if error else "."))
+        return
+
+    crit = critical_by_commune(latest, tables["store"], communes)
+    age = poller.status()["age_s"]
+    c1, c2, c3 = st.columns(3)
+    c1.metric("Reporting stations", f"{crit['reporting'].sum():,}")
+    c2.metric(f"Near empty (≤ {NEAR_EMPTY_BIKES} bikes)", f"{crit['near_empty'].sum():,}")
+    c3.metric(f"Near full (≤ {NEAR_FULL_DOCKS} free docks)", f"{crit['near_full'].sum():,}")
+    stale = " (stale)" if age > STALE_AFTER * POLL_SECONDS else ""
+    st.caption(f"Live feed updated {age:.0f} s ago{stale}, refreshed every {POLL_SECONDS:.0f} s.")
+    with st.expander("Critical stations by commune"):
+        st.dataframe(
+            crit.head(15).rename(columns={
+                "commune_std": "Commune", "reporting": "Reporting",
+                "near_empty": "Near empty", "near_full": "Near full",
+            }),
+            hide_index=True, use_container_width=True,
+        )
+
+
+@trace.fragment
+def _filtered_block(tables):
+    """Everything that depends on the commune filter: changing it reruns this block only."""
+    communes = commune_filter(tables, "overview")
+
+    # Key metrics (from the pre-aggregated cube, not the station rows)
     low_thr = tables["stats"]["quantiles"].get(0.1, None)
-    c4.metric("Stations below 10th percentile", f"{int((df['capacity_std'] < low_thr).sum()) if low_thr else 0:,}")
+    m = cell_metrics(select_cells(tables, communes), low_thr)
+    c1, c2, c3, c4 = st.columns(4)
+    c1.metric("Stations", f"{m['stations']:,}")
+    c2.metric("Total capacity", f"{int(m['capacity_total']):,}")
+    c3.metric("Median capacity", f"{int(m['capacity_median']) if m['stations'] else 0}")
+    c4.metric("Stations below 10th percentile", f"{m['below'] if low_thr else 0:,}")
+    _live_block(tables, communes)
 
     # Section introduction
     st.markdown("### Network overview")
@@ -31,7 +195,22 @@ def render(tables, filters):
     Each point represents a station, colored by its commune or arrondissement.
     Larger clusters of points indicate higher local density.
     """)
-    st.plotly_chart(map_chart(df), use_container_width=True)
+    _station_map_block(tables, communes)
+
+
+@trace.fragment
+def _capacity_block(tables):
+    """Unfiltered bar chart of every commune: not redrawn when the filter changes."""
+    fig = FIGURES.figure(
+        bar_commune_capacity, tables["by_commune"], colors=tables["colors"], version=tables.get("version"),
+    )
+    trace.plotly_chart(fig, use_container_width=True)
+
+
+def render(tables):
+    """Overview page showing general network patterns"""
+
+    _filtered_block(tables)
 
     # Capacity distribution chart
     st.markdown("### Capacity distribution across communes")
@@ -40,32 +219,7 @@ def render(tables, filters):
     It reveals where the largest portions of the network are concentrated.
     """)
 
-    df_communes = tables["by_commune"].sort_values("capacity_total", ascending=False)
-
-    fig = px.bar(
-        df_communes,
-        x="commune_std",
-        y="capacity_total",
-        text_auto=".2s",
-        color="commune_std",
-        color_discrete_map=COMMUNE_COLORS,
-        hover_name="commune_std",
-        hover_data={"capacity_total": True}
-    )
-
-    # Improved visual spacing for readability
-    fig.update_layout(
-        xaxis_title="Commune or arrondissement",
-        yaxis_title="Total docking capacity",
-        showlegend=False,
-        bargap=0.35,  # increased spacing for better readability
-        plot_bgcolor="rgba(0,0,0,0)",
-        paper_bgcolor="rgba(0,0,0,0)",
-        font=dict(color="white"),
-    )
-    fig.update_traces(marker_line_width=0.5, marker_line_color="rgba(255,255,255,0.3)")
-
-    st.plotly_chart(fig, use_container_width=True)
+    _capacity_block(tables)
 
     # Commentary section
     st.markdown("""
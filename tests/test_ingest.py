@@ -0,0 +1,66 @@
+import pandas as pd
+import pytest
+
+from utils.ingest import normalize_files, tile_of
+from utils.io import load_data
+from utils.prep import normalize
+
+COLUMNS = ["Identifiant station", "Nom de la station", "Capacité de la station", "Coordonnées géographiques"]
+STATIONS = [
+    (1, "Châtelet", 30, "48.8584, 2.3470"),
+    (2, "République", 40, "48.8675, 2.3637"),
+    (3, "Bastille", 24, "48.8532, 2.3692"),
+    (4, "Montparnasse", 52, "48.8422, 2.3211"),
+    (5, "Nation", 36, "48.8483, 2.3959"),
+    (6, "Trocadéro", 20, "48.8629, 2.2873"),
+    (7, "Hors Paris", 18, "48.8100, 2.1200"),
+    (8, "Sans capacité", None, "48.8566, 2.3522"),
+    (9, "Gare de Lyon", 44, "48.8443, 2.3744"),
+    (10, "Sans coordonnées", 12, None),
+    (11, "Place d'Italie", 28, "48.8310, 2.3555"),
+    (12, "Pigalle", 30, "48.8821, 2.3372"),
+]
+
+
+@pytest.fixture
+def files(tmp_path):
+    """The stations split in two CSV files, in the format of the Vélib export."""
+    paths = []
+    for i, rows in enumerate([STATIONS[:7], STATIONS[7:]]):
+        path = tmp_path / f"operator-{i}.csv"
+        df = pd.DataFrame(rows, columns=COLUMNS).astype({"Capacité de la station": "Int64"})
+        df.to_csv(path, sep=";", index=False)
+        paths.append(path)
+    return paths
+
+
+def _same_tables(a: dict, b: dict):
+    pd.testing.assert_frame_equal(
+        a["stations"].reset_index(drop=True), b["stations"].reset_index(drop=True), check_dtype=False
+    )
+    by_a, by_b = (
+        t["by_commune"].astype({"commune_std": str}).sort_values("commune_std").reset_index(drop=True) for t in (a, b)
+    )
+    pd.testing.assert_frame_equal(by_a, by_b, check_dtype=False)
+    cube_a, cube_b = (t["cube"].astype({"commune_std": str}).reset_index(drop=True) for t in (a, b))
+    pd.testing.assert_frame_equal(cube_a, cube_b, check_dtype=False)
+    assert a["stats"] == b["stats"]
+    assert sorted(a["sketches"]) == sorted(b["sketches"])
+
+
+def _reference(paths) -> dict:
+    return normalize(pd.concat([load_data(p) for p in paths], ignore_index=True))
+
+
+@pytest.mark.parametrize("tiles", [None, 4])
+def test_normalize_files_matches_normalize(files, tiles):
+    _same_tables(normalize_files(files, workers=1, tiles=tiles), _reference(files))
+
+
+def test_normalize_files_on_a_process_pool(files):
+    _same_tables(normalize_files(files, workers=2), _reference(files))
+
+
+def test_tile_of_keeps_points_on_the_grid():
+    tiles = tile_of([48.80, 48.84, 48.86, 48.90, float("nan")], [2.20, 2.30, 2.40, 2.50, 2.30], 4)
+    assert tiles.tolist() == [0, 0, 3, 3, 0]  # 2 x 2 grid, no coordinates -> tile 0
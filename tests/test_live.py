@@ -0,0 +1,131 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pytest
+import requests
+
+from utils.live import MISSING, StatusBuffer, StatusPoller, parse_status
+
+
+def _feed(bikes: dict, ts: int = 1_700_000_000) -> dict:
+    return {
+        "last_updated": ts,
+        "data": {"stations": [
+            {"stationCode": code, "num_bikes_available": b, "num_docks_available": 10 - b}
+            for code, b in bikes.items()
+        ]},
+    }
+
+
+def test_buffer_wraps_around_and_keeps_the_newest_samples():
+    buffer = StatusBuffer(stations=3, depth=2)
+    assert buffer.latest() is None
+    for t in range(3):
+        buffer.record(np.array([0, 2]), np.array([t, 10 + t]), np.array([5, 5]), float(t))
+
+    ts, bikes, _ = buffer.window()
+    assert len(buffer) == 2
+    assert ts.tolist() == [1.0, 2.0]
+    assert bikes[:, 0].tolist() == [1, 2]
+    assert bikes[:, 1].tolist() == [MISSING, MISSING]  # station 1 never reported
+    assert buffer.latest()[1].tolist() == [2, MISSING, 12]
+
+
+def test_parse_status_reads_station_codes_and_missing_counts():
+    payload = {"last_updated": 42, "data": {"stations": [
+        {"stationCode": "16107", "num_bikes_available": 3, "num_docks_available": 7},
+        {"station_id": 213688169, "num_bikes_available": 0},
+    ]}}
+    codes, bikes, docks, ts = parse_status(payload)
+    assert codes == ["16107", "213688169"]
+    assert bikes.tolist() == [3, 0]
+    assert docks.tolist() == [7, MISSING]
+    assert ts == 42.0
+
+
+def test_attach_reindexes_samples_on_a_new_station_table():
+    poller = StatusPoller(url="http://unused", depth=4)
+    poller.attach(["a", "b", "c"], version="v1")
+    assert poller.ingest(_feed({"a": 1, "b": 2, "c": 3, "unknown": 4})) == 3
+
+    # "b" removed, "d" added, order changed: samples follow the ids
+    poller.attach(["c", "d", "a"], version="v2")
+    _, bikes, _ = poller.latest()
+    assert bikes.tolist() == [3, MISSING, 1]
+
+    poller.attach(["x"], version="v2")  # same version: unchanged
+    assert poller.latest()[1].tolist() == [3, MISSING, 1]
+
+
+class _Feed(BaseHTTPRequestHandler):
+    """station_status with an ETag: 304 when the client already has it."""
+
+    body = json.dumps(_feed({"a": 1, "b": 9})).encode()
+    etag = '"v1"'
+    requests = []
+
+    def do_GET(self):
+        _Feed.requests.append(self.headers.get("If-None-Match"))
+        if self.headers.get("If-None-Match") == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", self.etag)
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def feed_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Feed)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    _Feed.requests = []
+    yield f"http://127.0.0.1:{server.server_address[1]}/station_status.json"
+    server.shutdown()
+
+
+def test_poll_is_conditional(feed_url):
+    poller = StatusPoller(url=feed_url)
+    poller.attach(["a", "b"], version="v1")
+
+    assert asyncio.run(poller.poll_once()) is True
+    assert asyncio.run(poller.poll_once()) is False
+    assert _Feed.requests == [None, '"v1"']
+    assert poller.not_modified == 1
+    assert poller.latest()[1].tolist() == [1, 9]
+
+
+def test_errors_back_off_then_reset():
+    poller = StatusPoller(url="http://unused", interval=0.001)
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        if len(calls) <= 3:
+            raise requests.ConnectionError("down")
+        return None  # not modified
+
+    poller._fetch = fetch
+
+    async def run_until_recovered():
+        task = asyncio.create_task(poller.run())
+        while len(calls) < 5:
+            await asyncio.sleep(0.01)
+        task.cancel()
+
+    asyncio.run(run_until_recovered())
+    assert poller.failures == 0 and poller.last_error is None
+    assert poller.not_modified >= 1
+
+    poller.failures = 3
+    for _ in range(20):
+        assert 0.004 <= poller.next_delay() <= 0.008  # interval x 2^3, jittered by [0.5, 1]
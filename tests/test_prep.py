@@ -0,0 +1,64 @@
+import pandas as pd
+
+from utils.prep import normalize, refresh
+
+
+def _snapshot(rows) -> pd.DataFrame:
+    return pd.DataFrame(rows, columns=[
+        "Identifiant station", "Nom de la station", "Capacité de la station", "Coordonnées géographiques",
+    ])
+
+
+STATIONS = [
+    (1, "Châtelet", 30, "48.8584, 2.3470"),         # 1er
+    (2, "République", 40, "48.8675, 2.3637"),       # 3e
+    (3, "Bastille", 24, "48.8532, 2.3692"),         # 11e
+    (4, "Montparnasse", 52, "48.8422, 2.3211"),     # 15e
+    (5, "Nation", 36, "48.8483, 2.3959"),           # 12e
+    (6, "Trocadéro", 20, "48.8629, 2.2873"),        # 16e
+    (7, "Hors Paris", 18, "48.8100, 2.1200"),       # commune layer or (Inconnu)
+    (8, "Sans capacité", None, "48.8566, 2.3522"),
+]
+
+
+def _same_tables(a: dict, b: dict):
+    pd.testing.assert_frame_equal(
+        a["stations"].reset_index(drop=True), b["stations"].reset_index(drop=True), check_dtype=False
+    )
+    key = ["commune_std"]
+    pd.testing.assert_frame_equal(
+        a["by_commune"].sort_values(key).reset_index(drop=True),
+        b["by_commune"].sort_values(key).reset_index(drop=True),
+        check_dtype=False,
+    )
+    cube_a, cube_b = a["cube"].reset_index(drop=True), b["cube"].reset_index(drop=True)
+    pd.testing.assert_frame_equal(
+        cube_a.assign(commune_std=cube_a["commune_std"].astype(str)),
+        cube_b.assign(commune_std=cube_b["commune_std"].astype(str)),
+        check_dtype=False,
+    )
+    assert a["stats"] == b["stats"]
+    assert sorted(a["sketches"]) == sorted(b["sketches"])
+
+
+def test_refresh_without_changes_keeps_the_tables():
+    previous = normalize(_snapshot(STATIONS))
+    _same_tables(refresh(previous, _snapshot(STATIONS)), previous)
+
+
+def test_refresh_matches_normalize_after_moves_resizes_drops_and_adds():
+    previous = normalize(_snapshot(STATIONS))
+
+    rows = [r for r in STATIONS if r[0] != 3]                # dropped
+    rows[0] = (1, "Châtelet", 60, rows[0][3])                # resized
+    rows[3] = (5, "Nation", 36, "48.8800, 2.2950")           # moved to the 17e
+    rows.append((9, "Nouvelle", 28, "48.8300, 2.3550"))      # added (13e)
+    rows.append((10, "Sans coordonnées", 12, None))          # added, dropped by the core filter
+
+    _same_tables(refresh(previous, _snapshot(rows)), normalize(_snapshot(rows)))
+
+
+def test_refresh_falls_back_to_normalize_on_duplicate_ids():
+    previous = normalize(_snapshot(STATIONS))
+    rows = STATIONS + [(1, "Doublon", 10, "48.8600, 2.3400")]
+    _same_tables(refresh(previous, _snapshot(rows)), normalize(_snapshot(rows)))
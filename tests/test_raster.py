@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import utils.raster
+from utils.raster import Coverage, Grid, _nearest_seed
+
+BOUNDS = (2.30, 48.84, 2.34, 48.87)  # min_lon, min_lat, max_lon, max_lat
+
+
+def _stations(n: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "id_std": np.arange(n),
+        "capacity_std": rng.integers(10, 60, n).astype(float),
+        # A few stations fall in the margin or outside the grid
+        "lat": rng.uniform(48.835, 48.875, n),
+        "lon": rng.uniform(2.295, 2.345, n),
+    })
+
+
+def _brute_force(rows, cols, shape) -> np.ndarray:
+    grid_r, grid_c = np.indices(shape, dtype=np.float64)
+    d = (grid_r.ravel()[:, None] - rows) ** 2 + (grid_c.ravel()[:, None] - cols) ** 2
+    return np.sqrt(d.min(axis=1)).reshape(shape)
+
+
+def test_nearest_seed_matches_brute_force():
+    rng = np.random.default_rng(1)
+    shape = (60, 90)
+    cases = [
+        (rng.uniform(0, 60, 300), rng.uniform(0, 90, 300)),
+        (rng.uniform(-20, 80, 3), rng.uniform(-20, 110, 3)),  # outside the grid
+        (np.r_[rng.normal(30, 2, 100), 5.2, 5.3], np.r_[rng.normal(45, 2, 100), 5.2, 5.4]),  # clustered
+        (np.array([5.0]), np.array([7.0])),
+    ]
+    grid_r, grid_c = np.indices(shape)
+    for rows, cols in cases:
+        seed = _nearest_seed(rows, cols, shape)
+        got = np.hypot(rows[seed] - grid_r, cols[seed] - grid_c)
+        np.testing.assert_allclose(got, _brute_force(rows, cols, shape), atol=1e-9)
+
+
+def test_coverage_distance_matches_brute_force():
+    grid = Grid(BOUNDS)
+    stations = _stations(150)
+    coverage = Coverage(grid, np.ones(grid.shape, dtype=bool), stations)
+
+    rows, cols = grid.to_cells(stations["lat"], stations["lon"])
+    np.testing.assert_allclose(coverage.dist_m, _brute_force(rows, cols, grid.shape) * grid.cell_m, rtol=1e-6)
+
+
+def test_incremental_update_matches_full_recompute(monkeypatch):
+    grid = Grid(BOUNDS)
+    mask = np.ones(grid.shape, dtype=bool)
+    stations = _stations(200)
+    coverage = Coverage(grid, mask, stations)
+
+    new = stations.drop(index=[3, 4]).reset_index(drop=True)  # removed
+    new.loc[10, ["lat", "lon"]] = [48.8601, 2.3150]           # moved
+    new.loc[11, "capacity_std"] = 99.0                        # resized
+    new = pd.concat([new, pd.DataFrame({                      # added
+        "id_std": [1000], "capacity_std": [30.0], "lat": [48.8500], "lon": [2.3300],
+    })], ignore_index=True)
+
+    full = Coverage(grid, mask, new)
+    with monkeypatch.context() as m:
+        # 5 stations changed out of ~200: update() must not fall back to a full recompute
+        m.setattr(utils.raster, "_nearest_seed", pytest.fail)
+        updated = coverage.update(new)
+    np.testing.assert_allclose(updated.dist_m, full.dist_m, rtol=1e-6)
+    np.testing.assert_allclose(updated.docks, full.docks, atol=1e-9)
+    np.testing.assert_allclose(updated.docks_within(5), full.docks_within(5))
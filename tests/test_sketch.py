@@ -0,0 +1,52 @@
+import numpy as np
+
+from utils.sketch import QuantileSketch, merge_all, sketch_by
+
+QS = [0.1, 0.25, 0.5, 0.75, 0.9]
+
+
+def _rank(values: np.ndarray, x: float) -> float:
+    """Normalized rank of `x` among sorted `values` (midpoint of its ties)."""
+    lo, hi = np.searchsorted(values, x, side="left"), np.searchsorted(values, x, side="right")
+    return (lo + hi) / 2 / len(values)
+
+
+def test_small_sketches_are_exact():
+    values = np.array([12, 30, 18, 44, 25, 30, 60, 22, np.nan])
+    sketch = QuantileSketch.of(values)
+    assert len(sketch) == 8 and sketch.rank_error() == 0
+    expected = np.quantile(values[~np.isnan(values)], QS)
+    assert np.allclose(list(sketch.quantiles(QS).values()), expected)
+
+
+def test_serialization_round_trip():
+    sketch = QuantileSketch.of(np.random.default_rng(0).integers(10, 70, 5000), k=64)
+    copy = QuantileSketch.from_bytes(sketch.to_bytes())
+    assert (copy.k, copy.n) == (sketch.k, sketch.n)
+    assert copy.quantiles(QS) == sketch.quantiles(QS)
+    assert copy.to_bytes() == sketch.to_bytes()
+
+
+def test_merge_is_within_the_rank_error_bound():
+    rng = np.random.default_rng(1)
+    parts = [rng.gamma(4, 8, size) for size in (20_000, 5_000, 30_000, 300)]
+    merged = merge_all(QuantileSketch.of(p) for p in parts)
+    values = np.sort(np.concatenate(parts))
+
+    assert len(merged) == len(values)
+    assert 0 < merged.rank_error() < 0.02
+    for q, x in merged.quantiles(QS).items():
+        assert abs(_rank(values, x) - q) <= merged.rank_error()
+    assert merged.quantile(0) >= values[0] and merged.quantile(1) <= values[-1]
+
+
+def test_merge_leaves_inputs_untouched_and_sketch_by_splits_per_key():
+    keys = np.array(["a", "b", "a", "c", "b", "a"])
+    values = np.array([10, 20, 30, 40, 50, 60])
+    sketches = sketch_by(keys, values)
+    assert sorted(sketches) == ["a", "b", "c"]
+    assert sketches["a"].quantile(0.5) == 30 and len(sketches["b"]) == 2
+
+    before = sketches["a"].to_bytes()
+    assert merge_all(sketches.values()).quantile(0.5) == np.median(values)
+    assert sketches["a"].to_bytes() == before
@@ -0,0 +1,288 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+import pyarrow.feather as feather
+
+from utils.io import load_data, LOCAL_PATH, ARR_PATH, COM_PATH, DATA_DIR
+from utils.cube import index_communes
+from utils.sketch import QuantileSketch
+from utils.store import StationStore
+
+# Bump when the layout of the normalized tables changes: old artifacts are ignored.
+ARTIFACT_VERSION = 6
+CACHE_DIR = Path(os.environ.get("VELIB_CACHE_DIR", DATA_DIR / ".cache"))
+# Older generations kept besides the published one (workers may still have them mapped)
+KEEP_GENERATIONS = 2
+
+
+def _file_digest(path: Path) -> str:
+    if not path.exists():
+        return "missing"
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _key(*digests) -> str:
+    h = hashlib.sha256(f"v{ARTIFACT_VERSION}".encode())
+    for digest in digests:
+        h.update(digest.encode())
+    return h.hexdigest()[:32]
+
+
+def source_key(source_path: Path = LOCAL_PATH, arr_path: Path = ARR_PATH, com_path: Path = COM_PATH) -> str:
+    """
+    Content hash of the station CSV and both GeoJSON layers.
+    Two identical inputs always map to the same artifact directory.
+    """
+    return _key(*(_file_digest(Path(p)) for p in (source_path, arr_path, com_path)))
+
+
+def geo_key(arr_path: Path = ARR_PATH, com_path: Path = COM_PATH) -> str:
+    """Content hash of the GeoJSON layers only: snapshots sharing it can be refreshed incrementally."""
+    return _key(_file_digest(Path(arr_path)), _file_digest(Path(com_path)))
+
+
+def _artifact_dir(key: str) -> Path:
+    return CACHE_DIR / f"v{ARTIFACT_VERSION}" / key
+
+
+def _write_arrow(df, path: Path):
+    # One uncompressed record batch per file: columns can be mapped without any copy
+    feather.write_feather(df, path, compression="uncompressed", chunksize=max(len(df), 1))
+
+
+def _read_arrow(path: Path):
+    """
+    Memory-maps an Arrow IPC file. Numeric columns without nulls (and Arrow-backed strings)
+    stay views of the file, so every worker on the host shares the OS page cache copy.
+    """
+    return feather.read_table(path, memory_map=True).to_pandas(split_blocks=True)
+
+
+def write_tables(tables: dict, key: str) -> Path:
+    """
+    Writes the normalized tables as Arrow IPC files (+ stats.json), one directory per generation.
+    The directory is written aside then renamed, so readers never see half an artifact.
+    """
+    target = _artifact_dir(key)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp = Path(tempfile.mkdtemp(dir=target.parent, prefix=".tmp-"))
+    try:
+        _write_arrow(tables["stations"].reset_index(drop=True), tmp / "stations.arrow")
+        # Compact station store (utils.store), mapped as is by every worker
+        rows, categories = StationStore.build(tables["stations"]).to_frames()
+        _write_arrow(rows, tmp / "store.arrow")
+        _write_arrow(categories, tmp / "store_categories.arrow")
+        _write_arrow(tables["by_commune"].reset_index(drop=True), tmp / "by_commune.arrow")
+        _write_arrow(tables["cube"], tmp / "cube.arrow")
+        sketches = tables["sketches"]
+        _write_arrow(
+            pd.DataFrame({"commune_std": list(sketches), "sketch": [s.to_bytes() for s in sketches.values()]}),
+            tmp / "sketches.arrow",
+        )
+        stats = {
+            "quantiles": [[float(k), float(v)] for k, v in tables["stats"]["quantiles"].items()],
+            "n": int(tables["stats"]["n"]),
+        }
+        (tmp / "stats.json").write_text(json.dumps(stats))
+        try:
+            os.rename(tmp, target)
+        except OSError:
+            # Another process published the same key first: its artifact is identical.
+            shutil.rmtree(tmp, ignore_errors=True)
+    except Exception:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return target
+
+
+def _latest_path(geo: str) -> Path:
+    return CACHE_DIR / f"v{ARTIFACT_VERSION}" / f"latest-{geo}"
+
+
+def _current_path() -> Path:
+    return CACHE_DIR / f"v{ARTIFACT_VERSION}" / "current"
+
+
+def _write_pointer(pointer: Path, key: str):
+    tmp = pointer.with_name(f".{pointer.name}.{os.getpid()}")
+    tmp.write_text(key)
+    os.replace(tmp, pointer)
+
+
+def _set_latest(geo: str, key: str):
+    """Publishes `key` as the current generation (atomic swap of the pointer files)."""
+    _write_pointer(_latest_path(geo), key)
+    _write_pointer(_current_path(), key)
+    prune_generations()
+
+
+def current_generation():
+    """Key of the last published generation (None before the first build). Cheap enough for every rerun."""
+    try:
+        return _current_path().read_text().strip() or None
+    except OSError:
+        return None
+
+
+def prune_generations(keep: int = KEEP_GENERATIONS):
+    """
+    Removes all but the `keep` most recent unpublished generations.
+    Files still mapped by a worker stay readable until it unmaps them (POSIX unlink semantics).
+    """
+    root = CACHE_DIR / f"v{ARTIFACT_VERSION}"
+    published = {current_generation()}
+    published |= {p.read_text().strip() for p in root.glob("latest-*") if p.is_file()}
+    old = [p for p in root.iterdir() if p.is_dir() and not p.name.startswith(".") and p.name not in published]
+    old.sort(key=lambda p: p.stat().st_mtime, reverse=True)
+    for path in old[keep:]:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def _get_latest(geo: str):
+    try:
+        return _latest_path(geo).read_text().strip()
+    except OSError:
+        return None
+
+
+def read_tables(key: str):
+    """
+    Returns the cached (memory-mapped, read-only) tables for `key`, or None if no valid artifact exists.
+    tables["store"] is the compact StationStore of the same stations.
+    """
+    target = _artifact_dir(key)
+    try:
+        stations = _read_arrow(target / "stations.arrow")
+        by_com = _read_arrow(target / "by_commune.arrow")
+        cube = _read_arrow(target / "cube.arrow")
+        sketches = _read_arrow(target / "sketches.arrow")
+        store = StationStore.from_frames(_read_arrow(target / "store.arrow"), _read_arrow(target / "store_categories.arrow"))
+        stats = json.loads((target / "stats.json").read_text())
+    except (OSError, ValueError):
+        return None
+    return {
+        "stations": stations,
+        "store": store,
+        "by_commune": by_com,
+        "stats": {"quantiles": {q: v for q, v in stats["quantiles"]}, "n": stats["n"]},
+        "cube": cube,
+        "commune_index": index_communes(cube),
+        "sketches": {c: QuantileSketch.from_bytes(b) for c, b in zip(sketches["commune_std"], sketches["sketch"])},
+        "version": key,
+    }
+
+
+def build_tables(source_path: Path = LOCAL_PATH, previous: dict = None, key: str = None) -> dict:
+    """
+    Normalizes `source_path`, stores it and publishes it (returned memory-mapped).
+    With `previous` tables, only the stations added, moved or resized since then go through
+    the spatial join (utils.prep.refresh); the full pipeline runs otherwise.
+    """
+    from utils.prep import normalize, refresh
+
+    key, geo = key or source_key(source_path), geo_key()
+    df = load_data(source_path)
+    write_tables(refresh(previous, df) if previous is not None else normalize(df), key)
+    _set_latest(geo, key)
+    return read_tables(key)
+
+
+def _source_record(source_path: Path) -> Path:
+    name = hashlib.sha256(str(Path(source_path).resolve()).encode()).hexdigest()[:16]
+    return CACHE_DIR / f"v{ARTIFACT_VERSION}" / f"source-{name}.json"
+
+
+def _stamp(source_path: Path) -> list:
+    """(mtime, size) of the CSV and both GeoJSONs: detects an unchanged source without hashing it."""
+    stamp = []
+    for path in (source_path, ARR_PATH, COM_PATH):
+        try:
+            st = Path(path).stat()
+            stamp.append([st.st_mtime_ns, st.st_size])
+        except OSError:
+            stamp.append(None)
+    return stamp
+
+
+def _seen_source(source_path: Path) -> dict:
+    try:
+        return json.loads(_source_record(source_path).read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def record_source(source_path: Path, key: str = None):
+    """Marks the current content of `source_path` as taken into account (load_tables serves `current`)."""
+    key = key or source_key(source_path)
+    record = _source_record(source_path)
+    record.parent.mkdir(parents=True, exist_ok=True)
+    _write_pointer(record, json.dumps({"key": key, "stamp": _stamp(source_path)}))
+
+
+def load_tables(source_path: Path = LOCAL_PATH) -> dict:
+    """
+    Serves the published generation (`current`), e.g. the one of the build step, of
+    `python -m utils.ingest --publish` or of the background refresh, unless `source_path`
+    changed since it was last taken into account: then it is normalized and published
+    (diffed against the latest stored snapshot with the same GeoJSONs when there is one).
+    Unchanged mtimes and sizes skip the content hash.
+    tables["version"] is the content key: it identifies the data for downstream caches.
+    """
+    source_path = Path(source_path)
+    if source_path.exists():
+        seen = _seen_source(source_path)
+        if seen.get("stamp") != _stamp(source_path):
+            key = source_key(source_path)
+            if seen.get("key") != key:
+                return publish_tables(source_path, key)
+            record_source(source_path, key)  # touched, same content
+
+    current = current_generation()
+    tables = read_tables(current) if current else None
+    if tables is not None:
+        return tables
+    if not source_path.exists():
+        raise FileNotFoundError(f"Fichier introuvable : {source_path} (et aucune table publiée)")
+    return publish_tables(source_path)
+
+
+def publish_tables(source_path: Path = LOCAL_PATH, key: str = None, record: bool = True,
+                   previous: dict = None, full: bool = False) -> dict:
+    """
+    Normalizes `source_path`, stores it and publishes it as the current generation.
+    The snapshot is diffed against `previous` tables, by default the latest stored ones with
+    the same GeoJSONs (`full` forces the whole pipeline), and an artifact that already exists
+    for the same content is published as is.
+    `record=False` leaves the source unmarked (see record_source), e.g. for a download
+    that is only moved in place afterwards.
+    """
+    key = key or source_key(source_path)
+    geo = geo_key()
+    tables = read_tables(key)
+    if tables is None:
+        if previous is None and not full:
+            previous_key = _get_latest(geo)
+            previous = read_tables(previous_key) if previous_key else None
+        tables = build_tables(source_path, None if full else previous, key)
+    _set_latest(geo, key)
+    if record:
+        record_source(source_path, key)
+    return tables
+
+
+if __name__ == "__main__":
+    # Build step: python -m utils.cache [csv] [--full]
+    import sys
+
+    args = [a for a in sys.argv[1:] if a != "--full"]
+    path = Path(args[0]) if args else LOCAL_PATH
+    print(publish_tables(path, full="--full" in sys.argv[1:])["version"])
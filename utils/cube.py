@@ -0,0 +1,182 @@
+import numpy as np
+import pandas as pd
+
+# Pre-aggregated station counts: one row per (commune, zone, capacity bucket).
+# A bucket is one exact capacity value (docks are integers), so a set of rows is
+# also an exact, mergeable summary of the capacity distribution: any selection of
+# communes gets exact totals, medians and quantiles without touching `stations`.
+CUBE_COLUMNS = ["commune_std", "zone", "capacity", "stations", "capacity_total"]
+
+
+def zone_of(communes) -> np.ndarray:
+    """'Paris' for the arrondissements, 'Suburbs' for everything else."""
+    communes = pd.Series(communes, dtype="str")
+    return np.where(communes.str.contains("Paris", regex=False, na=False), "Paris", "Suburbs")
+
+
+def build_cube(core: pd.DataFrame) -> pd.DataFrame:
+    """Aggregates normalized stations into cube cells, sorted by commune then capacity."""
+    if core.empty:
+        cube = pd.DataFrame({col: pd.Series(dtype="float64") for col in CUBE_COLUMNS})
+        cube["commune_std"] = pd.Categorical([])
+        cube["zone"] = cube["zone"].astype("str")
+        return cube
+
+    cube = (
+        core.groupby(["commune_std", "capacity_std"], dropna=False)
+        .size()
+        .rename("stations")
+        .reset_index()
+        .rename(columns={"capacity_std": "capacity"})
+    )
+    cube["capacity_total"] = cube["capacity"] * cube["stations"]
+    cube["zone"] = zone_of(cube["commune_std"])
+    cube["commune_std"] = pd.Categorical(cube["commune_std"], categories=sorted(cube["commune_std"].unique()))
+    cube = cube.sort_values(["commune_std", "capacity"]).reset_index(drop=True)
+    return cube[CUBE_COLUMNS]
+
+
+def index_communes(cube: pd.DataFrame) -> dict:
+    """{commune: slice of its cube rows}, so a selection costs O(selected communes)."""
+    codes = cube["commune_std"].cat.codes.to_numpy()
+    categories = cube["commune_std"].cat.categories
+    bounds = np.searchsorted(codes, np.arange(len(categories) + 1))
+    return {com: slice(bounds[i], bounds[i + 1]) for i, com in enumerate(categories)}
+
+
+def select_cells(tables: dict, communes=None) -> pd.DataFrame:
+    """Cube rows of the selected communes (all rows when nothing is selected)."""
+    cube = tables["cube"]
+    if not communes:
+        return cube
+    index = tables["commune_index"]
+    positions = [np.arange(index[c].start, index[c].stop) for c in communes if c in index]
+    if not positions:
+        return cube.iloc[0:0]
+    return cube.iloc[np.concatenate(positions)]
+
+
+def cell_quantiles(cells: pd.DataFrame, qs) -> dict:
+    """Exact quantiles (pandas 'linear' interpolation) of the stations behind `cells`."""
+    cells = cells.sort_values("capacity")
+    values = cells["capacity"].to_numpy(dtype="float64")
+    counts = cells["stations"].to_numpy()
+    n = int(counts.sum())
+    if n == 0:
+        return {q: np.nan for q in qs}
+
+    ends = np.cumsum(counts)  # rank r (0-based) is values[searchsorted(ends, r, 'right')]
+    out = {}
+    for q in qs:
+        h = (n - 1) * q
+        lo, hi = int(np.floor(h)), int(np.ceil(h))
+        v_lo = values[np.searchsorted(ends, lo, side="right")]
+        v_hi = values[np.searchsorted(ends, hi, side="right")]
+        out[q] = float(v_lo + (h - lo) * (v_hi - v_lo))
+    return out
+
+
+def grouped_quantiles(cells: pd.DataFrame, qs) -> pd.DataFrame:
+    """
+    cell_quantiles for every commune at once: one sort and one searchsorted per quantile.
+    Returns one row per commune (with stations) and one column per quantile.
+    """
+    cells = cells[cells["stations"] > 0]
+    cells = cells.assign(commune_std=cells["commune_std"].astype("str")).sort_values(["commune_std", "capacity"])
+    values = cells["capacity"].to_numpy(dtype="float64")
+    ends = np.cumsum(cells["stations"].to_numpy())
+
+    communes, first = np.unique(cells["commune_std"].to_numpy(), return_index=True)
+    offset = np.r_[0, ends][first]  # stations before each commune
+    n = np.diff(np.append(offset, ends[-1] if len(ends) else 0))
+
+    out = pd.DataFrame({"commune_std": communes})
+    for q in qs:
+        h = (n - 1) * q
+        lo, hi = np.floor(h), np.ceil(h)
+        v_lo = values[np.searchsorted(ends, offset + lo, side="right")]
+        v_hi = values[np.searchsorted(ends, offset + hi, side="right")]
+        out[q] = v_lo + (h - lo) * (v_hi - v_lo)
+    return out
+
+
+def cell_metrics(cells: pd.DataFrame, low_thr=None) -> dict:
+    """Station count, total/median capacity and stations strictly below `low_thr`."""
+    stations = int(cells["stations"].sum())
+    total = float(cells["capacity_total"].sum())
+    below = int(cells.loc[cells["capacity"] < low_thr, "stations"].sum()) if low_thr is not None else 0
+    return {
+        "stations": stations,
+        "capacity_total": total,
+        "capacity_mean": total / stations if stations else np.nan,
+        "capacity_median": cell_quantiles(cells, [0.5])[0.5],
+        "below": below,
+    }
+
+
+def zone_summary(cells: pd.DataFrame) -> pd.DataFrame:
+    """Number of stations per zone (Paris / Suburbs)."""
+    return cells.groupby("zone")["stations"].sum().reset_index()
+
+
+def capacity_counts(cells: pd.DataFrame) -> pd.DataFrame:
+    """Number of stations per capacity value, merged across the selected communes."""
+    return cells.groupby("capacity")["stations"].sum().reset_index()
+
+
+def replace_communes(cube: pd.DataFrame, cells: pd.DataFrame, communes) -> pd.DataFrame:
+    """Cube where the rows of `communes` are replaced by `cells` (e.g. after a refresh)."""
+    parts = [cube[~cube["commune_std"].isin(communes)], cells]
+    parts = [p.assign(commune_std=p["commune_std"].astype("str")) for p in parts if not p.empty]
+    if not parts:
+        return build_cube(pd.DataFrame(columns=["commune_std", "capacity_std"]))
+    merged = pd.concat(parts, ignore_index=True)
+    merged["commune_std"] = pd.Categorical(merged["commune_std"], categories=sorted(merged["commune_std"].unique()))
+    return merged.sort_values(["commune_std", "capacity"]).reset_index(drop=True)[CUBE_COLUMNS]
+
+
+def merge_cubes(parts) -> pd.DataFrame:
+    """One cube from cubes of disjoint station sets (e.g. partitions ingested in parallel)."""
+    parts = [p.assign(commune_std=p["commune_std"].astype("str")) for p in parts if not p.empty]
+    if not parts:
+        return build_cube(pd.DataFrame(columns=["commune_std", "capacity_std"]))
+    merged = (
+        pd.concat(parts, ignore_index=True)
+        .groupby(["commune_std", "zone", "capacity"], as_index=False)[["stations", "capacity_total"]]
+        .sum()
+    )
+    merged["commune_std"] = pd.Categorical(merged["commune_std"], categories=sorted(merged["commune_std"].unique()))
+    return merged.sort_values(["commune_std", "capacity"]).reset_index(drop=True)[CUBE_COLUMNS]
+
+
+def box_stats(cells: pd.DataFrame) -> tuple:
+    """
+    Per-commune box-plot statistics computed from cube cells (Tukey 1.5 IQR whiskers).
+    Returns (stats, outliers): one row per commune with n, mean, q1, median, q3,
+    lowerfence, upperfence; and one row per (commune, outlying capacity) with its station count.
+    """
+    cells = cells[cells["stations"] > 0].assign(commune_std=lambda d: d["commune_std"].astype("str"))
+    if cells.empty:
+        empty = pd.DataFrame(columns=["commune_std", "n", "mean", "q1", "median", "q3", "lowerfence", "upperfence"])
+        return empty, pd.DataFrame(columns=["commune_std", "capacity", "stations"])
+
+    stats = grouped_quantiles(cells, [0.25, 0.5, 0.75]).rename(columns={0.25: "q1", 0.5: "median", 0.75: "q3"})
+    sums = cells.groupby("commune_std", sort=False)[["stations", "capacity_total"]].sum()
+    stats.insert(1, "n", sums["stations"].reindex(stats["commune_std"]).to_numpy())
+    stats.insert(2, "mean", sums["capacity_total"].reindex(stats["commune_std"]).to_numpy() / stats["n"])
+
+    # Whiskers: most extreme capacities still within 1.5 IQR of the box
+    iqr = stats["q3"] - stats["q1"]
+    low = (stats["q1"] - 1.5 * iqr).to_numpy()
+    high = (stats["q3"] + 1.5 * iqr).to_numpy()
+    pos = stats.reset_index().set_index("commune_std")["index"]
+    row = pos.reindex(cells["commune_std"]).to_numpy()
+    cap = cells["capacity"].to_numpy(dtype="float64")
+    inside = (cap >= low[row]) & (cap <= high[row])
+
+    within = pd.DataFrame({"row": row[inside], "capacity": cap[inside]}).groupby("row")["capacity"]
+    stats["lowerfence"] = within.min().reindex(stats.index).fillna(stats["q1"]).to_numpy()
+    stats["upperfence"] = within.max().reindex(stats.index).fillna(stats["q3"]).to_numpy()
+
+    outliers = cells.loc[~inside, ["commune_std", "capacity", "stations"]].reset_index(drop=True)
+    return stats, outliers
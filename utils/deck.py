@@ -0,0 +1,130 @@
+import os
+import re
+import numpy as np
+import pandas as pd
+
+from utils.mapbase import MAP_HEIGHT, image_source
+
+# Map backend of the Overview page, chosen per deployment: "plotly" (default) or "pydeck"
+MAP_BACKEND = os.environ.get("VELIB_MAP_BACKEND", "plotly").strip().lower()
+
+DECK_LAYERS = ["Stations", "Hexagons", "Columns"]
+DEFAULT_COLOR = [160, 160, 160]
+
+
+def _rgb(color: str) -> list:
+    """'rgb(136, 204, 238)' or '#88CCEE' -> [136, 204, 238]"""
+    if color.startswith("#"):
+        return [int(color[i:i + 2], 16) for i in (1, 3, 5)]
+    return [int(v) for v in re.findall(r"\d+", color)[:3]]
+
+
+def deck_data(df: pd.DataFrame, labels=True, colors=None) -> pd.DataFrame:
+    """
+    Minimal columns sent to the browser: rounded positions, uint8 colors, int capacity
+    (+ name/commune for the tooltips when `labels`).
+    Streamlit serializes the layer data as JSON records, so every column and every
+    digit is repeated once per station: nothing else is kept.
+    """
+    data = pd.DataFrame({
+        "lon": df["lon"].to_numpy(dtype=np.float64).round(5),
+        "lat": df["lat"].to_numpy(dtype=np.float64).round(5),
+        "cap": df["capacity_std"].to_numpy().astype(np.int32),
+    })
+    if not labels:
+        return data
+
+    palette = {com: _rgb(col) for com, col in (colors or {}).items()}
+    codes, uniques = pd.factorize(df["commune_std"])
+    lookup = np.array([palette.get(com, DEFAULT_COLOR) for com in uniques] + [DEFAULT_COLOR], dtype=np.uint8)
+    rgb = lookup[codes]  # code -1 (missing commune) falls on DEFAULT_COLOR
+
+    data["r"], data["g"], data["b"] = rgb[:, 0], rgb[:, 1], rgb[:, 2]
+    data["name"] = df["name_std"].to_numpy()
+    data["commune"] = df["commune_std"].to_numpy()
+    return data
+
+
+def deck_map(df: pd.DataFrame, layer="Stations", zoom=10, center=None, colors=None, overlay=None, focus=None):
+    """
+    WebGL map of the stations (rendered by deck.gl in the browser).
+    'Stations': one dot per station, 'Hexagons': capacity summed per hexagon on the GPU,
+    'Columns': one column per station, elevation = capacity.
+    `overlay` = (png, bounds) draws a raster image (see utils.raster) under the stations,
+    `focus` = (lat, lon) rings one station (e.g. a search result).
+    """
+    import pydeck as pdk
+
+    data = deck_data(df, labels=layer != "Hexagons", colors=colors)
+    if center is None and len(data):
+        center = {"lat": float(data["lat"].mean()), "lon": float(data["lon"].mean())}
+    elif center is None:
+        center = {"lat": 48.8566, "lon": 2.3522}
+
+    if layer == "Hexagons":
+        layers = [pdk.Layer(
+            "HexagonLayer",
+            data=data,
+            get_position=["lon", "lat"],
+            get_elevation_weight="cap",
+            elevation_aggregation="SUM",
+            get_color_weight="cap",
+            color_aggregation="SUM",
+            radius=250,
+            elevation_scale=4,
+            extruded=True,
+            pickable=True,
+        )]
+        tooltip = {"text": "Capacity: {elevationValue}"}
+        pitch = 40
+    elif layer == "Columns":
+        layers = [pdk.Layer(
+            "ColumnLayer",
+            data=data,
+            get_position=["lon", "lat"],
+            get_elevation="cap",
+            get_fill_color=["r", "g", "b", 200],
+            radius=40,
+            elevation_scale=10,
+            extruded=True,
+            pickable=True,
+        )]
+        tooltip = {"text": "{name}\n{commune}\nCapacity: {cap}"}
+        pitch = 45
+    else:
+        layers = [pdk.Layer(
+            "ScatterplotLayer",
+            data=data,
+            get_position=["lon", "lat"],
+            get_fill_color=["r", "g", "b", 200],
+            get_radius=40,
+            radius_min_pixels=2,
+            pickable=True,
+        )]
+        tooltip = {"text": "{name}\n{commune}\nCapacity: {cap}"}
+        pitch = 0
+
+    if overlay is not None:
+        png, bounds = overlay
+        layers.insert(0, pdk.Layer("BitmapLayer", image=image_source(png), bounds=list(bounds)))
+
+    if focus is not None:
+        layers.append(pdk.Layer(
+            "ScatterplotLayer",
+            data=pd.DataFrame({"lat": [focus[0]], "lon": [focus[1]]}),
+            get_position=["lon", "lat"],
+            get_radius=60,
+            radius_min_pixels=8,
+            filled=False,
+            stroked=True,
+            get_line_color=[255, 255, 255],
+            line_width_min_pixels=3,
+        ))
+
+    return pdk.Deck(
+        layers=layers,
+        initial_view_state=pdk.ViewState(latitude=center["lat"], longitude=center["lon"], zoom=zoom, pitch=pitch),
+        map_style="light",
+        height=MAP_HEIGHT,
+        tooltip=tooltip,
+    )
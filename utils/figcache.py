@@ -0,0 +1,87 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+
+DEFAULT_MAX_BYTES = int(float(os.environ.get("VELIB_FIGURE_CACHE_MB", "64")) * (1 << 20))
+
+
+def _freeze(value):
+    """Hashable, order-insensitive form of a filter value (lists are treated as sets)."""
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return tuple(sorted(_freeze(v) for v in value))
+    return value
+
+
+class FigureCache:
+    """
+    Process-wide LRU of serialized Plotly figures, bounded by the size of their JSON.
+    Entries are keyed by (builder, filters, data version): the positional data arguments
+    are NOT part of the key, they must be fully determined by the filters and the version.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def figure(self, builder, *args, filters=None, version=None, **kwargs):
+        """Returns builder(*args, **kwargs), rebuilt from its cached JSON when possible."""
+        if version is None:
+            return builder(*args, **kwargs)
+
+        key = (f"{builder.__module__}.{builder.__qualname__}", _freeze(filters or {}), _freeze(kwargs), version)
+        with self._lock:
+            spec = self._entries.get(key)
+            if spec is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if spec is None:
+            spec = builder(*args, **kwargs).to_json().encode()
+            self._put(key, spec)
+        import plotly.graph_objects as go
+
+        # The JSON comes from a validated figure: skip plotly's validation when rehydrating
+        return go.Figure(json.loads(spec), _validate=False)
+
+    def _put(self, key, spec: bytes):
+        size = len(spec)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._entries[key] = spec
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+FIGURES = FigureCache()
@@ -0,0 +1,113 @@
+import json
+import numpy as np
+import shapely
+from functools import lru_cache
+from pathlib import Path
+
+from utils.io import ARR_PATH, COM_PATH
+
+UNKNOWN = "(Inconnu)"
+_WGS84 = {"urn:ogc:def:crs:OGC:1.3:CRS84", "urn:ogc:def:crs:EPSG::4326", "EPSG:4326"}
+
+
+def read_layer(path: Path, column: str) -> tuple:
+    """
+    (values of property `column`, shapely geometries) of every feature, in WGS84.
+    RFC 7946 GeoJSON is WGS84 by definition and is parsed with json + shapely:
+    geopandas is only imported for a legacy 'crs' member naming another system.
+    """
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+
+    crs = ((data.get("crs") or {}).get("properties") or {}).get("name")
+    if crs and crs not in _WGS84:
+        import geopandas as gpd
+
+        gdf = gpd.read_file(path).to_crs("EPSG:4326")
+        if column not in gdf.columns:
+            raise ValueError(f"{Path(path).name} doit contenir '{column}'.")
+        return gdf[column].tolist(), list(gdf.geometry.values)
+
+    features = [f for f in data.get("features", []) if f.get("geometry")]
+    if features and not any(column in (f.get("properties") or {}) for f in features):
+        raise ValueError(f"{Path(path).name} doit contenir '{column}'.")
+    values = [(f.get("properties") or {}).get(column) for f in features]
+    geometries = [shapely.geometry.shape(f["geometry"]) for f in features]
+    return values, geometries
+
+
+class CommuneIndex:
+    """
+    Arrondissement and commune polygons, loaded once, prepared and indexed by bounding box.
+    Polygons are stored arrondissements first and a point keeps the first polygon
+    that contains it: arrondissement, then commune, then '(Inconnu)'.
+    """
+
+    def __init__(self, names, geometries):
+        # Polygons without a label (e.g. unparsable 'l_ar') can never win a match
+        keep = [i for i, name in enumerate(names) if name is not None]
+        self.names = np.array([names[i] for i in keep] + [UNKNOWN], dtype=object)
+        self.geometries = np.array([geometries[i] for i in keep], dtype=object)
+        shapely.prepare(self.geometries)
+        self.bounds = shapely.bounds(self.geometries)
+
+    @classmethod
+    def from_files(cls, arr_path: Path = ARR_PATH, com_path: Path = COM_PATH):
+        from utils.prep import _format_arr_label
+
+        labels, geoms = read_layer(arr_path, "l_ar")
+        names = [_format_arr_label(label) for label in labels]
+
+        # Municipalities are only a fallback layer: the app still works without them
+        if Path(com_path).exists():
+            com_names, com_geoms = read_layer(com_path, "nom")
+            names += com_names
+            geoms += com_geoms
+
+        return cls(names, geoms)
+
+    def classify(self, lat, lon) -> np.ndarray:
+        """
+        Returns the commune label of each (lat, lon) pair.
+        Points are sorted by longitude once; each polygon then only tests the points
+        inside its bounding box that are still unassigned, with a vectorized contains_xy.
+        """
+        lat = np.asarray(lat, dtype="float64")
+        lon = np.asarray(lon, dtype="float64")
+        unknown = len(self.names) - 1
+
+        valid = np.flatnonzero(np.isfinite(lat) & np.isfinite(lon))
+        order = valid[np.argsort(lon[valid], kind="stable")]
+        s_lon, s_lat = lon[order], lat[order]
+        s_best = np.full(order.shape[0], unknown, dtype=np.int64)
+
+        for i, (min_x, min_y, max_x, max_y) in enumerate(self.bounds):
+            lo = np.searchsorted(s_lon, min_x, side="left")
+            hi = np.searchsorted(s_lon, max_x, side="right")
+            if lo == hi:
+                continue
+            window_lat = s_lat[lo:hi]
+            cand = lo + np.flatnonzero(
+                (window_lat >= min_y) & (window_lat <= max_y) & (s_best[lo:hi] == unknown)
+            )
+            if cand.size:
+                inside = shapely.contains_xy(self.geometries[i], s_lon[cand], s_lat[cand])
+                s_best[cand[inside]] = i
+
+        best = np.full(lat.shape[0], unknown, dtype=np.int64)
+        best[order] = s_best
+        return self.names[best]
+
+
+@lru_cache(maxsize=4)
+def _cached_index(arr_path: str, com_path: str, arr_mtime: float, com_mtime: float) -> CommuneIndex:
+    return CommuneIndex.from_files(Path(arr_path), Path(com_path))
+
+
+def _mtime(path: Path) -> float:
+    return path.stat().st_mtime if path.exists() else 0
+
+
+def get_commune_index(arr_path: Path = ARR_PATH, com_path: Path = COM_PATH) -> CommuneIndex:
+    """Process-wide index, rebuilt only when one of the GeoJSON files changes."""
+    return _cached_index(str(arr_path), str(com_path), _mtime(Path(arr_path)), _mtime(Path(com_path)))
@@ -0,0 +1,210 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+from datetime import date, datetime
+from functools import lru_cache
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from utils.io import DATA_DIR, load_data
+from utils.sketch import QuantileSketch, merge_all
+
+# Snapshot history, two Parquet datasets with hive partitions:
+#   stations/date=YYYY-MM-DD/  every ingested snapshot (ids, names, communes dictionary-encoded),
+#                              one HHMMSS-<content hash>.parquet file each
+#   daily/month=YYYY-MM/       one row per (day, commune), written at ingestion
+# The trend view only reads `daily`, pruned on the month partitions and filtered on
+# date and commune inside the files, so it never touches the station rows.
+HISTORY_DIR = Path(os.environ.get("VELIB_HISTORY_DIR", DATA_DIR / "history"))
+DAILY_COLUMNS = ["date", "taken_at", "commune_std", "stations", "capacity_total", "capacity_median", "sketch"]
+
+_DATE = re.compile(r"(20\d{2})-?(\d{2})-?(\d{2})")
+_PARTITIONING = {
+    "stations": ds.partitioning(pa.schema([("date", pa.string())]), flavor="hive"),
+    "daily": ds.partitioning(pa.schema([("month", pa.string())]), flavor="hive"),
+}
+
+
+def snapshot_time(path: Path) -> datetime:
+    """Date in the file name (e.g. velib-2024-08-31.csv), the file's modification time otherwise."""
+    m = _DATE.search(Path(path).name)
+    if m:
+        return datetime(*map(int, m.groups()))
+    return datetime.fromtimestamp(Path(path).stat().st_mtime).replace(microsecond=0)
+
+
+def _write_parquet(table: pa.Table, path: Path):
+    """Written aside then renamed: a reader never sees half a file."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-", suffix=".parquet")
+    os.close(fd)
+    try:
+        pq.write_table(table, tmp)
+        os.replace(tmp, path)
+    except Exception:
+        os.unlink(tmp)
+        raise
+
+
+def _station_table(stations: pd.DataFrame, taken_at: datetime) -> pa.Table:
+    return pa.table({
+        "taken_at": pa.array([taken_at] * len(stations), pa.timestamp("s")),
+        "id_std": pa.array(stations["id_std"].astype(str).to_numpy()).dictionary_encode(),
+        "name_std": pa.array(stations["name_std"].astype(str).to_numpy()).dictionary_encode(),
+        "commune_std": pa.array(stations["commune_std"].astype(str).to_numpy()).dictionary_encode(),
+        "capacity_std": pa.array(stations["capacity_std"].to_numpy(dtype="int32")),
+        "lat": pa.array(stations["lat"].to_numpy(dtype="float32")),
+        "lon": pa.array(stations["lon"].to_numpy(dtype="float32")),
+    })
+
+
+def _daily_rows(tables: dict, taken_at: datetime) -> pd.DataFrame:
+    by_com = tables["by_commune"]
+    return pd.DataFrame({
+        "date": taken_at.date(),
+        "taken_at": taken_at,
+        "commune_std": by_com["commune_std"].astype(str).to_numpy(),
+        "stations": by_com["stations"].to_numpy(dtype="int64"),
+        "capacity_total": by_com["capacity_total"].to_numpy(dtype="int64"),
+        "capacity_median": by_com["capacity_median"].to_numpy(dtype="float64"),
+        "sketch": [tables["sketches"][str(c)].to_bytes() for c in by_com["commune_std"]],
+    }, columns=DAILY_COLUMNS)
+
+
+def _month_path(day: date, root: Path) -> Path:
+    return root / "daily" / f"month={day:%Y-%m}" / "part-0.parquet"
+
+
+def _update_daily(rows: pd.DataFrame, root: Path):
+    """The daily aggregate of a day is its last snapshot: its month file is rewritten."""
+    day, taken_at = rows["date"].iloc[0], rows["taken_at"].iloc[0]
+    path = _month_path(day, root)
+    if path.exists():
+        month = pq.read_table(path).to_pandas()
+        previous = month.loc[month["date"] == day, "taken_at"]
+        if len(previous) and previous.max() > taken_at:
+            return
+        rows = pd.concat([month[month["date"] != day], rows], ignore_index=True)
+    rows = rows.sort_values(["date", "commune_std"], ignore_index=True)
+    _write_parquet(pa.Table.from_pandas(rows, preserve_index=False), path)
+
+
+def manifest(root: Path = HISTORY_DIR) -> dict:
+    """{"first", "last", "snapshots"} of the history ({} when there is none). One small file read."""
+    try:
+        data = json.loads((root / "manifest.json").read_text())
+    except (OSError, ValueError):
+        return {}
+    return {
+        "first": date.fromisoformat(data["first"]),
+        "last": date.fromisoformat(data["last"]),
+        "snapshots": data["snapshots"],
+        "version": data["version"],
+    }
+
+
+def _write_manifest(root: Path, day: date):
+    current = manifest(root)
+    data = {
+        "first": min(current.get("first", day), day).isoformat(),
+        "last": max(current.get("last", day), day).isoformat(),
+        # Counted on disk: a snapshot added twice is one file
+        "snapshots": sum(1 for _ in (root / "stations").glob("date=*/*.parquet")),
+    }
+    data["version"] = f"{data['snapshots']}-{datetime.now():%Y%m%d%H%M%S%f}"
+    tmp = root / f".manifest.{os.getpid()}"
+    tmp.write_text(json.dumps(data))
+    os.replace(tmp, root / "manifest.json")
+
+
+def _content_hash(stations) -> str:
+    return hashlib.sha256(pd.util.hash_pandas_object(stations, index=False).to_numpy().tobytes()).hexdigest()[:12]
+
+
+def add_snapshot(tables: dict, taken_at: datetime, root: Path = HISTORY_DIR):
+    """
+    Appends normalized tables (utils.prep) taken at `taken_at` to the history.
+    Files are named by time and content: two snapshots with the same time (e.g. dated file
+    names without an hour) are both kept, the same snapshot added twice is stored once.
+    """
+    stations = tables["stations"]
+    path = root / "stations" / f"date={taken_at:%Y-%m-%d}" / f"{taken_at:%H%M%S}-{_content_hash(stations)}.parquet"
+    if not path.exists():
+        _write_parquet(_station_table(stations, taken_at), path)
+    _update_daily(_daily_rows(tables, taken_at), root)
+    _write_manifest(root, taken_at.date())
+
+
+def ingest(paths, root: Path = HISTORY_DIR) -> int:
+    """
+    Adds dated station CSVs to the history, oldest first. Each snapshot is diffed against
+    the previous one (utils.prep.refresh): only moved or new stations go through the spatial join.
+    """
+    from utils.prep import normalize, refresh
+
+    previous = None
+    paths = sorted(paths, key=snapshot_time)
+    for path in paths:
+        df = load_data(path)
+        tables = normalize(df) if previous is None else refresh(previous, df)
+        add_snapshot(tables, snapshot_time(path), root)
+        previous = tables
+    return len(paths)
+
+
+@lru_cache(maxsize=4)
+def _dataset(name: str, root: Path, version: str):
+    """Dataset discovery (file listing) once per history version."""
+    return ds.dataset(root / name, format="parquet", partitioning=_PARTITIONING[name])
+
+
+def _daily_filter(communes, start: date, end: date):
+    expr = (
+        (ds.field("month") >= f"{start:%Y-%m}") & (ds.field("month") <= f"{end:%Y-%m}")
+        & (ds.field("date") >= start) & (ds.field("date") <= end)
+    )
+    if communes:
+        expr &= ds.field("commune_std").isin(sorted(communes))
+    return expr
+
+
+def trend(communes=None, start: date = None, end: date = None, root: Path = HISTORY_DIR) -> pd.DataFrame:
+    """
+    Daily stations and capacity per commune between `start` and `end` (inclusive).
+    Only the month partitions of the period and three columns are read.
+    """
+    info = manifest(root)
+    if not info:
+        return pd.DataFrame(columns=["date", "commune_std", "stations", "capacity_total"])
+    start, end = start or info["first"], end or info["last"]
+    table = _dataset("daily", root, info["version"]).to_table(
+        columns=["date", "commune_std", "stations", "capacity_total"],
+        filter=_daily_filter(communes, start, end),
+    )
+    return table.to_pandas().sort_values(["date", "commune_std"], ignore_index=True)
+
+
+def period_sketch(communes=None, start: date = None, end: date = None, root: Path = HISTORY_DIR) -> QuantileSketch:
+    """Capacity sketch over every (station, day) of the period, merged from the daily sketches."""
+    info = manifest(root)
+    if not info:
+        return QuantileSketch()
+    start, end = start or info["first"], end or info["last"]
+    table = _dataset("daily", root, info["version"]).to_table(
+        columns=["sketch"], filter=_daily_filter(communes, start, end)
+    )
+    return merge_all(QuantileSketch.from_bytes(b) for b in table.column("sketch").to_pylist())
+
+
+if __name__ == "__main__":
+    # python -m utils.history snapshots/velib-2024-08-*.csv
+    import sys
+
+    count = ingest([Path(p) for p in sys.argv[1:]])
+    print(f"{count} snapshot(s) added to {HISTORY_DIR}")
@@ -0,0 +1,184 @@
+"""
+Batch ingestion of many station CSVs on a process pool.
+
+    python -m utils.ingest operators/*.csv                 # one partition per file
+    python -m utils.ingest big.csv --tiles 64 --workers 32 # one partition per spatial tile
+    python -m utils.ingest operators/*.csv --publish       # + store and publish the tables
+
+Each worker receives the commune polygons once (as WKB, through the pool initializer),
+then turns partitions into partial tables: stations, per-commune counts and totals,
+capacity sketches and cube cells. The parent only merges these partials.
+"""
+import argparse
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from utils.io import load_data, iter_data
+from utils.prep import CORE_COLUMNS, _standardize, _core, _tables
+from utils.cube import build_cube, grouped_quantiles, merge_cubes
+from utils.sketch import merge_all, sketch_by
+
+# Parse columns kept when the parent splits rows into tiles (the commune is added by the worker)
+_TILE_COLUMNS = ["id_std", "name_std", "capacity_std", "lat", "lon"]
+
+_INDEX = None
+
+
+def _init_worker(names, wkb):
+    """Pool initializer: rebuilds the prepared polygon index once per worker process."""
+    import shapely
+
+    from utils.geo import CommuneIndex
+
+    global _INDEX
+    _INDEX = CommuneIndex(names, list(shapely.from_wkb(wkb)))
+
+
+def _polygons():
+    """(names, WKB) of the process-wide commune index, the payload of _init_worker."""
+    import shapely
+
+    from utils.geo import get_commune_index
+
+    index = get_commune_index()
+    return list(index.names[:-1]), list(shapely.to_wkb(index.geometries))
+
+
+def _partial(df: pd.DataFrame, order=None) -> dict:
+    """Stations of one partition with their commune, and everything the merge needs."""
+    df = df.assign(commune_std=_INDEX.classify(df["lat"].to_numpy(), df["lon"].to_numpy()))
+    core = _core(df)
+    if order is not None:
+        order = order[core.index.to_numpy()]
+    return {
+        "stations": core.reset_index(drop=True),
+        "order": order,
+        "by_commune": core.groupby("commune_std").agg(
+            stations=("id_std", "count"), capacity_total=("capacity_std", "sum")
+        ),
+        "sketches": sketch_by(core["commune_std"], core["capacity_std"]),
+        "cube": build_cube(core),
+    }
+
+
+def _file_partial(path) -> dict:
+    return _partial(_standardize(load_data(path)))
+
+
+def _tile_partial(rows: pd.DataFrame) -> dict:
+    rows = rows.reset_index(drop=True)
+    return _partial(rows.drop(columns="_order"), rows["_order"].to_numpy())
+
+
+def tile_of(lat, lon, tiles: int) -> np.ndarray:
+    """Tile number of each point on a ~sqrt(tiles) x sqrt(tiles) grid over the bounding box (0 without coordinates)."""
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    side = max(1, math.ceil(math.sqrt(tiles)))
+    ok = np.isfinite(lat) & np.isfinite(lon)
+    if not ok.any():
+        return np.zeros(len(lat), dtype=np.int64)
+    cells = []
+    for values in (lat, lon):
+        lo, hi = values[ok].min(), values[ok].max()
+        cell = np.floor((values - lo) / max(hi - lo, 1e-12) * side)
+        cells.append(np.clip(np.nan_to_num(cell), 0, side - 1).astype(np.int64))
+    return cells[0] * side + cells[1]
+
+
+def _tiles(paths, tiles: int):
+    """Rows of every file split by spatial tile, with their position in the concatenated input."""
+    frames = [_standardize(batch)[_TILE_COLUMNS] for path in paths for batch in iter_data(path)]
+    rows = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=_TILE_COLUMNS)
+    rows["_order"] = np.arange(len(rows))
+    tile = tile_of(rows["lat"], rows["lon"], tiles)
+    return [part for _, part in rows.groupby(tile, sort=True)]
+
+
+def merge_partials(partials) -> dict:
+    """Final tables (utils.prep layout) from partition partials: sums, sketch merges, cube cells."""
+    partials = list(partials)
+    if not partials:
+        return _tables(pd.DataFrame(columns=CORE_COLUMNS))
+
+    stations = pd.concat([p["stations"] for p in partials], ignore_index=True)
+    if all(p["order"] is not None for p in partials):
+        # Tiles: back to the order of the input rows
+        order = np.concatenate([p["order"] for p in partials])
+        stations = stations.iloc[np.argsort(order, kind="stable")].reset_index(drop=True)
+
+    sketches = {}
+    for p in partials:
+        for commune, sketch in p["sketches"].items():
+            sketches.setdefault(commune, []).append(sketch)
+    sketches = {c: merge_all(parts) for c, parts in sorted(sketches.items())}
+
+    # Exact medians from the merged cube (one cell per capacity value)
+    cube = merge_cubes([p["cube"] for p in partials])
+    by_com = pd.concat([p["by_commune"] for p in partials]).groupby(level=0).sum().reset_index()
+    medians = grouped_quantiles(cube, [0.5]).set_index("commune_std")[0.5]
+    by_com["capacity_median"] = by_com["commune_std"].astype(str).map(medians).to_numpy()
+    by_com = by_com.sort_values("capacity_total", ascending=False)
+
+    return _tables(stations, by_com, cube, sketches)
+
+
+def normalize_files(paths, workers: int = None, tiles: int = None) -> dict:
+    """
+    Same tables as utils.prep.normalize on the concatenated files, computed on `workers`
+    processes (all cores by default): one partition per file, or per spatial tile when
+    `tiles` is given (one large file).
+    """
+    paths = [Path(p) for p in paths]
+    workers = workers or os.cpu_count() or 1
+    if tiles:
+        parts, fn = _tiles(paths, tiles), _tile_partial
+    else:
+        parts, fn = paths, _file_partial
+
+    initargs = _polygons()
+    if workers == 1 or len(parts) <= 1:
+        _init_worker(*initargs)
+        return merge_partials(map(fn, parts))
+    with ProcessPoolExecutor(
+        max_workers=min(workers, len(parts)), mp_context=get_context("spawn"),
+        initializer=_init_worker, initargs=initargs,
+    ) as pool:
+        return merge_partials(pool.map(fn, parts))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", type=Path)
+    parser.add_argument("--workers", type=int, default=None, help="processes (default: all cores)")
+    parser.add_argument("--tiles", type=int, default=None, help="split the rows in N spatial tiles instead of per file")
+    parser.add_argument("--publish", action="store_true", help="store the tables and publish them (utils.cache)")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    tables = normalize_files(args.paths, args.workers, args.tiles)
+    print(f"{tables['stats']['n']:,} stations, {len(tables['by_commune'])} communes "
+          f"in {time.perf_counter() - start:.1f} s", file=sys.stderr)
+
+    if args.publish:
+        from utils.cache import _key, _file_digest, _set_latest, geo_key, record_source, write_tables
+        from utils.io import LOCAL_PATH
+
+        key = _key(*(_file_digest(p) for p in args.paths), geo_key())
+        write_tables(tables, key)
+        _set_latest(geo_key(), key)
+        if LOCAL_PATH.exists():
+            record_source(LOCAL_PATH)  # served until the app's own CSV changes
+        print(key)
+
+
+if __name__ == "__main__":
+    main()
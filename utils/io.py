@@ -1,13 +1,77 @@
+import codecs
+import os
 import pandas as pd
+import pyarrow as pa
 from pathlib import Path
 
-LOCAL_PATH = Path(__file__).parent.parent / "data" / "velib-emplacement-des-stations.csv"
+DATA_DIR = Path(__file__).parent.parent / "data"
+# VELIB_DATA_PATH points the app at another station file (e.g. a benchmark dataset)
+LOCAL_PATH = Path(os.environ.get("VELIB_DATA_PATH", DATA_DIR / "velib-emplacement-des-stations.csv"))
+ARR_PATH = DATA_DIR / "arrondissements.geojson"
+COM_PATH = DATA_DIR / "communes-version-simplifiee.geojson"
+
+# Columns of the data.gouv file and their type when streamed (other columns are dropped),
+# the dtypes pandas infers in load_data so both loaders give the same id_std / capacity_std
+SCHEMA = {
+    "Identifiant station": pa.int64(),
+    "Nom de la station": pa.string(),
+    "Capacité de la station": pa.int64(),
+    "Coordonnées géographiques": pa.string(),
+}
+
+_BOMS = [
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+]
+
+
+def detect_encoding(source_path: Path) -> str:
+    """Encoding read from the byte order mark, UTF-8 without one."""
+    with open(source_path, "rb") as f:
+        head = f.read(4)
+    for bom, encoding in _BOMS:
+        if head.startswith(bom):
+            return encoding
+    return "utf-8"
+
 
 def load_data(source_path: Path = LOCAL_PATH) -> pd.DataFrame:
     """
     Loads Vélib data from local CSV (separator ';')
     """
-    try:
-        return pd.read_csv(source_path, sep=";", encoding="utf-8-sig")
-    except UnicodeDecodeError:
-        return pd.read_csv(source_path, sep=";", encoding="utf-8")
+    return pd.read_csv(source_path, sep=";", encoding=detect_encoding(source_path))
+
+
+def iter_data(source_path: Path = LOCAL_PATH, batch_bytes: int = 16 << 20):
+    """
+    Streams the CSV as DataFrames of about `batch_bytes` of input each,
+    with the typed SCHEMA columns only (pyarrow reader, string columns stay Arrow-backed).
+    Files without the data.gouv headers are streamed whole, every column as a string.
+    """
+    import pyarrow.csv as pacsv
+
+    encoding = detect_encoding(source_path)
+    with open(source_path, encoding=encoding) as f:
+        header = f.readline().rstrip("\r\n").split(";")
+
+    known = [col for col in header if col in SCHEMA]
+    if known:
+        convert = pacsv.ConvertOptions(
+            column_types={col: SCHEMA[col] for col in known}, include_columns=known
+        )
+    else:
+        convert = pacsv.ConvertOptions(column_types={col: pa.string() for col in header})
+
+    reader = pacsv.open_csv(
+        source_path,
+        # pyarrow strips the UTF-8 BOM itself
+        read_options=pacsv.ReadOptions(
+            encoding="utf8" if encoding == "utf-8-sig" else encoding, block_size=batch_bytes
+        ),
+        parse_options=pacsv.ParseOptions(delimiter=";"),
+        convert_options=convert,
+    )
+    for batch in reader:
+        if batch.num_rows:
+            yield batch.to_pandas()
@@ -0,0 +1,323 @@
+import asyncio
+import os
+import random
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+# Live occupancy from a GBFS station_status feed, polled by one background asyncio task
+# per process. Samples go into preallocated (samples x stations) int16 ring buffers whose
+# columns are the rows of the normalized `stations` table: no Python object per sample,
+# memory fixed at 4 bytes x HISTORY_SAMPLES x stations (~1 MB for Paris).
+# Off unless VELIB_STATUS_URL is set, e.g. to the Vélib feed
+# https://velib-metropole-opendata.smovengo.cloud/opendata/Velib_Metropole/station_status.json
+# or to the local stand-in of serve().
+STATUS_URL = os.environ.get("VELIB_STATUS_URL", "")
+POLL_SECONDS = float(os.environ.get("VELIB_STATUS_POLL_S", "30"))
+# One hour of history at the default interval
+HISTORY_SAMPLES = 120
+REQUEST_TIMEOUT_S = 10
+BACKOFF_MAX_S = 600
+# "Critical right now": at most this many bikes (near empty) or free docks (near full)
+NEAR_EMPTY_BIKES = 2
+NEAR_FULL_DOCKS = 2
+# A sample older than this many intervals is reported as stale
+STALE_AFTER = 4
+
+MISSING = -1
+
+
+class StatusBuffer:
+    """Ring buffers of bikes / free docks per station; MISSING where a station did not report."""
+
+    def __init__(self, stations: int, depth: int = HISTORY_SAMPLES):
+        self.bikes = np.full((depth, stations), MISSING, dtype=np.int16)
+        self.docks = np.full((depth, stations), MISSING, dtype=np.int16)
+        self.times = np.zeros(depth)
+        self.head = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def record(self, positions, bikes, docks, ts: float):
+        """Writes one sample (one contiguous row, overwriting the oldest one when full)."""
+        row = self.head
+        self.bikes[row] = MISSING
+        self.docks[row] = MISSING
+        self.bikes[row, positions] = bikes
+        self.docks[row, positions] = docks
+        self.times[row] = ts
+        self.head = (row + 1) % len(self.times)
+        self.count = min(self.count + 1, len(self.times))
+
+    def latest(self):
+        """(time, bikes, docks) of the last sample (copies), None before the first one."""
+        if not self.count:
+            return None
+        row = (self.head - 1) % len(self.times)
+        return self.times[row], self.bikes[row].copy(), self.docks[row].copy()
+
+    def window(self):
+        """(times, bikes, docks) of the buffered samples, oldest first."""
+        rows = (self.head - self.count + np.arange(self.count)) % len(self.times)
+        return self.times[rows], self.bikes[rows], self.docks[rows]
+
+    def reindexed(self, take: np.ndarray) -> "StatusBuffer":
+        """Buffer for another station table: column i comes from old column take[i] (-1: new station)."""
+        other = StatusBuffer(len(take), len(self.times))
+        known = take >= 0
+        other.bikes[:, known] = self.bikes[:, take[known]]
+        other.docks[:, known] = self.docks[:, take[known]]
+        other.times[:] = self.times
+        other.head, other.count = self.head, self.count
+        return other
+
+
+def parse_status(payload: dict):
+    """(station codes, bikes, free docks, feed time) from a GBFS station_status document."""
+    stations = payload["data"]["stations"]
+    codes = [str(s.get("stationCode", s.get("station_id"))) for s in stations]
+    bikes = np.fromiter((s.get("num_bikes_available", MISSING) for s in stations), np.int16, len(stations))
+    docks = np.fromiter((s.get("num_docks_available", MISSING) for s in stations), np.int16, len(stations))
+    return codes, bikes, docks, float(payload.get("last_updated") or time.time())
+
+
+class StatusPoller:
+    """
+    Polls `url` every `interval` seconds in a daemon thread running an asyncio loop.
+    Requests are conditional (ETag / Last-Modified): an unchanged feed costs a 304 and no
+    parsing. Errors back off exponentially (with jitter) up to BACKOFF_MAX_S.
+    """
+
+    def __init__(self, url: str = STATUS_URL, interval: float = POLL_SECONDS, depth: int = HISTORY_SAMPLES):
+        self.url = url
+        self.interval = interval
+        self.buffer = StatusBuffer(0, depth)
+        self.version = None
+        self.etag = None
+        self.last_modified = None
+        self.polls = 0
+        self.not_modified = 0
+        self.failures = 0
+        self.last_error = None
+        self._ids = pd.Index([], dtype=object)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._loop = None
+        self._task = None
+
+    def attach(self, ids, version):
+        """Aligns the buffers on a station table (rows = buffer columns). Cheap when `version` is unchanged."""
+        with self._lock:
+            if version == self.version and self.version is not None:
+                return
+            ids = pd.Index(pd.Series(ids).astype(str).to_numpy(), dtype=object)
+            take = self._ids.get_indexer(ids) if self._ids.is_unique else np.full(len(ids), -1)
+            self.buffer = self.buffer.reindexed(take)
+            self._ids, self.version = ids, version
+
+    def latest(self):
+        with self._lock:
+            return self.buffer.latest()
+
+    def ingest(self, payload: dict) -> int:
+        """Records one station_status document, returns the number of known stations in it."""
+        codes, bikes, docks, ts = parse_status(payload)
+        with self._lock:
+            positions = self._ids.get_indexer(codes)
+            known = positions >= 0
+            self.buffer.record(positions[known], bikes[known], docks[known], ts)
+        return int(known.sum())
+
+    def _fetch(self):
+        """Blocking conditional GET (run in a worker thread): the JSON, or None when not modified."""
+        import requests
+
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        response = requests.get(self.url, headers=headers, timeout=REQUEST_TIMEOUT_S)
+        if response.status_code == 304:
+            return None
+        response.raise_for_status()
+        payload = response.json()
+        self.etag = response.headers.get("ETag")
+        self.last_modified = response.headers.get("Last-Modified")
+        return payload
+
+    async def poll_once(self) -> bool:
+        """One request; True when a new sample was recorded."""
+        payload = await asyncio.to_thread(self._fetch)
+        self.polls += 1
+        if payload is None:
+            self.not_modified += 1
+            return False
+        self.ingest(payload)
+        return True
+
+    def next_delay(self) -> float:
+        if not self.failures:
+            return self.interval
+        return min(BACKOFF_MAX_S, self.interval * 2 ** self.failures) * random.uniform(0.5, 1.0)
+
+    async def run(self):
+        import requests
+
+        while True:
+            try:
+                await self.poll_once()
+                self.failures, self.last_error = 0, None
+            except (requests.RequestException, ValueError, KeyError, TypeError) as e:
+                self.failures += 1
+                self.last_error = f"{type(e).__name__}: {str(e)[:120]}"
+            await asyncio.sleep(self.next_delay())
+
+    def start(self):
+        if self._thread is not None:
+            return self
+        ready = threading.Event()
+
+        def main():
+            self._loop = asyncio.new_event_loop()
+            self._task = self._loop.create_task(self.run())
+            ready.set()
+            try:
+                self._loop.run_until_complete(self._task)
+            except asyncio.CancelledError:
+                pass
+            finally:
+                self._loop.close()
+
+        self._thread = threading.Thread(target=main, name="velib-status-poller", daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def stop(self, timeout: float = 5.0):
+        if self._thread is None:
+            return
+        self._loop.call_soon_threadsafe(self._task.cancel)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def status(self) -> dict:
+        latest = self.latest()
+        return {
+            "url": self.url,
+            "samples": len(self.buffer),
+            "age_s": time.time() - latest[0] if latest else None,
+            "polls": self.polls,
+            "not_modified": self.not_modified,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "bytes": self.buffer.bikes.nbytes + self.buffer.docks.nbytes,
+        }
+
+
+_POLLER = None
+_POLLER_LOCK = threading.Lock()
+
+
+def get_poller():
+    """The process-wide poller, started on first use (None unless VELIB_STATUS_URL is set)."""
+    global _POLLER
+    if not STATUS_URL:
+        return None
+    with _POLLER_LOCK:
+        if _POLLER is None:
+            _POLLER = StatusPoller().start()
+        return _POLLER
+
+
+def critical_by_commune(latest, store, communes=None) -> pd.DataFrame:
+    """
+    Reporting, near-empty and near-full stations per commune in the `latest` sample,
+    one bincount per metric over the commune codes of the station store.
+    """
+    _, bikes, docks = latest
+    codes = store.frame["commune_std"].cat.codes.to_numpy()
+    reporting = bikes >= 0
+    if communes:
+        reporting &= np.isin(codes, store.communes.get_indexer(list(communes)))
+    n = len(store.communes)
+    df = pd.DataFrame({
+        "commune_std": store.communes,
+        "reporting": np.bincount(codes, weights=reporting, minlength=n).astype(np.int64),
+        "near_empty": np.bincount(codes, weights=reporting & (bikes <= NEAR_EMPTY_BIKES), minlength=n).astype(np.int64),
+        "near_full": np.bincount(codes, weights=reporting & (docks <= NEAR_FULL_DOCKS), minlength=n).astype(np.int64),
+    })
+    df = df[df["reporting"] > 0]
+    return df.sort_values(["near_empty", "near_full"], ascending=False, ignore_index=True)
+
+
+def _stand_in_feed(stations: pd.DataFrame, rng) -> dict:
+    capacity = stations["capacity_std"].to_numpy(dtype=np.int64)
+    bikes = rng.integers(0, capacity + 1)
+    return {
+        "last_updated": int(time.time()),
+        "ttl": int(POLL_SECONDS),
+        "data": {"stations": [
+            {"stationCode": str(code), "num_bikes_available": int(b), "num_docks_available": int(c - b)}
+            for code, b, c in zip(stations["id_std"], bikes, capacity)
+        ]},
+    }
+
+
+def serve(port: int = 8765, interval: float = POLL_SECONDS):
+    """
+    Local stand-in for the GBFS feed, built from the local station table: random occupancy,
+    renewed every `interval` seconds, with ETag / Last-Modified and 304 answers.
+    """
+    import json
+    from email.utils import formatdate
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    from utils.cache import load_tables
+
+    stations = load_tables()["stations"]
+    rng = np.random.default_rng()
+    state = {"expires": 0.0}
+
+    def current():
+        now = time.time()
+        if now >= state["expires"]:
+            body = json.dumps(_stand_in_feed(stations, rng)).encode()
+            state.update(body=body, etag=f'"{hash(body) & 0xFFFFFFFF:08x}"', modified=formatdate(now, usegmt=True))
+            state["expires"] = now + interval
+        return state
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            feed = current()
+            if self.headers.get("If-None-Match") == feed["etag"] or (
+                not self.headers.get("If-None-Match") and self.headers.get("If-Modified-Since") == feed["modified"]
+            ):
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("ETag", feed["etag"])
+            self.send_header("Last-Modified", feed["modified"])
+            self.send_header("Content-Length", str(len(feed["body"])))
+            self.end_headers()
+            self.wfile.write(feed["body"])
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    print(f"station_status stand-in on http://127.0.0.1:{port}/station_status.json")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    # python -m utils.live [port]   then   VELIB_STATUS_URL=http://127.0.0.1:8765/ streamlit run app.py
+    import sys
+
+    serve(int(sys.argv[1]) if len(sys.argv) > 1 else 8765)
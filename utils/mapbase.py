@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+
+# Map helpers without plotly, shared by utils.viz and utils.deck: choosing the pydeck
+# backend (or serving the tables) does not import plotly.
+
+# plotly.express.colors.qualitative.Safe (colour-blind safe)
+SAFE_COLORS = [
+    "rgb(136, 204, 238)", "rgb(204, 102, 119)", "rgb(221, 204, 119)", "rgb(17, 119, 51)",
+    "rgb(51, 34, 136)", "rgb(170, 68, 153)", "rgb(68, 170, 153)", "rgb(153, 153, 51)",
+    "rgb(136, 34, 85)", "rgb(102, 17, 0)", "rgb(136, 136, 136)",
+]
+
+
+def commune_palette(communes) -> dict:
+    """
+    Defines the common palette for all figures (Plotly and pydeck).
+    It generates a {commune: color} dictionary, computed once per data version
+    (tables["colors"]) and passed to the figure builders as `colors`.
+    """
+    palette = SAFE_COLORS
+    return {
+        com: palette[i % len(palette)] for i, com in enumerate(communes)
+    }
+
+# Level of detail: above LOD_MAX_POINTS stations the map shows one marker per
+# (commune, grid cell) instead of one per station. Cells are LOD_CELL_PX screen
+# pixels wide at the requested zoom, so the payload depends on the viewport, not on n.
+LOD_MAX_POINTS = 5000
+LOD_CELL_PX = 32
+LOD_POINT_ZOOM = 15
+# Detail is only kept within LOD_PAD viewport sizes on each side of the visible area,
+# so panning still shows every station; farther away, cells are 2**LOD_OUTER_STEP times wider.
+LOD_PAD = 3
+LOD_OUTER_STEP = 4
+MAP_HEIGHT = 520
+MAP_WIDTH = 1400  # generous guess of the rendered width, used to crop to the viewport
+
+
+def _mercator(lat, lon):
+    """Web-mercator coordinates normalized to [0, 1] (the zoom 0 tile)."""
+    lat = np.clip(np.radians(np.asarray(lat, dtype="float64")), -1.4844, 1.4844)
+    x = (np.asarray(lon, dtype="float64") + 180.0) / 360.0
+    y = (1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / np.pi) / 2.0
+    return x, y
+
+
+def bin_stations(df, zoom):
+    """
+    Aggregates stations per (commune, grid cell) for a given zoom level:
+    station count, capacity sum and capacity-weighted centroid.
+    """
+    x, y = _mercator(df["lat"], df["lon"])
+    cells_per_unit = (2 ** zoom) * 256 / LOD_CELL_PX
+    cap = df["capacity_std"].to_numpy(dtype="float64")
+    d = pd.DataFrame({
+        "commune_std": df["commune_std"].to_numpy(),
+        "cell_x": np.floor(x * cells_per_unit).astype("int64"),
+        "cell_y": np.floor(y * cells_per_unit).astype("int64"),
+        "capacity_std": cap,
+        "w_lat": df["lat"].to_numpy() * cap,
+        "w_lon": df["lon"].to_numpy() * cap,
+    })
+    cells = (
+        d.groupby(["commune_std", "cell_x", "cell_y"], sort=False)
+        .agg(
+            stations=("capacity_std", "size"),
+            capacity_total=("capacity_std", "sum"),
+            w_lat=("w_lat", "sum"),
+            w_lon=("w_lon", "sum"),
+        )
+        .reset_index()
+    )
+    total = cells["capacity_total"].where(cells["capacity_total"] > 0)
+    cells["lat"] = cells["w_lat"] / total
+    cells["lon"] = cells["w_lon"] / total
+    return cells.drop(columns=["w_lat", "w_lon"])
+
+
+def bin_cells(cells, zoom):
+    """Merges binned cells (see bin_stations) into the coarser grid of `zoom`, keeping counts and totals."""
+    cells = cells[cells["lat"].notna()]
+    x, y = _mercator(cells["lat"], cells["lon"])
+    cells_per_unit = (2 ** zoom) * 256 / LOD_CELL_PX
+    cap = cells["capacity_total"].to_numpy(dtype="float64")
+    d = pd.DataFrame({
+        "commune_std": cells["commune_std"].to_numpy(),
+        "cell_x": np.floor(x * cells_per_unit).astype("int64"),
+        "cell_y": np.floor(y * cells_per_unit).astype("int64"),
+        "stations": cells["stations"].to_numpy(),
+        "capacity_total": cap,
+        "w_lat": cells["lat"].to_numpy() * cap,
+        "w_lon": cells["lon"].to_numpy() * cap,
+    })
+    merged = d.groupby(["commune_std", "cell_x", "cell_y"], sort=False).sum().reset_index()
+    total = merged["capacity_total"].where(merged["capacity_total"] > 0)
+    merged["lat"] = merged["w_lat"] / total
+    merged["lon"] = merged["w_lon"] / total
+    return merged.drop(columns=["w_lat", "w_lon"])
+
+
+def in_viewport(lat, lon, center, zoom, width=MAP_WIDTH, height=MAP_HEIGHT, pad=0):
+    """Mask of the positions visible around `center` ({'lat', 'lon'}) at `zoom`, plus `pad` viewport sizes on each side."""
+    x, y = _mercator(lat, lon)
+    cx, cy = _mercator(center["lat"], center["lon"])
+    scale = (2 ** zoom) * 256
+    return (np.abs(x - cx) * scale <= width * (0.5 + pad)) & (np.abs(y - cy) * scale <= height * (0.5 + pad))
+
+
+def image_source(png: bytes) -> str:
+    import base64
+
+    return "data:image/png;base64," + base64.b64encode(png).decode()
@@ -0,0 +1,222 @@
+import heapq
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils.raster import WALK_SPEED_M_MIN, WALK_DETOUR
+
+# Where to add docks: every pick adds STEP_DOCKS at one candidate, either an existing
+# station or a new site on a CANDIDATE_SPACING_M lattice inside Paris (away from stations).
+# Paris only: demand and candidates come from the accessibility grid (utils.raster),
+# which covers the arrondissements; suburban communes and their stations are left out.
+STEP_DOCKS = 10
+MAX_PICKS_PER_SITE = 3
+CANDIDATE_SPACING_M = 100.0
+MIN_NEW_SITE_DISTANCE_M = 150.0
+# Candidates whose gain is refreshed together in each lazy-greedy round
+BATCH = 64
+# A refreshed gain within TOLERANCE of the best upper bound is taken (1 - 1/e - TOLERANCE guarantee)
+TOLERANCE = 0.02
+# Demand cells per walking disc above which the grid is coarsened (long walks)
+MAX_REACH_CELLS = 600
+# Equity weighting (equity_weights): the cells of a commune with fewer docks per km² than the
+# whole area count up to 1 + EQUITY_BOOST times more, in proportion to the shortfall
+EQUITY_BOOST = 1.0
+
+
+def utility(docks):
+    """Benefit of `docks` reachable from one cell: concave, so underserved cells gain the most."""
+    return np.log1p(docks)
+
+
+def _disk_offsets(radius_cells: float):
+    r = int(np.floor(radius_cells))
+    dy, dx = np.mgrid[-r:r + 1, -r:r + 1]
+    inside = dx ** 2 + dy ** 2 <= radius_cells ** 2
+    return dy[inside], dx[inside]
+
+
+def candidates(coverage, stations) -> pd.DataFrame:
+    """Existing stations inside the area (Paris) + lattice sites in the area without a station nearby."""
+    grid = coverage.grid
+    rows, cols = grid.to_cells(stations["lat"], stations["lon"])
+    r, c = np.rint(rows).astype(np.int64), np.rint(cols).astype(np.int64)
+    inside = (r >= 0) & (r < grid.height) & (c >= 0) & (c < grid.width)
+    inside[inside] = coverage.mask[r[inside], c[inside]]
+    existing = pd.DataFrame({
+        "kind": "Expand station",
+        "name": stations["name_std"].to_numpy()[inside],
+        "commune": stations["commune_std"].to_numpy()[inside],
+        "row": r[inside],
+        "col": c[inside],
+    })
+
+    step = max(int(round(CANDIDATE_SPACING_M / grid.cell_m)), 1)
+    lr, lc = np.mgrid[step // 2:grid.height:step, step // 2:grid.width:step]
+    lr, lc = lr.ravel(), lc.ravel()
+    keep = coverage.mask[lr, lc] & (coverage.dist_m[lr, lc] >= MIN_NEW_SITE_DISTANCE_M)
+    new = pd.DataFrame({"kind": "New station", "name": "", "commune": "", "row": lr[keep], "col": lc[keep]})
+    return pd.concat([existing, new], ignore_index=True)
+
+
+def commune_density(coverage, stations) -> tuple:
+    """
+    (area in km² of grid cells, docks and docks per km² of each commune of the area,
+    commune of every cell of the area in coverage.mask order)
+    """
+    from utils.geo import get_commune_index
+
+    grid = coverage.grid
+    lat, lon = grid.centers()
+    labels = get_commune_index().classify(lat[coverage.mask], lon[coverage.mask])
+    area = pd.Series(labels).value_counts() * grid.cell_m ** 2 / 1e6
+    docks = stations.groupby("commune_std", observed=True)["capacity_std"].sum()
+    density = pd.DataFrame({"area_km2": area, "docks": docks.reindex(area.index, fill_value=0)})
+    density["docks_per_km2"] = density["docks"] / density["area_km2"]
+    return density.rename_axis("commune"), labels
+
+
+def equity_weights(coverage, stations) -> tuple:
+    """
+    (demand raster for optimize, density table) where each cell is weighted by the dock
+    deficit of its commune: 1 at or above the docks per km² of the whole area,
+    up to 1 + EQUITY_BOOST for a commune without docks.
+    """
+    density, labels = commune_density(coverage, stations)
+    target = density["docks"].sum() / density["area_km2"].sum()
+    density["weight"] = 1 + EQUITY_BOOST * np.clip(1 - density["docks_per_km2"] / target, 0, 1)
+    weights = np.zeros(coverage.grid.shape)
+    weights[coverage.mask] = density["weight"].reindex(labels).to_numpy()
+    return weights, density
+
+
+def _coarsen(values: np.ndarray, factor: int) -> np.ndarray:
+    """Sums over factor x factor blocks."""
+    if factor == 1:
+        return values
+    h, w = values.shape
+    padded = np.zeros((-(-h // factor) * factor, -(-w // factor) * factor))
+    padded[:h, :w] = values
+    return padded.reshape(padded.shape[0] // factor, factor, padded.shape[1] // factor, factor).sum(axis=(1, 3))
+
+
+def _padded(values: np.ndarray, pad: int) -> np.ndarray:
+    """`values` with `pad` zero cells around: a disc around any cell of the grid stays inside."""
+    out = np.zeros((values.shape[0] + 2 * pad, values.shape[1] + 2 * pad))
+    out[pad:pad + values.shape[0], pad:pad + values.shape[1]] = values
+    return out
+
+
+def _gains(js, base, offsets, supply, weights):
+    """Marginal gain of STEP_DOCKS more at each candidate of `js`, in one vectorized pass."""
+    cells = base[js][:, None] + offsets
+    s = supply[cells]
+    return (weights[cells] * (utility(s + STEP_DOCKS) - utility(s))).sum(axis=1)
+
+
+def _all_gains(base, shape, radius_cells, supply, weights):
+    """
+    Marginal gains of every candidate at once: the gain field summed over a disc is a
+    convolution with the disc kernel (FFT), read at the candidate cells.
+    """
+    from utils.raster import _disk_fft
+
+    field = (weights * (utility(supply + STEP_DOCKS) - utility(supply))).reshape(shape)
+    sums = np.fft.irfft2(np.fft.rfft2(field) * _disk_fft(shape, radius_cells), shape)
+    # Rounded off the FFT noise, so equal discs keep equal gains (ties go to the lower index)
+    return np.maximum(np.round(sums.ravel()[base], 9), 0.0)
+
+
+def optimize(coverage, stations, budget: int, minutes: float = 5.0, weights=None) -> dict:
+    """
+    Lazy-greedy placement of `budget` docks (in STEP_DOCKS increments) maximizing
+    sum over the cells of Paris of weight x utility(docks reachable within `minutes`).
+    `weights` is a demand raster (e.g. residents per cell, or equity_weights); by default
+    every cell of the area counts the same, parks included. The unserved shares are
+    shares of the area whatever the weights.
+    The objective is submodular, so a stale gain is an upper bound: the first gains of all
+    candidates come from one FFT convolution, then candidates are popped from a max-heap
+    BATCH at a time, refreshed with one NumPy pass, and the best fresh one is taken when
+    it still beats every remaining upper bound.
+    """
+    start = time.perf_counter()
+    cand = candidates(coverage, stations)
+    weights = coverage.mask.astype(np.float64) if weights is None else np.nan_to_num(weights) * coverage.mask
+    docks = np.nan_to_num(coverage.docks_within(minutes))
+
+    # Long walks: demand and supply on blocks of factor x factor cells (weighted means)
+    radius_cells = minutes * WALK_SPEED_M_MIN / WALK_DETOUR / coverage.grid.cell_m
+    factor = max(1, int(np.ceil(np.sqrt(np.pi * radius_cells ** 2 / MAX_REACH_CELLS))))
+    radius_cells /= factor
+    total = _coarsen(weights, factor)
+    supply = _coarsen(weights * docks, factor) / np.maximum(total, 1e-12)
+    area = _coarsen(coverage.mask.astype(np.float64), factor)
+
+    # Disc of a candidate = its flat cell index + fixed offsets, on a zero-padded grid
+    pad = int(np.floor(radius_cells))
+    total, supply, area = _padded(total, pad), _padded(supply, pad), _padded(area, pad).ravel()
+    shape, width = total.shape, total.shape[1]
+    dy, dx = _disk_offsets(radius_cells)
+    offsets = (dy * width + dx)[None, :]
+    base = (cand["row"].to_numpy() // factor + pad) * width + cand["col"].to_numpy() // factor + pad
+    weights, supply = total.ravel(), supply.ravel()
+    before = supply.copy()
+
+    gains = _all_gains(base, shape, radius_cells, supply, weights)
+    heap = [(-g, j) for j, g in enumerate(gains.tolist()) if g > 0]
+    heapq.heapify(heap)
+    picks = np.zeros(len(cand), dtype=np.int64)
+    first = np.zeros(len(cand), dtype=np.int64)
+    evaluations = len(cand)
+
+    for _ in range(int(budget) // STEP_DOCKS):
+        chosen = None
+        while heap and chosen is None:
+            batch = [heapq.heappop(heap)[1] for _ in range(min(BATCH, len(heap)))]
+            fresh = _gains(np.array(batch), base, offsets, supply, weights)
+            evaluations += len(batch)
+            best = int(np.argmax(fresh))
+            bound = -heap[0][0] if heap else -np.inf
+            if fresh[best] >= (1 - TOLERANCE) * bound:
+                chosen = batch[best]
+            for j, g in zip(batch, fresh):
+                if j != chosen and g > 0:
+                    heapq.heappush(heap, (-g, j))
+        if chosen is None:
+            break
+        supply[base[chosen] + offsets[0]] += STEP_DOCKS
+        picks[chosen] += 1
+        first[chosen] = first[chosen] or picks.sum()
+        if picks[chosen] < MAX_PICKS_PER_SITE:
+            g = _gains(np.array([chosen]), base, offsets, supply, weights)[0]
+            if g > 0:
+                heapq.heappush(heap, (-g, chosen))
+
+    chosen = np.flatnonzero(picks)
+    result = cand.iloc[chosen].reset_index(drop=True)
+    lat, lon = coverage.grid.centers()
+    result["lat"] = lat[result["row"], result["col"]]
+    result["lon"] = lon[result["row"], result["col"]]
+    result["docks_added"] = picks[chosen] * STEP_DOCKS
+    result["rank"] = first[chosen]
+    new = (result["kind"] == "New station").to_numpy()
+    if new.any():
+        from utils.geo import get_commune_index
+
+        result.loc[new, "commune"] = get_commune_index().classify(result.loc[new, "lat"], result.loc[new, "lon"])
+    result = result.sort_values("rank").drop(columns=["row", "col"]).reset_index(drop=True)
+
+    demand = weights / max(weights.sum(), 1e-9)
+    area = area / max(area.sum(), 1e-9)
+    return {
+        "picks": result,
+        "docks_added": int(picks.sum() * STEP_DOCKS),
+        "objective_before": float(demand @ utility(before)),
+        "objective_after": float(demand @ utility(supply)),
+        "unserved_before": float(area @ (before < 1)),
+        "unserved_after": float(area @ (supply < 1)),
+        "candidates": len(cand),
+        "evaluations": evaluations,
+        "seconds": time.perf_counter() - start,
+    }
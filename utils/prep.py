@@ -1,10 +1,12 @@
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
 import unicodedata
-import geopandas as gpd
-from shapely.geometry import Point
-from pathlib import Path
 import re
+from functools import lru_cache
+from utils.cube import build_cube, index_communes, replace_communes
+from utils.sketch import sketch_by
 
 
 def _format_arr_label(l_ar: str) -> str:
@@ -19,52 +21,15 @@ def _format_arr_label(l_ar: str) -> str:
     return f"Paris - {n}{suffix} arrondissement"
 
 def assign_commune_geojson(df):
-    base_dir = Path(__file__).resolve().parents[1]
-    path_arr = base_dir / "data" / "arrondissements.geojson"
-    path_com = base_dir / "data" / "communes-version-simplifiee.geojson"
-
-    # Load districts and KEEP only the ar
-    gdf_arr = gpd.read_file(path_arr).to_crs("EPSG:4326")
-    if "l_ar" not in gdf_arr.columns:
-        raise ValueError("Le GeoJSON d'arrondissements doit contenir 'l_ar'.")
-    gdf_arr = gdf_arr[["l_ar", "geometry"]].copy()
-    gdf_arr["arrondissement_nom"] = gdf_arr["l_ar"].apply(_format_arr_label)
-
-    # Charging municipalities
-    gdf_com = gpd.read_file(path_com).to_crs("EPSG:4326")
-    gdf_com = gdf_com[["nom", "geometry"]].rename(columns={"nom": "commune_nom"})
-
-    # Vélib -> GeoDataFrame
-    gdf = gpd.GeoDataFrame(
-        df.copy(),
-        geometry=gpd.points_from_xy(df["lon"], df["lat"]),
-        crs="EPSG:4326",
-    )
-
-    # Spatial join (boroughs first)
-    gdf = gpd.sjoin(
-        gdf,
-        gdf_arr[["arrondissement_nom", "geometry"]],
-        how="left",
-        predicate="within",
-    ).drop(columns=["index_right"], errors="ignore")
-
-    # Spatial joint (communes)
-    gdf = gpd.sjoin(
-        gdf,
-        gdf_com[["commune_nom", "geometry"]],
-        how="left",
-        predicate="within",
-    ).drop(columns=["index_right"], errors="ignore")
-
-    gdf["commune_std"] = gdf["arrondissement_nom"].where(
-        gdf["arrondissement_nom"].notna(), gdf["commune_nom"]
-    ).fillna("(Inconnu)")
-
-    gdf = gdf.drop(columns=[c for c in gdf.columns if c in {"l_ar", "l_aroff"}], errors="ignore")
-    gdf = gdf.drop(columns=["geometry"], errors="ignore")
+    """
+    Adds 'commune_std' from the 'lat'/'lon' columns:
+    Paris arrondissement first, then municipality, '(Inconnu)' otherwise.
+    """
+    # Imported here: serving precomputed tables never needs the polygons
+    from utils.geo import get_commune_index
 
-    return pd.DataFrame(gdf)
+    index = get_commune_index()
+    return df.assign(commune_std=index.classify(df["lat"].to_numpy(), df["lon"].to_numpy()))
 
 
 def _norm(s: str) -> str:
@@ -76,8 +41,9 @@ def _norm(s: str) -> str:
     return s.lower()
 
 
-def _find_column(df: pd.DataFrame, keywords: list):
-    norm_map = {col: _norm(col) for col in df.columns}
+@lru_cache(maxsize=64)
+def _match_column(columns: tuple, keywords: tuple):
+    norm_map = {col: _norm(col) for col in columns}
     for col, normcol in norm_map.items():
         tokens = normcol.split()
         for kw in keywords:
@@ -89,60 +55,232 @@ def _find_column(df: pd.DataFrame, keywords: list):
                 return col
     return None
 
-def normalize(df: pd.DataFrame):
+
+def _find_column(df: pd.DataFrame, keywords: list):
+    return _match_column(tuple(df.columns), tuple(keywords))
+
+
+def _exact_column(columns: tuple, names: set):
+    """Column whose whole normalized header is one of `names` (e.g. 'lat', 'Latitude')."""
+    for col in columns:
+        if _norm(col).strip().replace("_", " ") in names:
+            return col
+    return None
+
+
+@lru_cache(maxsize=64)
+def _resolve_columns(columns: tuple) -> dict:
     """
-    Normalizes the Vélib file downloaded from data.gouv.fr
-    (Station identifier, Station name, Station capacity, Geographic coordinates).
+    Maps the raw headers to the standard fields, once per schema.
+    Coordinates come either from two 'lat'/'lon' columns or from a single column
+    ("lat, lon" string, WKT point or GeoJSON point).
     """
-    col_id = _find_column(df, ["identifiant", "id"] ) or "Identifiant station"
-    col_name = _find_column(df, ["nom", "name"]) or "Nom de la station"
-    col_cap = _find_column(df, ["capacit", "capacity", "capacite"]) or "Capacité de la station"
-    col_geo = _find_column(df, ["coord", "geograph", "latitude", "longitude"]) or "Coordonnées géographiques"
-
-    if col_geo in df.columns:
-        parts = (
-            df[col_geo]
-            .astype(str)
-            .str.replace(r"[\(\)\[\]]", "", regex=True)
-            .str.split(",", n=1, expand=True)
+    lat = _exact_column(columns, {"lat", "latitude", "y"})
+    lon = _exact_column(columns, {"lon", "lng", "long", "longitude", "x"})
+    if lat is None or lon is None:
+        lat = lon = None
+
+    geo = None
+    if lat is None:
+        geo = (
+            _match_column(columns, ("coord", "geograph", "latitude", "longitude", "geo point", "geometry", "wkt"))
+            or "Coordonnées géographiques"
         )
-        df["lat"] = pd.to_numeric(parts[0].str.strip(), errors="coerce")
-        df["lon"] = pd.to_numeric(parts[1].str.strip(), errors="coerce")
+
+    return {
+        "id": _match_column(columns, ("identifiant", "id")) or "Identifiant station",
+        "name": _match_column(columns, ("nom", "name")) or "Nom de la station",
+        "cap": _match_column(columns, ("capacit", "capacity", "capacite")) or "Capacité de la station",
+        "geo": geo,
+        "lat": lat,
+        "lon": lon,
+    }
+
+
+_NUM = r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?"
+_PAIR = rf"(?P<a>{_NUM})[\s,;]+(?P<b>{_NUM})"
+
+
+def parse_coordinates(values) -> tuple:
+    """
+    Splits a coordinate column into (lat, lon) float64 arrays with pyarrow kernels.
+    Accepts "lat, lon" (optionally in brackets), WKT "POINT (lon lat)"
+    and GeoJSON '{"type": "Point", "coordinates": [lon, lat]}'.
+    Unparsable values give NaN.
+    """
+    arr = pa.array(values, from_pandas=True)
+    if not pa.types.is_string(arr.type) and not pa.types.is_large_string(arr.type):
+        arr = pc.cast(arr, pa.string())
+
+    # Fast path: clean "lat, lon" strings, a split and two casts
+    try:
+        parts = pc.split_pattern(arr, ",", max_splits=1)
+        lat = pc.cast(pc.utf8_trim(pc.list_element(parts, 0), " ()[]"), pa.float64())
+        lon = pc.cast(pc.utf8_trim(pc.list_element(parts, 1), " ()[]"), pa.float64())
+    except (pa.ArrowInvalid, IndexError):
+        # Any other shape: pick the first two numbers of each value
+        pairs = pc.extract_regex(arr, _PAIR)
+        a = pc.cast(pc.struct_field(pairs, "a"), pa.float64())
+        b = pc.cast(pc.struct_field(pairs, "b"), pa.float64())
+        # WKT and GeoJSON store longitude first
+        lon_first = pc.fill_null(pc.match_substring_regex(arr, r"^\s*(POINT|\{)", ignore_case=True), False)
+        lat, lon = pc.if_else(lon_first, b, a), pc.if_else(lon_first, a, b)
+
+    return (
+        lat.to_numpy(zero_copy_only=False).astype("float64", copy=False),
+        lon.to_numpy(zero_copy_only=False).astype("float64", copy=False),
+    )
+
+
+QUANTILES = [0.1, 0.25, 0.5, 0.75, 0.9]
+CORE_COLUMNS = ["id_std", "name_std", "commune_std", "capacity_std", "lat", "lon"]
+
+
+def _standardize(df: pd.DataFrame) -> pd.DataFrame:
+    """Adds the *_std, lat and lon columns (everything except the commune)."""
+    cols = _resolve_columns(tuple(df.columns))
+
+    if cols["lat"] is not None:
+        df["lat"] = pd.to_numeric(df[cols["lat"]], errors="coerce").astype("float64")
+        df["lon"] = pd.to_numeric(df[cols["lon"]], errors="coerce").astype("float64")
+    elif cols["geo"] in df.columns:
+        df["lat"], df["lon"] = parse_coordinates(df[cols["geo"]])
     else:
         df["lat"], df["lon"] = np.nan, np.nan
 
-    if col_cap in df.columns:
-        df["capacity_std"] = pd.to_numeric(df[col_cap], errors="coerce")
+    if cols["cap"] in df.columns:
+        df["capacity_std"] = pd.to_numeric(df[cols["cap"]], errors="coerce")
     else:
         df["capacity_std"] = pd.NA
 
-    df["id_std"] = df[col_id] if col_id in df.columns else pd.NA
-    df["name_std"] = df[col_name] if col_name in df.columns else pd.NA
+    df["id_std"] = df[cols["id"]] if cols["id"] in df.columns else pd.NA
+    df["name_std"] = df[cols["name"]] if cols["name"] in df.columns else pd.NA
+    return df
 
-    df = assign_commune_geojson(df)
 
-    core = df[["id_std", "name_std", "commune_std", "capacity_std", "lat", "lon"]].copy()
+def _core(df: pd.DataFrame) -> pd.DataFrame:
+    core = df[CORE_COLUMNS].copy()
     core = core.dropna(subset=["lat", "lon"])
-    core = core[core["capacity_std"].notna()]
-
-    if not core.empty:
-        by_com = (
-            core.groupby("commune_std", dropna=False)
-            .agg(
-                stations=("id_std", "count"),
-                capacity_total=("capacity_std", "sum"),
-                capacity_median=("capacity_std", "median"),
-            )
-            .reset_index()
-            .sort_values("capacity_total", ascending=False)
+    return core[core["capacity_std"].notna()]
+
+
+def _aggregate_communes(core: pd.DataFrame) -> pd.DataFrame:
+    return (
+        core.groupby("commune_std", dropna=False)
+        .agg(
+            stations=("id_std", "count"),
+            capacity_total=("capacity_std", "sum"),
+            capacity_median=("capacity_std", "median"),
         )
-        q = core["capacity_std"].quantile([0.1, 0.25, 0.5, 0.75, 0.9]).to_dict()
-    else:
+        .reset_index()
+        .sort_values("capacity_total", ascending=False)
+    )
+
+
+def _tables(core: pd.DataFrame, by_com: pd.DataFrame = None, cube: pd.DataFrame = None, sketches: dict = None) -> dict:
+    """
+    Medians and stats["quantiles"] are exact for the snapshot. The per-commune capacity
+    sketches (utils.sketch) are kept for the history, where periods are merged.
+    """
+    if sketches is None:
+        sketches = sketch_by(core["commune_std"], core["capacity_std"])
+    if core.empty:
         by_com = pd.DataFrame(columns=["commune_std", "stations", "capacity_total", "capacity_median"])
         q = {}
+    else:
+        if by_com is None:
+            by_com = _aggregate_communes(core)
+        q = core["capacity_std"].quantile(QUANTILES).to_dict()
+    if cube is None:
+        cube = build_cube(core)
 
     return {
         "stations": core,
         "by_commune": by_com,
         "stats": {"quantiles": q, "n": len(core)},
+        "cube": cube,
+        "commune_index": index_communes(cube),
+        "sketches": sketches,
     }
+
+
+def normalize(df: pd.DataFrame):
+    """
+    Normalizes the Vélib file downloaded from data.gouv.fr
+    (Station identifier, Station name, Station capacity, Geographic coordinates).
+    """
+    df = _standardize(df)
+    df = assign_commune_geojson(df)
+    return _tables(_core(df))
+
+
+def normalize_batches(batches):
+    """
+    Same as normalize, fed by an iterable of DataFrames (e.g. utils.io.iter_data).
+    Each batch is reduced to the core columns before the next one is read.
+    """
+    cores = [_core(assign_commune_geojson(_standardize(batch))) for batch in batches]
+    if not cores:
+        return _tables(pd.DataFrame(columns=CORE_COLUMNS))
+    return _tables(pd.concat(cores, ignore_index=True))
+
+
+def refresh(previous: dict, df: pd.DataFrame):
+    """
+    Normalizes a new snapshot starting from the tables of the previous one.
+    Stations are matched on 'id_std': only added or moved stations go through the
+    commune assignment, and only the communes touched by the diff are re-aggregated.
+    Gives the same tables as normalize(df).
+    """
+    prev = previous["stations"]
+    df = _standardize(df)
+    if prev.empty or not prev["id_std"].is_unique or not df["id_std"].is_unique:
+        return normalize(df)
+
+    # Previous position and commune of every station still present
+    old = prev.set_index("id_std")[["lat", "lon", "commune_std", "capacity_std"]]
+    old = old.reindex(df["id_std"])
+    same_place = (
+        (old["lat"].to_numpy() == df["lat"].to_numpy())
+        & (old["lon"].to_numpy() == df["lon"].to_numpy())
+    )
+
+    commune = old["commune_std"].to_numpy(dtype=object, na_value=None)
+    changed = np.flatnonzero(~same_place)
+    if changed.size:
+        from utils.geo import get_commune_index
+
+        commune[changed] = get_commune_index().classify(
+            df["lat"].to_numpy()[changed], df["lon"].to_numpy()[changed]
+        )
+    core = _core(df.assign(commune_std=commune))
+
+    # Communes whose rows differ: stations moved in/out, added, removed or resized
+    prev_rows = prev.set_index("id_std")[["commune_std", "capacity_std"]]
+    new_rows = core.set_index("id_std")[["commune_std", "capacity_std"]]
+    both = prev_rows.index.intersection(new_rows.index)
+    diff_ids = (
+        prev_rows.index.difference(new_rows.index)
+        .union(new_rows.index.difference(prev_rows.index))
+        .union(both[(prev_rows.loc[both] != new_rows.loc[both]).any(axis=1).to_numpy()])
+    )
+    if diff_ids.empty:
+        return _tables(core, previous["by_commune"], previous["cube"], previous["sketches"])
+
+    touched = set(prev_rows["commune_std"].reindex(diff_ids).dropna()) | set(
+        new_rows["commune_std"].reindex(diff_ids).dropna()
+    )
+    touched_core = core[core["commune_std"].isin(touched)]
+    sketches = {c: s for c, s in previous["sketches"].items() if c not in touched}
+    sketches.update(sketch_by(touched_core["commune_std"], touched_core["capacity_std"]))
+    by_com = previous["by_commune"]
+    by_com = pd.concat(
+        [
+            by_com[~by_com["commune_std"].isin(touched)],
+            _aggregate_communes(touched_core),
+        ],
+        ignore_index=True,
+    ).sort_values("capacity_total", ascending=False)
+    cube = replace_communes(previous["cube"], build_cube(touched_core), touched)
+
+    return _tables(core, by_com, cube, sketches)
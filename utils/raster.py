@@ -0,0 +1,321 @@
+import threading
+import numpy as np
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+
+from utils.io import ARR_PATH
+
+# Accessibility raster over the arrondissements: one cell every RASTER_CELL_M meters.
+# Walking distance = straight-line distance x WALK_DETOUR (street network), at WALK_SPEED_M_MIN.
+RASTER_CELL_M = 25.0
+RASTER_MARGIN_M = 500.0  # stations this close outside Paris still serve Paris cells
+WALK_SPEED_M_MIN = 80.0  # 4.8 km/h
+WALK_DETOUR = 1.3
+EARTH_RADIUS_M = 6_371_008.8
+# Above this share of changed stations, an update recomputes the whole grid
+INCREMENTAL_MAX_SHARE = 0.05
+# Side, in cells, of the blocks checked exactly after jump flooding
+EXACT_BLOCK = 16
+
+
+class Grid:
+    """Fixed-resolution grid over a lat/lon bounding box (equirectangular, meters)."""
+
+    def __init__(self, bounds, cell_m: float = RASTER_CELL_M, margin_m: float = RASTER_MARGIN_M):
+        min_lon, min_lat, max_lon, max_lat = bounds
+        self.cell_m = float(cell_m)
+        self.k_lon = EARTH_RADIUS_M * np.cos(np.radians((min_lat + max_lat) / 2)) * np.pi / 180
+        self.k_lat = EARTH_RADIUS_M * np.pi / 180
+        self.lon0 = min_lon - margin_m / self.k_lon
+        self.lat0 = min_lat - margin_m / self.k_lat
+        self.width = int(np.ceil(((max_lon - min_lon) * self.k_lon + 2 * margin_m) / self.cell_m))
+        self.height = int(np.ceil(((max_lat - min_lat) * self.k_lat + 2 * margin_m) / self.cell_m))
+
+    @property
+    def shape(self):
+        return self.height, self.width
+
+    @property
+    def bounds(self):
+        """(min_lon, min_lat, max_lon, max_lat) of the raster edges."""
+        return (
+            self.lon0, self.lat0,
+            self.lon0 + self.width * self.cell_m / self.k_lon,
+            self.lat0 + self.height * self.cell_m / self.k_lat,
+        )
+
+    def to_cells(self, lat, lon):
+        """Continuous (row, col) coordinates, cell centers at integers (row 0 = south)."""
+        col = (np.asarray(lon, dtype=np.float64) - self.lon0) * self.k_lon / self.cell_m - 0.5
+        row = (np.asarray(lat, dtype=np.float64) - self.lat0) * self.k_lat / self.cell_m - 0.5
+        return row, col
+
+    def centers(self):
+        """(lat, lon) of every cell center, as two (height, width) arrays."""
+        rows, cols = np.indices(self.shape, dtype=np.float64)
+        return (
+            self.lat0 + (rows + 0.5) * self.cell_m / self.k_lat,
+            self.lon0 + (cols + 0.5) * self.cell_m / self.k_lon,
+        )
+
+
+@lru_cache(maxsize=2)
+def _area(arr_path: str, arr_mtime: float, cell_m: float):
+    """(Grid, mask of the cells inside an arrondissement), once per GeoJSON file."""
+    import shapely
+    from utils.geo import read_layer
+
+    _, geometries = read_layer(Path(arr_path), "l_ar")
+    union = shapely.union_all(geometries)
+    grid = Grid(shapely.bounds(union), cell_m)
+    shapely.prepare(union)
+    lat, lon = grid.centers()
+    mask = shapely.contains_xy(union, lon.ravel(), lat.ravel()).reshape(grid.shape)
+    return grid, mask
+
+
+def region(arr_path: Path = ARR_PATH, cell_m: float = RASTER_CELL_M):
+    """Grid and inside-mask of the arrondissements layer (cached per file version)."""
+    arr_path = Path(arr_path)
+    return _area(str(arr_path), arr_path.stat().st_mtime, float(cell_m))
+
+
+def _nearest_seed(rows, cols, shape):
+    """
+    Index of the nearest point for every cell (-1 where there is no point at all), points
+    in continuous cell coordinates. Jump flooding (log2(size) + 1 passes of 9 shifted array
+    comparisons, no per-cell loop) is approximate: a cell can keep a seed a few cells too far,
+    and points sharing a cell (or clipped to the same border cell) seed only one of them.
+    Its distances are upper bounds, which _exact_nearest then uses to correct every cell.
+    """
+    height, width = shape
+    seed = np.full(shape, -1, dtype=np.int64)
+    r = np.clip(np.rint(rows).astype(np.int64), 0, height - 1)
+    c = np.clip(np.rint(cols).astype(np.int64), 0, width - 1)
+    seed[r, c] = np.arange(len(rows))
+    if not len(rows):
+        return seed
+
+    # Seed -1 (no point yet) reads a sentinel point far away: no masking needed
+    rows = np.append(rows, 1e9).astype(np.float32)
+    cols = np.append(cols, 1e9).astype(np.float32)
+    grid_r, grid_c = np.indices(shape, dtype=np.float32)
+    best = (rows[seed] - grid_r) ** 2 + (cols[seed] - grid_c) ** 2
+
+    levels = int(np.ceil(np.log2(max(max(shape), 2))))
+    steps = [1 << k for k in range(levels - 1, -1, -1)] + [1]  # extra unit pass fixes most misses
+    for k in steps:
+        for dy in (-k, 0, k):
+            for dx in (-k, 0, k):
+                if (dy == 0 and dx == 0) or abs(dy) >= height or abs(dx) >= width:
+                    continue
+                # Each cell looks at the seed of the cell (dy, dx) away: overlapping views only
+                src = seed[max(dy, 0):height + min(dy, 0), max(dx, 0):width + min(dx, 0)].copy()
+                dst = (slice(max(-dy, 0), height + min(-dy, 0)), slice(max(-dx, 0), width + min(-dx, 0)))
+                d = (rows[src] - grid_r[dst]) ** 2 + (cols[src] - grid_c[dst]) ** 2
+                better = d < best[dst]
+                seed[dst][better] = src[better]
+                best[dst][better] = d[better]
+    _exact_nearest(seed, best, rows[:-1], cols[:-1])
+    return seed
+
+
+def _exact_nearest(seed, best, rows, cols, block: int = EXACT_BLOCK):
+    """
+    Makes an upper-bound nearest-point field exact, in place. The nearest point of a cell is
+    at most sqrt(best) away, so each block of cells only compares its cells with the points
+    of the buckets (points grouped by block) within its largest bound, usually the 3x3 around it.
+    """
+    height, width = seed.shape
+    nby, nbx = -(-height // block), -(-width // block)
+    br = np.clip(np.floor(rows / block), 0, nby - 1).astype(np.int64)
+    bc = np.clip(np.floor(cols / block), 0, nbx - 1).astype(np.int64)
+    keys = br * nbx + bc
+    order = np.argsort(keys, kind="stable")
+    rows, cols = rows[order].astype(np.float64), cols[order].astype(np.float64)
+    # Points of buckets [k0, k1) are order[first[k0]:first[k1]]
+    first = np.searchsorted(keys[order], np.arange(nby * nbx + 1))
+
+    for by in range(nby):
+        r0, r1 = by * block, min((by + 1) * block, height)
+        grid_r = np.arange(r0, r1, dtype=np.float64)[:, None, None]
+        for bx in range(nbx):
+            c0, c1 = bx * block, min((bx + 1) * block, width)
+            ring = int(np.ceil(np.sqrt(best[r0:r1, c0:c1].max()) / block))
+            lo, hi = max(bx - ring, 0), min(bx + ring, nbx - 1)
+            cand = np.concatenate([
+                np.arange(first[y * nbx + lo], first[y * nbx + hi + 1])
+                for y in range(max(by - ring, 0), min(by + ring, nby - 1) + 1)
+            ])
+            grid_c = np.arange(c0, c1, dtype=np.float64)[None, :, None]
+            d = (rows[cand] - grid_r) ** 2 + (cols[cand] - grid_c) ** 2
+            nearest = d.argmin(axis=2)
+            seed[r0:r1, c0:c1] = order[cand[nearest]]
+            best[r0:r1, c0:c1] = np.take_along_axis(d, nearest[..., None], axis=2)[..., 0]
+
+
+@lru_cache(maxsize=8)
+def _disk_fft(shape, radius_cells: float):
+    """FFT of a disk kernel of `radius_cells`, zero-padded to `shape` and centred on (0, 0)."""
+    r = int(np.floor(radius_cells))
+    y, x = np.mgrid[-r:r + 1, -r:r + 1]
+    kernel = np.zeros(shape)
+    disk = (x ** 2 + y ** 2 <= radius_cells ** 2).astype(np.float64)
+    kernel[y % shape[0], x % shape[1]] = disk
+    return np.fft.rfft2(kernel)
+
+
+class Coverage:
+    """
+    Accessibility of every grid cell from a set of stations: walking distance to the
+    nearest station and docks reachable within N minutes (FFT disk convolution of the
+    docks raster). Use update() for a new snapshot where only a few stations changed.
+    """
+
+    def __init__(self, grid: Grid, mask: np.ndarray, stations):
+        self.grid = grid
+        self.mask = mask
+        self._set_stations(stations)
+        self.seed = _nearest_seed(self.rows, self.cols, grid.shape)
+        self._dist_from_seed()
+        self.docks = self._docks_raster(self.rows, self.cols, self.cap)
+
+    def _set_stations(self, stations):
+        self.ids = stations["id_std"].to_numpy()
+        self.cap = stations["capacity_std"].to_numpy(dtype=np.float64)
+        self.rows, self.cols = self.grid.to_cells(stations["lat"], stations["lon"])
+
+    def _dist_from_seed(self):
+        grid_r, grid_c = np.indices(self.grid.shape, dtype=np.float64)
+        s = self.seed
+        d = np.hypot(self.rows[s] - grid_r, self.cols[s] - grid_c) * self.grid.cell_m
+        self.dist_m = np.where(s >= 0, d, np.inf).astype(np.float32)
+
+    def _docks_raster(self, rows, cols, cap):
+        height, width = self.grid.shape
+        r, c = np.rint(rows).astype(np.int64), np.rint(cols).astype(np.int64)
+        inside = (r >= 0) & (r < height) & (c >= 0) & (c < width)
+        flat = np.bincount(r[inside] * width + c[inside], weights=cap[inside], minlength=height * width)
+        return flat.reshape(self.grid.shape)
+
+    def walk_minutes(self) -> np.ndarray:
+        """Walking time to the nearest station, NaN outside the area."""
+        minutes = self.dist_m * WALK_DETOUR / WALK_SPEED_M_MIN
+        return np.where(self.mask, minutes, np.nan)
+
+    def docks_within(self, minutes: float) -> np.ndarray:
+        """Docks of the stations reachable on foot within `minutes`, NaN outside the area."""
+        radius_cells = minutes * WALK_SPEED_M_MIN / WALK_DETOUR / self.grid.cell_m
+        pad = int(np.ceil(radius_cells))
+        shape = (self.grid.height + pad, self.grid.width + pad)  # no wrap-around
+        spectrum = np.fft.rfft2(self.docks, shape) * _disk_fft(shape, radius_cells)
+        out = np.fft.irfft2(spectrum, shape)[:self.grid.height, :self.grid.width]
+        return np.where(self.mask, np.rint(np.maximum(out, 0)), np.nan)
+
+    def update(self, stations) -> "Coverage":
+        """
+        Coverage of a new snapshot. When few stations were added, removed or moved,
+        only the docks of those stations and the cells they were / are nearest to are recomputed.
+        """
+        new_ids = stations["id_std"].to_numpy()
+        if len(new_ids) == 0 or len(self.ids) == 0:
+            return Coverage(self.grid, self.mask, stations)
+
+        old_pos = {sid: i for i, sid in enumerate(self.ids)}
+        new_rows, new_cols = self.grid.to_cells(stations["lat"], stations["lon"])
+        new_cap = stations["capacity_std"].to_numpy(dtype=np.float64)
+        prev = np.array([old_pos.get(sid, -1) for sid in new_ids])
+        known = prev >= 0
+        same = np.zeros(len(new_ids), dtype=bool)
+        same[known] = (
+            (self.rows[prev[known]] == new_rows[known]) & (self.cols[prev[known]] == new_cols[known])
+            & (self.cap[prev[known]] == new_cap[known])
+        )
+        kept = np.zeros(len(self.ids), dtype=bool)
+        kept[prev[same]] = True
+        changed_old, changed_new = np.flatnonzero(~kept), np.flatnonzero(~same)
+        if len(changed_old) + len(changed_new) > INCREMENTAL_MAX_SHARE * len(new_ids):
+            return Coverage(self.grid, self.mask, stations)
+
+        out = object.__new__(Coverage)
+        out.grid, out.mask = self.grid, self.mask
+        out._set_stations(stations)
+
+        # Docks raster is linear in the stations: remove the old, add the new
+        out.docks = (
+            self.docks
+            - self._docks_raster(self.rows[changed_old], self.cols[changed_old], self.cap[changed_old])
+            + out._docks_raster(new_rows[changed_new], new_cols[changed_new], new_cap[changed_new])
+        )
+
+        # Nearest station: remap kept seeds to their new index, then fix the affected cells
+        remap = np.full(len(self.ids) + 1, -1, dtype=np.int64)
+        remap[prev[same]] = np.flatnonzero(same)
+        seed = remap[self.seed]  # -1 seeds stay -1 (remap[-1])
+        orphan = seed < 0
+        grid_r, grid_c = np.indices(self.grid.shape, dtype=np.float64)
+        best = np.where(orphan, np.inf, (out.rows[seed] - grid_r) ** 2 + (out.cols[seed] - grid_c) ** 2)
+        # Cells whose station disappeared or moved: exact search among all stations
+        cells = np.flatnonzero(orphan.ravel())
+        for chunk in np.array_split(cells, max(1, len(cells) * len(new_ids) // 20_000_000 + 1)):
+            if not len(chunk):
+                continue
+            d = (grid_r.ravel()[chunk, None] - out.rows) ** 2 + (grid_c.ravel()[chunk, None] - out.cols) ** 2
+            nearest = d.argmin(axis=1)
+            seed.ravel()[chunk] = nearest
+            best.ravel()[chunk] = d[np.arange(len(chunk)), nearest]
+        # New or moved stations can only bring cells closer
+        for i in changed_new:
+            d = (out.rows[i] - grid_r) ** 2 + (out.cols[i] - grid_c) ** 2
+            closer = d < best
+            seed[closer], best[closer] = i, d[closer]
+        out.seed = seed
+        out._dist_from_seed()
+        return out
+
+
+_coverages = OrderedDict()  # data version -> Coverage, most recent last
+_coverages_lock = threading.Lock()
+
+
+def get_coverage(stations, version, arr_path: Path = ARR_PATH) -> Coverage:
+    """
+    Process-wide Coverage of one data version (the two most recent are kept).
+    A new version is derived from the latest one with Coverage.update().
+    """
+    grid, mask = region(arr_path)
+    with _coverages_lock:
+        coverage = _coverages.get(version)
+        if coverage is not None and coverage.grid is grid:
+            return coverage
+        previous = next(reversed(_coverages.values()), None)
+        if previous is not None and previous.grid is grid:
+            coverage = previous.update(stations)
+        else:
+            coverage = Coverage(grid, mask, stations)
+        _coverages[version] = coverage
+        while len(_coverages) > 2:
+            _coverages.popitem(last=False)
+        return coverage
+
+
+def image(values: np.ndarray, vmin: float, vmax: float, reverse: bool = False, alpha: int = 150) -> bytes:
+    """
+    PNG (RGBA) of a raster for a map overlay: north up, NaN transparent,
+    red (worst) to green (best) on [vmin, vmax].
+    """
+    import io
+    from PIL import Image
+
+    t = np.nan_to_num(np.clip((values - vmin) / max(vmax - vmin, 1e-9), 0, 1))
+    if reverse:
+        t = 1 - t
+    rgba = np.zeros(values.shape + (4,), dtype=np.uint8)
+    rgba[..., 0] = np.rint(255 * np.clip(2 * (1 - t), 0, 1))
+    rgba[..., 1] = np.rint(200 * np.clip(2 * t, 0, 1))
+    rgba[..., 2] = 40
+    rgba[..., 3] = np.where(np.isnan(values), 0, alpha)
+    buf = io.BytesIO()
+    Image.fromarray(rgba[::-1]).save(buf, format="PNG", compress_level=1)
+    return buf.getvalue()
@@ -0,0 +1,228 @@
+import json
+import os
+import random
+import stat
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from utils.io import LOCAL_PATH, load_data
+
+# Background refresh of the station CSV. A daemon thread polls the source with conditional
+# requests; a changed file is downloaded aside, validated, normalized and published as a new
+# generation (utils.cache) BEFORE it replaces LOCAL_PATH, so a rerun finds the tables ready.
+# Off unless VELIB_REFRESH_URL is set, e.g. to the opendata.paris.fr export
+# https://opendata.paris.fr/api/explore/v2.1/catalog/datasets/velib-emplacement-des-stations/exports/csv?delimiter=%3B
+# (it rewrites LOCAL_PATH). VELIB_DATA_PATH (benchmark datasets) disables it too.
+# One process per cache directory refreshes (a lock file there); the other workers only
+# follow the generations it publishes.
+REFRESH_URL = os.environ.get("VELIB_REFRESH_URL", "")
+REFRESH_HOURS = float(os.environ.get("VELIB_REFRESH_HOURS", "6"))
+REQUEST_TIMEOUT_S = 60
+RETRY_MIN_S = 60
+# A download with fewer stations than this share of the published snapshot is rejected
+MIN_ROWS_SHARE = 0.5
+# ... and so is one where this share of the rows has no usable coordinates or capacity
+MAX_INVALID_SHARE = 0.1
+LOCK_NAME = "refresh.lock"
+
+
+def validate(df, previous_n: int = 0):
+    """Raises ValueError when a downloaded snapshot should not replace the published one."""
+    from utils.prep import _standardize
+
+    df = _standardize(df)
+    if df.empty:
+        raise ValueError("Fichier invalide : aucune station")
+    invalid = (df["lat"].isna() | df["lon"].isna() | df["capacity_std"].isna()).mean()
+    if invalid > MAX_INVALID_SHARE:
+        raise ValueError(f"Fichier invalide : {invalid:.0%} des lignes sans coordonnées ou capacité")
+    if len(df) < MIN_ROWS_SHARE * previous_n:
+        raise ValueError(f"Fichier invalide : {len(df)} stations au lieu d'environ {previous_n}")
+
+
+class Refresher:
+    """
+    Checks `url` every `interval` seconds (If-None-Match / If-Modified-Since, validators kept
+    next to the target so restarts stay conditional) and publishes new snapshots.
+    `on_publish(tables)` runs after each publication, e.g. to warm the app's caches.
+    """
+
+    def __init__(self, url: str = REFRESH_URL, target: Path = LOCAL_PATH,
+                 interval: float = REFRESH_HOURS * 3600, on_publish=None):
+        self.url = url
+        self.target = Path(target)
+        self.interval = interval
+        self.on_publish = on_publish
+        self.checks = 0
+        self.published = 0
+        self.failures = 0
+        self.last_error = None
+        self.last_check = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def _validators_path(self) -> Path:
+        return self.target.with_name(f".{self.target.name}.refresh.json")
+
+    def _validators(self) -> dict:
+        try:
+            return json.loads(self._validators_path.read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def _download(self):
+        """New content in a temporary file next to the target, None when not modified."""
+        import requests
+
+        saved = self._validators() if self.target.exists() else {}
+        headers = {}
+        if saved.get("etag"):
+            headers["If-None-Match"] = saved["etag"]
+        if saved.get("last_modified"):
+            headers["If-Modified-Since"] = saved["last_modified"]
+
+        with requests.get(self.url, headers=headers, timeout=REQUEST_TIMEOUT_S, stream=True) as response:
+            if response.status_code == 304:
+                return None, saved
+            response.raise_for_status()
+            fd, tmp = tempfile.mkstemp(dir=self.target.parent, prefix=".download-", suffix=".csv")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    for chunk in response.iter_content(1 << 20):
+                        f.write(chunk)
+            except Exception:
+                os.unlink(tmp)
+                raise
+            validators = {"etag": response.headers.get("ETag"), "last_modified": response.headers.get("Last-Modified")}
+        return Path(tmp), validators
+
+    def check(self) -> bool:
+        """One conditional request; True when a new snapshot was published."""
+        from utils.cache import current_generation, publish_tables, read_tables, record_source, source_key
+
+        self.checks += 1
+        self.last_check = time.time()
+        tmp, validators = self._download()
+        if tmp is None:
+            return False
+        try:
+            key = source_key(tmp)
+            if self.target.exists() and source_key(self.target) == key:
+                published = None  # same content under new validators
+            else:
+                current = current_generation()
+                previous = read_tables(current) if current else None
+                validate(load_data(tmp), previous["stats"]["n"] if previous else 0)
+                # Published first, then moved in place: the new CSV always has its tables.
+                # The target is only marked as seen once replaced, so load_tables never
+                # takes the old CSV for a change in between.
+                published = publish_tables(tmp, key, record=False, previous=previous)
+                if self.target.exists():
+                    os.chmod(tmp, stat.S_IMODE(self.target.stat().st_mode))  # mkstemp creates it 0600
+                os.replace(tmp, self.target)
+                record_source(self.target, key)
+        finally:
+            if tmp.exists():
+                os.unlink(tmp)
+        tmp_validators = self._validators_path.with_suffix(f".{os.getpid()}")
+        tmp_validators.write_text(json.dumps(validators))
+        os.replace(tmp_validators, self._validators_path)
+
+        if published is None:
+            return False
+        self.published += 1
+        if self.on_publish is not None:
+            self.on_publish(published)
+        return True
+
+    def next_delay(self) -> float:
+        if not self.failures:
+            return self.interval
+        return min(self.interval, RETRY_MIN_S * 2 ** (self.failures - 1)) * random.uniform(0.5, 1.0)
+
+    def run(self):
+        while not self._stop.is_set():
+            try:
+                self.check()
+                self.failures, self.last_error = 0, None
+            except Exception as e:  # the thread must survive network, disk and parsing errors
+                self.failures += 1
+                self.last_error = f"{type(e).__name__}: {str(e)[:120]}"
+            self._stop.wait(self.next_delay())
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run, name="velib-refresh", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def status(self) -> dict:
+        return {
+            "url": self.url,
+            "checks": self.checks,
+            "published": self.published,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "last_check": self.last_check,
+        }
+
+
+_REFRESHER = None
+_REFRESHER_LOCK = threading.Lock()
+_LOCK_FILE = None
+
+
+def elect() -> bool:
+    """
+    True when this process holds the refresh lock of the cache directory (kept until it exits).
+    Without fcntl (Windows) there is no election and every process refreshes.
+    """
+    global _LOCK_FILE
+    try:
+        import fcntl
+    except ImportError:
+        return True
+    from utils.cache import CACHE_DIR
+
+    if _LOCK_FILE is None:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        _LOCK_FILE = open(CACHE_DIR / LOCK_NAME, "a")
+    try:
+        fcntl.flock(_LOCK_FILE, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return False
+    return True
+
+
+def start_refresher(on_publish=None):
+    """
+    The process-wide refresher, started on first call by the elected process only.
+    None unless VELIB_REFRESH_URL is set, and in the other workers: they follow the published
+    generation, and try the election again on each call (a new refresher when the elected one exits).
+    """
+    global _REFRESHER
+    if not REFRESH_URL or "VELIB_DATA_PATH" in os.environ:
+        return None
+    with _REFRESHER_LOCK:
+        if _REFRESHER is None and elect():
+            _REFRESHER = Refresher(on_publish=on_publish).start()
+        return _REFRESHER
+
+
+if __name__ == "__main__":
+    # One refresh, e.g. from cron: python -m utils.refresh [url]
+    import sys
+
+    if not elect():
+        sys.exit("another process is refreshing this cache directory")
+    refresher = Refresher(sys.argv[1] if len(sys.argv) > 1 else REFRESH_URL)
+    print("published" if refresher.check() else "not modified")
@@ -0,0 +1,133 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+from utils.prep import _norm
+
+# Station search over "<name> <commune>", folded with utils.prep._norm (accents, case) and
+# reduced to [a-z0-9 ]. Two indexes are built once per data version:
+#  - trigram postings (CSR arrays): a query scores the stations by the share of its
+#    trigrams they contain, which tolerates a typo and matches inside words;
+#  - the sorted array of every word: a query word is a prefix range (two searchsorted).
+# A lookup touches the postings of the query trigrams only, never the whole table.
+ALPHABET = " abcdefghijklmnopqrstuvwxyz0123456789"
+# Share of the query trigrams a station must contain to be returned
+MIN_TRIGRAM_SHARE = 0.5
+# Bonus of the stations where every query word starts a word (the usual "as you type" case)
+PREFIX_BONUS = 1.0
+
+_CODES = np.full(256, 0, dtype=np.int32)
+_CODES[np.frombuffer(ALPHABET.encode(), dtype=np.uint8)] = np.arange(len(ALPHABET))
+_BASE = len(ALPHABET)
+
+
+def fold(text) -> str:
+    """Lowercase, accent-free text reduced to single-spaced [a-z0-9] words."""
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", _norm(text)).split())
+
+
+def fold_all(texts) -> list:
+    """fold() of many texts: each distinct word goes through _norm once."""
+    words = {}
+    out = []
+    for text in texts:
+        parts = []
+        for word in str(text).split():
+            folded = words.get(word)
+            if folded is None:
+                folded = words[word] = fold(word)
+            if folded:
+                parts.append(folded)
+        out.append(" ".join(parts))
+    return out
+
+
+def _query_trigrams(text: str) -> np.ndarray:
+    codes = _CODES[np.frombuffer(f" {text} ".encode(), dtype=np.uint8)]
+    grams = codes[:-2] * _BASE * _BASE + codes[1:-1] * _BASE + codes[2:]
+    return np.unique(grams)
+
+
+class StationIndex:
+    """Trigram + sorted-prefix index of station names and communes (rows = positions in the table)."""
+
+    def __init__(self, names, communes):
+        names = pd.Series(pd.Categorical(names))
+        communes = pd.Series(pd.Categorical(communes))
+        # Folding runs once per distinct name / commune, not per station
+        folded_names = pd.Series(fold_all(names.cat.categories), dtype=object)
+        folded_communes = pd.Series(fold_all(communes.cat.categories), dtype=object)
+        name_text = folded_names.to_numpy()[names.cat.codes.to_numpy()] if len(folded_names) else np.array([], object)
+        commune_text = (
+            folded_communes.to_numpy()[communes.cat.codes.to_numpy()] if len(folded_communes) else np.array([], object)
+        )
+        texts = [f"{n} {c}".strip() for n, c in zip(name_text, commune_text)]
+        self.size = len(texts)
+        self.lengths = np.fromiter((len(n) for n in name_text), np.int64, self.size)
+        self._build_trigrams(texts)
+        self._build_words(texts)
+
+    def _build_trigrams(self, texts):
+        """Postings of every trigram of ' text ', as one (trigram, station) sort."""
+        width = max((len(t) for t in texts), default=0) + 2
+        padded = np.array([f" {t} ".ljust(width, "\0") for t in texts], dtype=f"S{width}")
+        chars = np.frombuffer(padded.tobytes(), dtype=np.uint8).reshape(self.size, width) if self.size else np.zeros((0, 3), np.uint8)
+        codes = _CODES[chars]
+        valid = chars != 0
+        grams = codes[:, :-2] * _BASE * _BASE + codes[:, 1:-1] * _BASE + codes[:, 2:]
+        keep = valid[:, 2:]
+        rows = np.broadcast_to(np.arange(self.size)[:, None], grams.shape)[keep]
+        pairs = np.sort(grams[keep].astype(np.int64) * max(self.size, 1) + rows)
+        pairs = pairs[np.r_[True, pairs[1:] != pairs[:-1]]] if len(pairs) else pairs
+        gram_of, self.postings = np.divmod(pairs, max(self.size, 1))
+        self.grams, self.starts = np.unique(gram_of, return_index=True)
+        self.ends = np.append(self.starts[1:], len(self.postings))
+
+    def _build_words(self, texts):
+        words, rows = [], []
+        for row, text in enumerate(texts):
+            for word in set(text.split()):
+                words.append(word)
+                rows.append(row)
+        words = np.array(words, dtype=str) if words else np.array([], dtype="<U1")
+        order = np.argsort(words, kind="stable")
+        self.words, self.word_rows = words[order], np.asarray(rows, dtype=np.int64)[order]
+
+    def prefix_rows(self, prefix: str) -> np.ndarray:
+        """Stations with a word starting with `prefix` (folded), possibly repeated."""
+        lo = np.searchsorted(self.words, prefix, side="left")
+        hi = np.searchsorted(self.words, prefix + "\U0010ffff", side="left")
+        return self.word_rows[lo:hi]
+
+    def search(self, query: str, limit: int = 10) -> np.ndarray:
+        """Positions of the best matches, best first."""
+        text = fold(query)
+        if not text or not self.size:
+            return np.empty(0, dtype=np.int64)
+        score = np.zeros(self.size)
+
+        # Every query word is a prefix of some word of the station (marks, no sort)
+        words = text.split()
+        matched = np.zeros(self.size, dtype=np.int32)
+        for word in words:
+            hit = np.zeros(self.size, dtype=bool)
+            hit[self.prefix_rows(word)] = True
+            matched += hit
+        score[matched == len(words)] += PREFIX_BONUS
+
+        grams = _query_trigrams(text)
+        pos = np.searchsorted(self.grams, grams)
+        pos = pos[(pos < len(self.grams)) & (self.grams[np.minimum(pos, len(self.grams) - 1)] == grams)]
+        if len(pos):
+            hits = np.concatenate([self.postings[self.starts[p]:self.ends[p]] for p in pos])
+            share = np.bincount(hits, minlength=self.size) / len(grams)
+            score += np.where(share >= MIN_TRIGRAM_SHARE, share, 0.0)
+
+        found = np.flatnonzero(score > 0)
+        # Best score first, then the shortest name: partial selection, only `limit` rows sorted
+        key = self.lengths[found] - score[found] * 1e6
+        if len(found) > limit:
+            top = np.argpartition(key, limit)[:limit]
+            found, key = found[top], key[top]
+        return found[np.argsort(key, kind="stable")]
@@ -0,0 +1,200 @@
+import numpy as np
+import pandas as pd
+
+# Station neighbourhoods without pairwise O(n²) distances: stations are bucketed on a
+# uniform metric grid whose cells are at least as wide as the search radius, so every
+# neighbour within the radius lies in the 3x3 block of cells around a station.
+# Exact (haversine) distances are only computed for those candidate pairs.
+EARTH_RADIUS_M = 6_371_008.8
+# Upper bound on the candidate pairs materialized at once (memory ~ 24 bytes per pair)
+PAIR_CHUNK = 4_000_000
+# Cells are slightly wider than the radius: the planar projection is off by <1% at this scale
+CELL_MARGIN = 1.02
+
+_OFFSETS = [(dx, dy) for dy in (-1, 0, 1) for dx in (-1, 0, 1)]
+
+
+def haversine(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """Great-circle distance in meters (vectorized)."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(a, dtype=np.float64)) for a in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def project(lat, lon):
+    """Local equirectangular projection in meters (accurate to <1% over a metropolitan area)."""
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    lat0 = np.radians(np.nanmean(lat)) if len(lat) else 0.0
+    return EARTH_RADIUS_M * np.radians(lon) * np.cos(lat0), EARTH_RADIUS_M * np.radians(lat)
+
+
+def _hav(rlat1, rlon1, cos1, rlat2, rlon2, cos2):
+    """Haversine term sin²(d / 2R) from radians and cosines: monotonic in d, no arcsin."""
+    return np.sin((rlat2 - rlat1) / 2) ** 2 + cos1 * cos2 * np.sin((rlon2 - rlon1) / 2) ** 2
+
+
+def _to_meters(hav):
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(hav, 1.0)))
+
+
+def _to_hav(meters):
+    return np.sin(meters / (2 * EARTH_RADIUS_M)) ** 2
+
+
+class GridIndex:
+    """
+    Stations bucketed in square cells of `cell_m` meters. Internally the stations are
+    sorted by cell (`order` maps sorted positions back to rows), so each cell is one
+    contiguous run and neighbour lookups are mostly sequential reads.
+    """
+
+    def __init__(self, lat, lon, cell_m: float):
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        self.cell_m = float(cell_m)
+        x, y = project(lat, lon)
+        if len(x):
+            x, y = x - x.min(), y - y.min()
+        ix = np.floor(x / self.cell_m).astype(np.int64)
+        iy = np.floor(y / self.cell_m).astype(np.int64)
+        self.nx = int(ix.max()) + 2 if len(x) else 1
+        self.ny = int(iy.max()) + 2 if len(x) else 1
+
+        keys = iy * self.nx + ix
+        self.order = np.argsort(keys, kind="stable")
+        self.ix, self.iy, keys = ix[self.order], iy[self.order], keys[self.order]
+        self.rlat = np.radians(lat[self.order])
+        self.rlon = np.radians(lon[self.order])
+        self.cos = np.cos(self.rlat)
+        self.cells, self.starts, self.counts = np.unique(keys, return_index=True, return_counts=True)
+
+        # Dense cell -> run lookup when the grid is small enough (it always is for a city)
+        self._dense = None
+        if self.nx * self.ny <= 1 << 24:
+            first = np.zeros(self.nx * self.ny, dtype=np.int64)
+            count = np.zeros(self.nx * self.ny, dtype=np.int64)
+            first[self.cells], count[self.cells] = self.starts, self.counts
+            self._dense = first, count
+
+    def __len__(self):
+        return len(self.order)
+
+    def _cell_runs(self, points, dx, dy):
+        """(first sorted position, count) of the cell at offset (dx, dy) from each point (count 0 if empty)."""
+        ix, iy = self.ix[points] + dx, self.iy[points] + dy
+        inside = (ix >= 0) & (iy >= 0) & (ix < self.nx) & (iy < self.ny)
+        key = np.where(inside, iy * self.nx + ix, 0)
+        if self._dense is not None:
+            first, count = self._dense
+            return first[key], np.where(inside, count[key], 0)
+        pos = np.minimum(np.searchsorted(self.cells, key), len(self.cells) - 1)
+        hit = inside & (self.cells[pos] == key)
+        return np.where(hit, self.starts[pos], 0), np.where(hit, self.counts[pos], 0)
+
+    def candidate_pairs(self, points=None):
+        """
+        Yields (i, j, hav) in sorted positions for every station i of `points` (all by default)
+        and every station j in the 3x3 cells around it, i included, ~PAIR_CHUNK pairs at a time.
+        `hav` is the haversine term: compare it to _to_hav(radius), convert with _to_meters.
+        """
+        points = np.arange(len(self)) if points is None else np.asarray(points)
+        runs = [self._cell_runs(points, dx, dy) for dx, dy in _OFFSETS]
+        per_point = np.sum([counts for _, counts in runs], axis=0)
+        bounds = np.searchsorted(np.cumsum(per_point), np.arange(PAIR_CHUNK, per_point.sum(), PAIR_CHUNK))
+        for chunk in np.split(np.arange(len(points)), np.unique(bounds + 1)):
+            for starts, counts in runs:
+                cnt = counts[chunk]
+                total = int(cnt.sum())
+                if not total:
+                    continue
+                ends = np.cumsum(cnt)
+                i = np.repeat(points[chunk], cnt)  # runs of equal i, in `points` order
+                j = np.arange(total) + np.repeat(starts[chunk] - (ends - cnt), cnt)
+                yield i, j, _hav(self.rlat[i], self.rlon[i], self.cos[i], self.rlat[j], self.rlon[j], self.cos[j])
+
+
+def _run_heads(i):
+    """Start of each run of equal values in `i` (candidate_pairs yields one run per station)."""
+    return np.flatnonzero(np.r_[True, i[1:] != i[:-1]])
+
+
+def nearest_neighbour(lat, lon) -> np.ndarray:
+    """
+    Distance in meters from each station to the closest other one (inf when alone).
+    A neighbour found at d <= cell size in the 3x3 block is exact: anything closer would
+    be in the block too. Stations without such a neighbour are retried on a grid twice as coarse.
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    n = len(lat)
+    best = np.full(n, np.inf)
+    if n < 2:
+        return best
+
+    x, y = project(lat, lon)
+    span = max(np.ptp(x), np.ptp(y), 1.0)
+    cell = max(np.sqrt(max(np.ptp(x) * np.ptp(y), 1.0) / n) * 2, 1.0)  # ~4 stations per cell on average
+    pending = np.arange(n)
+    while len(pending):
+        index = GridIndex(lat, lon, cell)
+        rank = np.empty(n, dtype=np.int64)
+        rank[index.order] = np.arange(n)
+        hav = np.full(n, np.inf)
+        for i, j, h in index.candidate_pairs(np.sort(rank[pending])):
+            h[i == j] = np.inf
+            heads = _run_heads(i)
+            hav[i[heads]] = np.minimum(hav[i[heads]], np.minimum.reduceat(h, heads))
+        found = _to_meters(hav[rank[pending]])
+        best[pending] = found
+        if cell > 2 * span:
+            break
+        pending = pending[found * CELL_MARGIN > cell]
+        cell *= 2
+    return best
+
+
+def neighbourhood(stations: pd.DataFrame, radius_m: float) -> pd.DataFrame:
+    """
+    Per-station neighbourhood within `radius_m` meters (the station itself included):
+    stations and docks within the radius, and capacity per km² of the disc around the station.
+    Rows are aligned with `stations`. O(n x local density), never O(n²).
+    """
+    lat = stations["lat"].to_numpy(dtype=np.float64)
+    lon = stations["lon"].to_numpy(dtype=np.float64)
+    cap = stations["capacity_std"].to_numpy(dtype=np.float64)
+    n = len(lat)
+
+    index = GridIndex(lat, lon, radius_m * CELL_MARGIN)
+    cap_sorted = cap[index.order]
+    limit = _to_hav(radius_m)
+    count = np.zeros(n)
+    docks = np.zeros(n)
+    for i, j, h in index.candidate_pairs():
+        near = h <= limit
+        heads = _run_heads(i)
+        count[i[heads]] += np.add.reduceat(near, heads)
+        docks[i[heads]] += np.add.reduceat(np.where(near, cap_sorted[j], 0.0), heads)
+    # Back from sorted positions to rows
+    count[index.order], docks[index.order] = count.copy(), docks.copy()
+
+    return pd.DataFrame({
+        "stations_within": count.astype(np.int64),
+        "docks_within": docks,
+        "capacity_km2": docks / (np.pi * radius_m ** 2 / 1e6),
+    })
+
+
+def capacity_surface(stations: pd.DataFrame, cell_m: float = 500.0) -> pd.DataFrame:
+    """Docks per km² on a uniform grid of `cell_m` meters (occupied cells only, with their centroid)."""
+    index = GridIndex(stations["lat"], stations["lon"], cell_m)
+    cap = stations["capacity_std"].to_numpy(dtype=np.float64)
+    cell_of = np.repeat(np.arange(len(index.cells)), index.counts)
+    docks = np.bincount(cell_of, weights=cap[index.order], minlength=len(index.cells))
+    count = np.bincount(cell_of, minlength=len(index.cells))
+    return pd.DataFrame({
+        "lat": np.degrees(np.bincount(cell_of, weights=index.rlat)) / np.maximum(count, 1),
+        "lon": np.degrees(np.bincount(cell_of, weights=index.rlon)) / np.maximum(count, 1),
+        "stations": count,
+        "capacity_km2": docks / (cell_m ** 2 / 1e6),
+    })
@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+
+
+class StationStore:
+    """
+    Compact, read-only station table shared by every session and every worker: it is built
+    once per published generation and memory-mapped from the artifact (utils.cache).
+    Communes and names are dictionary-encoded (categoricals), capacity is int16 and
+    coordinates float32. A commune selection is an array of row positions: rows are
+    only materialized (take) by the code that really needs them, e.g. a figure on a cache miss.
+    Pandas copy-on-write keeps the shared frame intact if a caller modifies what it got.
+    """
+
+    def __init__(self, frame: pd.DataFrame, order: np.ndarray = None):
+        """`frame` is already compact (see build / from_frames): it is kept as is, not copied."""
+        self.frame = frame
+        self.communes = frame["commune_std"].cat.categories
+
+        # Rows grouped by commune: order[offsets[c]:offsets[c + 1]] are the rows of commune c
+        codes = frame["commune_std"].array.codes
+        if order is None:
+            order = np.argsort(codes, kind="stable").astype(np.int32)
+        self.order = order
+        self.offsets = np.searchsorted(codes[self.order], np.arange(len(self.communes) + 1))
+        for arr in (self.order, self.offsets):
+            arr.flags.writeable = False
+
+    @classmethod
+    def build(cls, stations: pd.DataFrame) -> "StationStore":
+        """Compact store of a normalized stations table (done once, when the tables are published)."""
+        return cls(pd.DataFrame({
+            "id_std": stations["id_std"].to_numpy(),
+            "name_std": pd.Categorical(stations["name_std"]),
+            "commune_std": pd.Categorical(stations["commune_std"]),
+            "capacity_std": _small_int(stations["capacity_std"]),
+            "lat": stations["lat"].to_numpy(dtype=np.float32),
+            "lon": stations["lon"].to_numpy(dtype=np.float32),
+        }))
+
+    def to_frames(self):
+        """
+        (rows, categories) to store: category codes instead of categoricals (Arrow dictionaries
+        are copied when read back), plus the commune order, so from_frames only wraps columns.
+        """
+        rows = pd.DataFrame({
+            "id_std": self.frame["id_std"].to_numpy(),
+            **{col: self.frame[col].array.codes for col in _CATEGORICAL},
+            **{col: self.frame[col].to_numpy() for col in ("capacity_std", "lat", "lon")},
+            "order": self.order,
+        })
+        categories = pd.DataFrame({
+            "column": [col for col in _CATEGORICAL for _ in self.frame[col].cat.categories],
+            "value": [v for col in _CATEGORICAL for v in self.frame[col].cat.categories],
+        })
+        return rows, categories
+
+    @classmethod
+    def from_frames(cls, rows: pd.DataFrame, categories: pd.DataFrame) -> "StationStore":
+        """Store over the columns of to_frames(), e.g. memory-mapped: numeric columns and codes are not copied."""
+        columns = {"id_std": rows["id_std"]}
+        for col in _CATEGORICAL:
+            values = categories.loc[categories["column"] == col, "value"].to_numpy()
+            columns[col] = pd.Series(
+                pd.Categorical.from_codes(rows[col].to_numpy(), categories=values, validate=False), copy=False
+            )
+        for col in ("capacity_std", "lat", "lon"):
+            columns[col] = rows[col]
+        return cls(pd.DataFrame(columns, copy=False), rows["order"].to_numpy())
+
+    def __len__(self):
+        return len(self.frame)
+
+    def select(self, communes=None) -> np.ndarray:
+        """Row positions of the selected communes (every row when nothing is selected)."""
+        if not communes:
+            return np.arange(len(self.frame))
+        codes = self.communes.get_indexer(list(communes))
+        parts = [self.order[self.offsets[c]:self.offsets[c + 1]] for c in codes if c >= 0]
+        if not parts:
+            return np.empty(0, dtype=np.int32)
+        return np.sort(np.concatenate(parts))
+
+    def take(self, rows=None) -> pd.DataFrame:
+        """Stations at `rows` (the whole table, without copy, for None)."""
+        if rows is None:
+            return self.frame
+        return self.frame.take(rows)
+
+    def nbytes(self) -> int:
+        return int(self.frame.memory_usage(deep=True).sum() + self.order.nbytes + self.offsets.nbytes)
+
+
+_CATEGORICAL = ("name_std", "commune_std")
+
+
+def _small_int(values: pd.Series) -> np.ndarray:
+    """Capacities as int16 when they fit (they are dock counts), int32 / float32 otherwise."""
+    arr = pd.to_numeric(values).to_numpy(dtype=np.float64)
+    if not len(arr):
+        return arr.astype(np.int16)
+    if not np.array_equal(arr, np.round(arr)):
+        return arr.astype(np.float32)
+    if arr.max() > np.iinfo(np.int16).max or arr.min() < np.iinfo(np.int16).min:
+        return arr.astype(np.int32)
+    return arr.astype(np.int16)
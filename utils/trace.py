@@ -0,0 +1,134 @@
+"""
+Opt-in timing of the app's hot path.
+
+VELIB_TRACE=1 turns it on: every rerun collects spans (name, duration, attributes),
+the sidebar shows the breakdown of the last rerun, and when VELIB_TRACE_FILE is set
+each span is appended there as one JSON line (for p95s across sessions offline).
+Fragments declared with trace.fragment record their own reruns the same way.
+When off, span() and annotate() are no-ops.
+"""
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+ENABLED = os.environ.get("VELIB_TRACE", "").strip().lower() not in ("", "0", "false", "no")
+TRACE_FILE = os.environ.get("VELIB_TRACE_FILE")
+
+_local = threading.local()
+_file_lock = threading.Lock()
+
+
+def _script_context():
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+    return get_script_run_ctx()
+
+
+def begin(session: str = None, **attrs):
+    """Starts collecting the spans of one script rerun (in the current thread), of the current session by default."""
+    if not ENABLED:
+        return
+    if session is None:
+        ctx = _script_context()
+        session = ctx.session_id if ctx else None
+    _local.rerun = {
+        "rerun": uuid.uuid4().hex[:12],
+        "session": session,
+        "started": time.time(),
+        "attrs": attrs,
+        "spans": [],
+        "stack": [],
+    }
+
+
+def _current():
+    return getattr(_local, "rerun", None) if ENABLED else None
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Times the enclosed block. The yielded dict can receive extra attributes."""
+    rerun = _current()
+    if rerun is None:
+        yield attrs
+        return
+    start = time.perf_counter()
+    start_ms = round((time.time() - rerun["started"]) * 1000, 3)
+    record = {"name": name, "depth": len(rerun["stack"]), "start_ms": start_ms, **attrs}
+    rerun["stack"].append(record)
+    try:
+        yield record
+    finally:
+        record["ms"] = round((time.perf_counter() - start) * 1000, 3)
+        rerun["stack"].pop()
+        rerun["spans"].append(record)
+
+
+def annotate(**attrs):
+    """Adds attributes to the innermost open span (e.g. cache='miss' from inside a cached function)."""
+    rerun = _current()
+    if rerun is not None and rerun["stack"]:
+        rerun["stack"][-1].update(attrs)
+
+
+def end(**attrs) -> list:
+    """Closes the rerun, appends its spans to TRACE_FILE and returns them (in start order)."""
+    rerun = _current()
+    if rerun is None:
+        return []
+    _local.rerun = None
+    total_ms = round((time.time() - rerun["started"]) * 1000, 3)
+    spans = [{"name": "rerun", "depth": 0, "start_ms": 0.0, "ms": total_ms, **rerun["attrs"], **attrs}]
+    spans += sorted(rerun["spans"], key=lambda s: s["start_ms"])
+
+    if TRACE_FILE:
+        common = {"rerun": rerun["rerun"], "session": rerun["session"], "ts": rerun["started"]}
+        lines = "".join(json.dumps({**common, **s}, default=str) + "\n" for s in spans)
+        with _file_lock, open(TRACE_FILE, "a", encoding="utf-8") as f:
+            f.write(lines)
+    return spans
+
+
+def fragment(func=None, **kwargs):
+    """
+    st.fragment (same arguments, e.g. run_every) whose runs are traced: a span inside a
+    full rerun, and a rerun record of its own (kind='fragment') when the fragment reruns alone.
+    """
+    import streamlit as st
+
+    def decorate(fn):
+        @functools.wraps(fn)
+        def traced(*args, **kw):
+            if not ENABLED:
+                return fn(*args, **kw)
+            ctx = _script_context()
+            if not (ctx and ctx.fragment_ids_this_run):
+                with span("fragment", fragment=fn.__name__):
+                    return fn(*args, **kw)
+            begin(kind="fragment", fragment=fn.__name__)
+            try:
+                result = fn(*args, **kw)
+            finally:
+                spans = end()
+            st.caption(f"Fragment rerun ({fn.__name__}): {spans[0]['ms']:.0f} ms")
+            return result
+
+        return st.fragment(traced, **kwargs)
+
+    return decorate(func) if func is not None else decorate
+
+
+def plotly_chart(fig, name: str = None, **kwargs):
+    """st.plotly_chart, timed, with the size of the figure JSON sent to the browser."""
+    import streamlit as st
+
+    if _current() is None:
+        return st.plotly_chart(fig, **kwargs)
+    title = name or (fig.layout.title.text if fig.layout.title and fig.layout.title.text else "figure")
+    with span("plotly_chart", figure=title) as s:
+        s["payload_bytes"] = len(fig.to_json())
+        return st.plotly_chart(fig, **kwargs)
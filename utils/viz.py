@@ -1,31 +1,18 @@
+import numpy as np
 import plotly.express as px
+import plotly.graph_objects as go
 
-COMMUNE_COLORS = {}
-def set_commune_colors(communes):
-    """
-    Defines the common palette for all Plotly figures.
-    It generates a {common: color} dictionary.
-    """
-    global COMMUNE_COLORS
-    palette = px.colors.qualitative.Safe
-    COMMUNE_COLORS = {
-        com: palette[i % len(palette)] for i, com in enumerate(communes)
-    }
+# Plotly-free helpers, re-exported here for the figure builders and the sections
+from utils.mapbase import (
+    commune_palette, bin_stations, bin_cells, in_viewport, image_source,
+    LOD_MAX_POINTS, LOD_POINT_ZOOM, LOD_PAD, LOD_OUTER_STEP, MAP_HEIGHT,
+)
 
-def map_chart(df):
-    fig = px.scatter_mapbox(
-        df,
-        lat="lat",
-        lon="lon",
-        color="commune_std",
-        hover_name="name_std",
-        hover_data={"commune_std": True, "capacity_std": True, "lat": False, "lon": False},
-        zoom=10,
-        height=520,
-        color_discrete_map=COMMUNE_COLORS
-    )
+
+def _map_layout(fig, zoom, center):
     fig.update_layout(
         mapbox_style="open-street-map",
+        mapbox=dict(zoom=zoom, center=center) if center else dict(zoom=zoom),
         margin=dict(l=0, r=0, t=0, b=0),
         legend=dict(
             title="Commune / Arrondissement",
@@ -41,7 +28,90 @@ def map_chart(df):
     return fig
 
 
-def bar_commune(df_commune, topn=None):
+def add_image_overlay(fig, png: bytes, bounds):
+    """Draws a north-up PNG (see utils.raster.image) over `bounds` = (min_lon, min_lat, max_lon, max_lat), under the markers."""
+    lon0, lat0, lon1, lat1 = bounds
+    fig.update_layout(mapbox_layers=[{
+        "sourcetype": "image",
+        "source": image_source(png),
+        "coordinates": [[lon0, lat1], [lon1, lat1], [lon1, lat0], [lon0, lat0]],
+        "below": "traces",
+    }])
+    return fig
+
+
+def add_focus_marker(fig, lat, lon, label):
+    """Highlights one station (e.g. a search result) on a map figure."""
+    fig.add_trace(go.Scattermapbox(
+        lat=[lat], lon=[lon], mode="markers", name=label, hovertext=[label], hoverinfo="text",
+        marker=dict(size=18, color="white", opacity=0.9),
+    ))
+    return fig
+
+
+def map_chart(df, zoom=10, center=None, colors=None):
+    fig = px.scatter_mapbox(
+        df,
+        lat="lat",
+        lon="lon",
+        color="commune_std",
+        hover_name="name_std",
+        hover_data={"commune_std": True, "capacity_std": True, "lat": False, "lon": False},
+        zoom=zoom,
+        center=center,
+        height=MAP_HEIGHT,
+        color_discrete_map=colors or {}
+    )
+    return _map_layout(fig, zoom, center)
+
+
+def map_cells_chart(cells, zoom=10, center=None, colors=None):
+    """Map of binned stations (see bin_stations): marker size follows total capacity."""
+    fig = px.scatter_mapbox(
+        cells,
+        lat="lat",
+        lon="lon",
+        color="commune_std",
+        size="capacity_total",
+        size_max=28,
+        hover_name="commune_std",
+        hover_data={"stations": True, "capacity_total": True, "lat": False, "lon": False, "commune_std": False},
+        zoom=zoom,
+        center=center,
+        height=MAP_HEIGHT,
+        color_discrete_map=colors or {}
+    )
+    return _map_layout(fig, zoom, center)
+
+
+def add_cells(fig, cells, colors=None):
+    """Adds binned stations (see bin_stations) to a station map, e.g. around the detailed area."""
+    if len(cells):
+        for cell_trace in map_cells_chart(cells, colors=colors).data:
+            fig.add_trace(cell_trace.update(showlegend=False))
+    return fig
+
+
+def map_recommendations(picks, zoom=11):
+    """Docks proposed by utils.optimize: marker size = docks added, color = new vs expanded station."""
+    fig = px.scatter_mapbox(
+        picks,
+        lat="lat",
+        lon="lon",
+        color="kind",
+        size="docks_added",
+        size_max=14,
+        hover_name="name",
+        hover_data={"commune": True, "docks_added": True, "rank": True, "kind": False, "lat": False, "lon": False},
+        zoom=zoom,
+        height=MAP_HEIGHT,
+    )
+    fig = _map_layout(fig, zoom, None)
+    fig.update_layout(legend_title_text="Recommendation")
+    return fig
+
+
+def bar_commune(df_commune, topn=None, colors=None):
     d = df_commune.copy()
     if topn:
         d = d.head(topn)
@@ -51,7 +121,7 @@ def bar_commune(df_commune, topn=None):
         y="capacity_total",
         color="commune_std",
         text_auto=".2s",
-        color_discrete_map=COMMUNE_COLORS
+        color_discrete_map=colors or {}
     )
     fig.update_layout(
         xaxis_title="Commune",
@@ -65,23 +135,100 @@ def bar_commune(df_commune, topn=None):
     return fig
 
 
-def hist_capacity(df):
-    fig = px.histogram(df, x="capacity_std", nbins=30, opacity=0.8)
+def bar_commune_capacity(df_communes, colors=None):
+    """All communes ranked by total capacity (Overview page)."""
+    fig = px.bar(
+        df_communes.sort_values("capacity_total", ascending=False),
+        x="commune_std",
+        y="capacity_total",
+        text_auto=".2s",
+        color="commune_std",
+        color_discrete_map=colors or {},
+        hover_name="commune_std",
+        hover_data={"capacity_total": True}
+    )
+
+    # Improved visual spacing for readability
+    fig.update_layout(
+        xaxis_title="Commune or arrondissement",
+        yaxis_title="Total docking capacity",
+        showlegend=False,
+        bargap=0.35,  # increased spacing for better readability
+        plot_bgcolor="rgba(0,0,0,0)",
+        paper_bgcolor="rgba(0,0,0,0)",
+        font=dict(color="white"),
+    )
+    fig.update_traces(marker_line_width=0.5, marker_line_color="rgba(255,255,255,0.3)")
+    return fig
+
+
+def hist_capacity(counts):
+    """Histogram of station capacities from per-capacity counts (see utils.cube.capacity_counts)."""
+    fig = px.histogram(counts, x="capacity", y="stations", histfunc="sum", nbins=30, opacity=0.8)
     fig.update_traces(marker_line_width=1, marker_line_color="white")
     fig.update_layout(xaxis_title="Station capacity", yaxis_title="Count", bargap=0.15)
     return fig
 
-def fig_box(df):
-    fig = px.box(
-        df,
-        x="commune_std",
-        y="capacity_std",
-        color="commune_std",
-        color_discrete_map=COMMUNE_COLORS,
-        title="Capacity distribution across communes",
-        points="all",
-    )
+def sample_stations(df, per_commune=50, seed=0):
+    """At most `per_commune` random stations of each commune (one shuffle, one grouped rank)."""
+    if df.empty:
+        return df
+    order = np.random.default_rng(seed).permutation(len(df))
+    shuffled = df.iloc[order]
+    rank = shuffled.groupby("commune_std", sort=False).cumcount().to_numpy()
+    return shuffled[rank < per_commune]
+
+
+def fig_box(stats, outliers, sample=None, colors=None):
+    """
+    Capacity box plot per commune from precomputed statistics (see utils.cube.box_stats):
+    only quartiles, whiskers and outlying capacities are sent to the browser.
+    `sample` optionally adds a capped sample of individual stations (see sample_stations).
+    """
+    colors = colors or {}
+    fig = go.Figure()
+    for row in stats.itertuples(index=False):
+        fig.add_trace(go.Box(
+            x=[row.commune_std],
+            name=row.commune_std,
+            q1=[row.q1],
+            median=[row.median],
+            q3=[row.q3],
+            lowerfence=[row.lowerfence],
+            upperfence=[row.upperfence],
+            mean=[row.mean],
+            marker_color=colors.get(row.commune_std),
+            boxpoints=False,
+        ))
+
+    if len(outliers):
+        fig.add_trace(go.Scatter(
+            x=outliers["commune_std"],
+            y=outliers["capacity"],
+            mode="markers",
+            marker=dict(
+                color=[colors.get(c, "white") for c in outliers["commune_std"]],
+                size=np.clip(4 + 2 * np.sqrt(outliers["stations"].to_numpy()), 4, 16),
+                symbol="circle-open",
+            ),
+            customdata=outliers["stations"],
+            hovertemplate="%{x}<br>Capacity %{y}: %{customdata} station(s)<extra>outliers</extra>",
+            name="Outliers",
+        ))
+
+    if sample is not None and len(sample):
+        fig.add_trace(go.Scatter(
+            x=sample["commune_std"],
+            y=sample["capacity_std"],
+            mode="markers",
+            marker=dict(color="rgba(255,255,255,0.35)", size=4),
+            text=sample["name_std"],
+            hovertemplate="%{text}<br>Capacity %{y}<extra>sample</extra>",
+            name="Sample of stations",
+        ))
+
     fig.update_layout(
+        title="Capacity distribution across communes",
         showlegend=False,
         xaxis_title="Commune or arrondissement",
         yaxis_title="Docking capacity",
@@ -92,21 +239,60 @@ def fig_box(df):
     )
     return fig
 
-def fig_pie_paris_suburbs(df):
+def fig_neighbourhood(df, radius_m, colors=None):
     """
-    Returns a pie chart showing the proportion of Velib stations in Paris vs Suburbs.
+    Station isolation vs local supply: distance to the nearest station against the docks
+    within `radius_m` (see utils.spatial). Stations at the bottom right are the gaps.
     """
-    import plotly.express as px
+    fig = px.scatter(
+        df,
+        x="nn_m",
+        y="docks_within",
+        color="commune_std",
+        hover_name="name_std",
+        hover_data={"capacity_std": True, "nn_m": ":.0f", "docks_within": True, "commune_std": False},
+        color_discrete_map=colors or {},
+        opacity=0.7,
+    )
+    fig.update_layout(
+        xaxis_title="Distance to the nearest station (m)",
+        yaxis_title=f"Docks within {radius_m:.0f} m",
+        showlegend=False,
+        plot_bgcolor="rgba(0,0,0,0)",
+        paper_bgcolor="rgba(0,0,0,0)",
+        font=dict(color="white"),
+    )
+    return fig
 
-    # Determine whether a station is in Paris or in the suburbs
-    df = df.copy()
-    df["zone"] = df["commune_std"].apply(
-        lambda x: "Paris" if "Paris" in str(x) else "Suburbs"
+def fig_trend(df, value="capacity_total", colors=None):
+    """
+    Daily stations or docks per commune from the snapshot history (see utils.history.trend).
+    Rows with commune_std "All communes" are the network total.
+    """
+    fig = px.line(
+        df,
+        x="date",
+        y=value,
+        color="commune_std",
+        color_discrete_map=colors or {},
+        markers=df["date"].nunique() < 60,
+    )
+    fig.update_layout(
+        xaxis_title="",
+        yaxis_title="Docks" if value == "capacity_total" else "Stations",
+        legend_title_text="",
+        plot_bgcolor="rgba(0,0,0,0)",
+        paper_bgcolor="rgba(0,0,0,0)",
+        font=dict(color="white"),
     )
+    return fig
 
-    # Count number of stations by zone
-    summary = df.groupby("zone", dropna=False)["id_std"].count().reset_index()
-    summary = summary.rename(columns={"id_std": "stations"})
+def fig_pie_paris_suburbs(summary):
+    """
+    Returns a pie chart showing the proportion of Velib stations in Paris vs Suburbs.
+    `summary` has one row per zone with its number of stations (see utils.cube.zone_summary).
+    """
+    import plotly.express as px
 
     # Create the pie chart
     fig = px.pie(
@@ -124,20 +310,19 @@ def fig_pie_paris_suburbs(df):
     )
     return fig
 
-def fig_pie_capacity_share(df_by_commune):
+def fig_pie_capacity_share(df_by_commune, colors=None):
     """
     Returns a pie chart showing each commune's share of total docking capacity.
     Used in the Conclusions page.
     """
     import plotly.express as px
-    from utils.viz import COMMUNE_COLORS
 
     fig = px.pie(
         df_by_commune,
         names="commune_std",
         values="capacity_total",
         color="commune_std",
-        color_discrete_map=COMMUNE_COLORS,
+        color_discrete_map=colors or {},
         title="Share of total capacity by commune",
     )
     fig.update_traces(textinfo="percent+label", pull=[0.02] * len(df_by_commune))
@@ -149,7 +334,7 @@ def fig_pie_capacity_share(df_by_commune):
     )
     return fig
 
-def fig_scatter_capacity_vs_stations(df_by_commune):
+def fig_scatter_capacity_vs_stations(df_by_commune, colors=None):
     import plotly.express as px
     fig = px.scatter(
         df_by_commune,
@@ -157,7 +342,7 @@ def fig_scatter_capacity_vs_stations(df_by_commune):
         y="capacity_total",
         color="commune_std",
         size="capacity_median",
-        color_discrete_map=COMMUNE_COLORS,
+        color_discrete_map=colors or {},
         title="Correlation between number of stations and total capacity",
     )
     fig.update_layout(